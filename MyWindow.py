@@ -1,14 +1,47 @@
+import argparse
+import copy
+import queue
+import sys
+import threading
+import time
 import tkinter as tk
+from collections import OrderedDict
 from tkinter import filedialog, messagebox, ttk
+import numpy as np
 from PIL import ImageTk, Image
-import librosa
-
-from WaterfallGenerator import WaterfallGenerator
-
-
-def is_power_of_two(x: int) -> bool:
-    # True for 1,2,4,8,... (and only for those)
-    return x > 0 and (x & (x - 1)) == 0
+from audioSource import open_audio
+from diskCache import DiskCache
+from falseColor import PALETTES
+from imageExport import is_export_path
+from liveWaterfall import PCM_FORMATS, REFERENCES, GrowingFileSource, LiveSTFT, PcmStreamSource, WaterfallRing
+from spectrogramStore import STORE_SUFFIX, SpectrogramStore
+from WaterfallGenerator import (
+    RenderCancelled,
+    RenderStats,
+    WaterfallGenerator,
+    array_to_image,
+    is_power_of_two,
+    set_palette,
+)
+
+# Edge length of the canvas tiles (screen pixels) and how many rendered tiles are kept
+TILE_SIZE = 256
+TILE_CACHE_SIZE = 256
+
+# How often the main thread polls the background worker (ms)
+JOB_POLL_MS = 50
+
+# Live mode: height of the ring-buffer waterfall (rows) and poll interval (ms)
+LIVE_ROWS = 1024
+LIVE_POLL_MS = 100
+
+# Region detail: the selected region is re-analyzed with hop_length divided
+# and n_fft multiplied by these factors, and shown at most this many pixels
+# wide/high. Shorter drags (screen pixels) are ignored.
+REGION_HOP_DIVISOR = 8
+REGION_NFFT_FACTOR = 2
+DETAIL_VIEW_SIZE = 768
+REGION_MIN_DRAG = 4
 
 
 class MyWindow(tk.Tk):
@@ -18,11 +51,39 @@ class MyWindow(tk.Tk):
 
         self.__samples = None
         self.__samplerate = None
+        self.__audio_path = None  # file the samples were loaded from
 
-        self.__waterfall = WaterfallGenerator(dynamic_db=80, bandwidth_hz=3000)
+        # Decoded audio and spectrograms persist across sessions (best effort)
+        try:
+            self.__disk_cache = DiskCache()
+        except OSError:
+            self.__disk_cache = None
+
+        self.__waterfall = WaterfallGenerator(dynamic_db=80, bandwidth_hz=3000, disk_cache=self.__disk_cache)
+
+        # Background jobs (load/render). Only the job with the current id may
+        # deliver results; starting a new job makes every older one stale.
+        self.__job_id = 0
+        self.__job_queue = queue.Queue()
+        self.__job_on_done = None
+        self.__job_on_partial = None
+        self.__job_active = False
+        self.__job_poll = None  # after() id of the pending _poll_jobs
+
+        # Whether the current job already showed a partial (progressive) result
+        self.__partial_shown = False
+
+        # Live mode: the source being followed, its dB reference, and
+        # (stop event, row queue, LiveSTFT, ring) of the running worker
+        self.__live_source = None
+        self.__live_reference = "running"
+        self.__live_description = ""
+        self.__live = None
 
         # Zoom state
         self.__pil_img_full = None
+        self.__pyramid = []  # [full image, 2x max-pooled overview, 4x, ...]
+        self.__last_stats = None  # RenderStats of the image on screen
         self.__zoom = 1.0
         self.__zoom_min = 0.1
         self.__zoom_max = 20.0
@@ -34,7 +95,13 @@ class MyWindow(tk.Tk):
 
         self.__filemenu = tk.Menu(self.__menubar, tearoff=0)
         self.__filemenu.add_command(label="Load audio file ...", command=self.onLoadAudio)
+        self.__filemenu.add_command(label="Open spectrogram store ...", command=self.onOpenStore)
         self.__filemenu.add_command(label="Save image ...", command=self.onSaveImage)
+        self.__filemenu.add_command(label="Save spectrogram store ...", command=self.onSaveStore)
+        self.__filemenu.add_separator()
+        self.__filemenu.add_command(label="Follow recording (live) ...", command=self.onFollowFile)
+        self.__filemenu.add_command(label="Stop live", command=self.stop_live)
+        self.__filemenu.add_separator()
         
         self.__filemenu.add_command(label="Exit", command=self.destroy)
         self.__menubar.add_cascade(label="File", menu=self.__filemenu)
@@ -42,6 +109,27 @@ class MyWindow(tk.Tk):
         self.__viewmenu = tk.Menu(self.__menubar, tearoff=0)
         self.__viewmenu.add_command(label="Fit to window", command=self.fit_to_window)
         self.__viewmenu.add_command(label="100%", command=self.zoom_100)
+        self.__viewmenu.add_separator()
+
+        # Images are kept palette-indexed, so switching colors only swaps palettes
+        self.__var_palette = tk.StringVar(value="screen")
+        self.__palettemenu = tk.Menu(self.__viewmenu, tearoff=0)
+        for name in PALETTES:
+            self.__palettemenu.add_radiobutton(
+                label=name.capitalize(), value=name, variable=self.__var_palette,
+                command=lambda name=name: self.set_palette(name),
+            )
+        self.__viewmenu.add_cascade(label="Palette", menu=self.__palettemenu)
+
+        # Channels are decoded once and analyzed in one batched STFT
+        self.__var_channels = tk.StringVar(value="mono")
+        self.__channelsmenu = tk.Menu(self.__viewmenu, tearoff=0)
+        for label, mode in (("Mixed to mono", "mono"), ("Side by side", "side"), ("Stacked", "stacked")):
+            self.__channelsmenu.add_radiobutton(
+                label=label, value=mode, variable=self.__var_channels,
+                command=lambda mode=mode: self.set_channels(mode),
+            )
+        self.__viewmenu.add_cascade(label="Channels", menu=self.__channelsmenu)
         self.__menubar.add_cascade(label="View", menu=self.__viewmenu)
 
         self.config(menu=self.__menubar)
@@ -161,14 +249,26 @@ class MyWindow(tk.Tk):
         self.__canvas = tk.Canvas(container, highlightthickness=0)
         self.__hbar = tk.Scrollbar(container, orient="horizontal", command=self.__canvas.xview)
         self.__vbar = tk.Scrollbar(container, orient="vertical", command=self.__canvas.yview)
-        self.__canvas.configure(xscrollcommand=self.__hbar.set, yscrollcommand=self.__vbar.set)
+        self.__canvas.configure(xscrollcommand=self._on_xscroll, yscrollcommand=self._on_yscroll)
 
         self.__hbar.pack(side="bottom", fill="x")
         self.__vbar.pack(side="right", fill="y")
         self.__canvas.pack(side="left", fill="both", expand=True)
 
-        self.__tk_img = None
-        self.__canvas_img_id = None
+        # Only tiles intersecting the visible region are rendered and placed.
+        # Rendered tiles: (zoom, tx, ty) -> PhotoImage, least recently used first
+        self.__tile_cache = OrderedDict()
+        self.__tile_items = {}  # (tx, ty) -> canvas item id of the placed tiles
+        self.__tile_refresh_pending = False
+
+        self.__canvas.bind("<Configure>", lambda _e: self._schedule_tile_refresh())
+
+        # Dragging a rectangle re-analyzes that region in a detail window
+        self.__region_start = None
+        self.__region_item = None
+        self.__canvas.bind("<ButtonPress-1>", self._on_region_press)
+        self.__canvas.bind("<B1-Motion>", self._on_region_drag)
+        self.__canvas.bind("<ButtonRelease-1>", self._on_region_release)
 
         # ---------- Status bar ----------
         status = tk.Frame(self, bd=1, relief="sunken")
@@ -288,10 +388,11 @@ class MyWindow(tk.Tk):
         self.__waterfall.hop_length = hop_length
         self.__waterfall.bandwidth_hz = bandwidth_hz
 
-        # If audio is loaded, re-render the waterfall
+        # If audio is loaded, re-render the waterfall (cancels a render in progress)
         if self.__samples is not None and self.__samplerate is not None:
             self._render_waterfall_full()
-            self.fit_to_window()
+        elif self.__live_source is not None:
+            self._restart_live()
 
         self._clear_params_dirty()
 
@@ -316,7 +417,15 @@ class MyWindow(tk.Tk):
             self.__updating_slider = False
 
     def _update_status(self, full_w: int, full_h: int, shown_w: int, shown_h: int):
-        self.__status_var.set(f"image {full_w}×{full_h} px   shown {shown_w}×{shown_h} px")
+        text = f"image {full_w}×{full_h} px   shown {shown_w}×{shown_h} px"
+        if self.__last_stats is not None:
+            text += f"   |   {self.__last_stats.summary()}"
+        self.__status_var.set(text)
+
+    def _update_status_shown(self):
+        """_update_status for the image on screen at the current zoom."""
+        full_w, full_h = self.__pil_img_full.size
+        self._update_status(full_w, full_h, max(1, int(full_w * self.__zoom)), max(1, int(full_h * self.__zoom)))
 
     # ---------- Load + render ----------
 
@@ -329,29 +438,113 @@ class MyWindow(tk.Tk):
         )
         if not file_path:
             return
+        self.load_audio(file_path)
+
+    def load_audio(self, file_path: str):
+        # Decoding and rendering run in the background; this cancels any
+        # load or render still in progress.
+        self.stop_live()
+        waterfall = copy.copy(self.__waterfall)
+        mono = self.__var_channels.get() == "mono"
+
+        def work(progress, partial):
+            # WAV/AIFF are memory-mapped and read lazily; other formats are
+            # decoded, or taken from the disk cache if opened before
+            stats = RenderStats()
+            t = time.perf_counter()
+            samples, samplerate = open_audio(file_path, waterfall.disk_cache, mono)
+            stats.lap("decode", t, samples if isinstance(samples, np.ndarray) else None)
+            progress(0, 1)  # bail out early if a newer job started while decoding
+            for pyramid in waterfall.iter_pyramids(samples, int(samplerate), progress, stats=stats, indexed=True):
+                partial((pyramid, stats))
+            return samples, samplerate, (pyramid, stats)
+
+        self.__status_var.set(f"Loading {file_path} ...")
+        self._start_job(work, lambda result: self._on_audio_loaded(result, file_path), self._show_partial_waterfall)
+
+    def _on_audio_loaded(self, result, path: str | None = None):
+        self.__samples, self.__samplerate, rendered = result
+        self.__audio_path = path
+        self.__nyquist_var.set(f"Nyquist: {int(self.__samplerate / 2)} Hz")
+
+        # If bandwidth limiting is enabled, ensure it's not above Nyquist and reflect it in the UI
+        if self.__var_bw_enabled.get():
+            try:
+                bw = float(self.__var_bandwidth.get())
+            except ValueError:
+                bw = 0.0
 
-        try:
-            self.__samples, self.__samplerate = librosa.load(file_path, sr=None)
-            self.__nyquist_var.set(f"Nyquist: {int(self.__samplerate / 2)} Hz")
+            nyquist = float(self.__samplerate) / 2.0
+            if bw > nyquist:
+                bw = nyquist
+                self.__var_bandwidth.set(str(int(nyquist)))
 
+        self._show_waterfall(rendered)
+        self._set_zoom_controls_enabled(True)
 
-            # If bandwidth limiting is enabled, ensure it's not above Nyquist and reflect it in the UI
-            if self.__var_bw_enabled.get():
-                try:
-                    bw = float(self.__var_bandwidth.get())
-                except ValueError:
-                    bw = 0.0
+    def onOpenStore(self):
+        """Show a spectrogram store written earlier; re-rendering only re-colors it."""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Spectrogram store", "*" + STORE_SUFFIX), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
 
-                nyquist = float(self.__samplerate) / 2.0
-                if bw > nyquist:
-                    bw = nyquist
-                    self.__var_bandwidth.set(str(int(nyquist)))
+        self.stop_live()
+        waterfall = copy.copy(self.__waterfall)
+
+        def work(progress):
+            stats = RenderStats()
+            t = time.perf_counter()
+            store = SpectrogramStore(file_path)
+            stats.lap("decode", t)
+            pyramid = waterfall.build_pyramid(store, store.samplerate, progress, stats=stats, indexed=True)
+            return store, store.samplerate, (pyramid, stats)
+
+        self.__status_var.set(f"Opening {file_path} ...")
+        self._start_job(work, self._on_store_loaded)
+
+    def _on_store_loaded(self, result):
+        self._on_audio_loaded(result)
+
+        # The STFT parameters are fixed by the store; show them
+        store = self.__samples
+        self.__waterfall.n_fft = store.n_fft
+        self.__waterfall.hop_length = store.hop_length
+        self.__waterfall.win_length = int(store.attrs.get("win_length", store.n_fft))
+        self.__var_n_fft.set(str(self.__waterfall.n_fft))
+        self.__var_win_length.set(str(self.__waterfall.win_length))
+        self.__var_hop_length.set(str(self.__waterfall.hop_length))
+        self._clear_params_dirty()
 
-            self._render_waterfall_full()
-            self.fit_to_window()
-            self._set_zoom_controls_enabled(True)
-        except Exception as e:
-            print(e)
+    def onSaveStore(self):
+        """Write the dB spectrogram of the loaded audio to a store file."""
+        if self.__samples is None or isinstance(self.__samples, SpectrogramStore):
+            messagebox.showinfo("Save spectrogram store", "No audio loaded.")
+            return
+        if getattr(self.__samples, "ndim", 1) == 2:
+            messagebox.showinfo(
+                "Save spectrogram store", "Stores hold one channel; choose View → Channels → Mixed to mono first."
+            )
+            return
+
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=STORE_SUFFIX,
+            filetypes=[("Spectrogram store", "*" + STORE_SUFFIX)],
+            title="Save spectrogram store",
+        )
+        if not file_path:
+            return
+
+        waterfall = copy.copy(self.__waterfall)
+        samples, samplerate = self.__samples, int(self.__samplerate)
+
+        def work(progress):
+            waterfall.write_store(samples, samplerate, file_path, progress=progress)
+            return file_path
+
+        self.__status_var.set(f"Writing {file_path} ...")
+        self._start_job(work, lambda path: self.__status_var.set(f"Saved {path}"))
 
     def onSaveImage(self):
         """Save the currently rendered waterfall image to disk."""
@@ -372,6 +565,20 @@ class MyWindow(tk.Tk):
         if not file_path:
             return
 
+        if is_export_path(file_path) and self.__samples is not None:
+            # PNG/TIFF are written strip by strip from the analysis, so images
+            # of any height can be saved without holding them in memory again
+            waterfall = copy.copy(self.__waterfall)
+            samples, samplerate = self.__samples, int(self.__samplerate)
+
+            def work(progress):
+                waterfall.export_image(samples, samplerate, file_path, progress=progress)
+                return file_path
+
+            self.__status_var.set(f"Writing {file_path} ...")
+            self._start_job(work, lambda path: self.__status_var.set(f"Saved {path}"))
+            return
+
         try:
             # Use format inferred from extension; ensure RGB for formats that do not support arbitrary modes well.
             img = self.__pil_img_full
@@ -390,10 +597,365 @@ class MyWindow(tk.Tk):
         if self.__samples is None or self.__samplerate is None:
             return
 
-        self.__pil_img_full = self.__waterfall.build_image(self.__samples, int(self.__samplerate))
+        # Render with a snapshot of the parameters; the cache is shared
+        waterfall = copy.copy(self.__waterfall)
+        samples, samplerate = self.__samples, int(self.__samplerate)
+        self.__status_var.set("Rendering ...")
+        def work(progress, partial):
+            # Coarse passes are shown as they finish; see iter_progressive
+            stats = RenderStats()
+            for pyramid in waterfall.iter_pyramids(samples, samplerate, progress, stats=stats, indexed=True):
+                partial((pyramid, stats))
+            return pyramid, stats
+
+        self._start_job(work, self._show_waterfall, self._show_partial_waterfall)
+
+    def _show_partial_waterfall(self, rendered):
+        """Show a coarse pass; the first one of a job resets the view like _show_waterfall."""
+        self._show_waterfall(rendered)
+        self._set_zoom_controls_enabled(True)
+        self.__partial_shown = True
+
+    def _show_waterfall(self, rendered):
+        pyramid, self.__last_stats = rendered
+        self.__pyramid = pyramid
+        self.__pil_img_full = pyramid[0]
+        self._clear_tiles()
+        if self.__partial_shown:
+            # Refinement of the image on screen: keep zoom and scroll position
+            self._refresh_tiles()
+            self._update_status_shown()
+            return
         self.__zoom = 1.0
         self._set_slider_from_zoom()
         self._redraw_at_current_zoom(anchor_canvas_xy=None)
+        self.fit_to_window()
+
+    def set_palette(self, name: str):
+        """Recolor the waterfall on screen; only the palettes of the images change."""
+        self.__waterfall.palette = name
+        self.__var_palette.set(name)
+        table = self.__waterfall.palette_table
+        for img in self.__pyramid:
+            set_palette(img, table)
+        self._clear_tiles()
+        self._refresh_tiles()
+
+    def set_channels(self, mode: str):
+        """
+        "mono" (downmix), "side" or "stacked": how the channels of the audio
+        are shown. Switching to or from mono reloads the file; switching the
+        layout only re-arranges the cached spectrograms.
+        """
+        self.__var_channels.set(mode)
+        if mode != "mono":
+            self.__waterfall.channel_layout = mode
+        if self.__audio_path is None:
+            return
+        multichannel = getattr(self.__samples, "ndim", 1) == 2
+        if multichannel == (mode == "mono"):
+            self.load_audio(self.__audio_path)
+        else:
+            self._render_waterfall_full()
+
+    # ---------- Region detail ----------
+
+    def _on_region_press(self, event):
+        if self.__pil_img_full is None:
+            return
+        self.__region_start = (self.__canvas.canvasx(event.x), self.__canvas.canvasy(event.y))
+        self.__region_item = self.__canvas.create_rectangle(
+            *self.__region_start, *self.__region_start, outline="white", dash=(4, 2)
+        )
+
+    def _on_region_drag(self, event):
+        if self.__region_item is not None:
+            x, y = self.__canvas.canvasx(event.x), self.__canvas.canvasy(event.y)
+            self.__canvas.coords(self.__region_item, *self.__region_start, x, y)
+
+    def _on_region_release(self, event):
+        if self.__region_item is None:
+            return
+        self.__canvas.delete(self.__region_item)
+        self.__region_item = None
+        (x0, y0), x1, y1 = self.__region_start, self.__canvas.canvasx(event.x), self.__canvas.canvasy(event.y)
+        if abs(x1 - x0) < REGION_MIN_DRAG or abs(y1 - y0) < REGION_MIN_DRAG:
+            return
+        z = self.__zoom
+        self.analyze_region(min(x0, x1) / z, min(y0, y1) / z, max(x0, x1) / z, max(y0, y1) / z)
+
+    def analyze_region(self, x0: float, y0: float, x1: float, y1: float):
+        """
+        Re-analyze the waterfall pixels x0..x1 (frequency) × y0..y1 (time) at
+        finer parameters and show them in a detail window. Only the samples
+        of the selected time range go through the STFT.
+        """
+        if self.__samples is None or isinstance(self.__samples, SpectrogramStore):
+            self.__status_var.set("Region detail needs the audio (not available for stores and live mode)")
+            return
+        if getattr(self.__samples, "ndim", 1) == 2:
+            self.__status_var.set("Region detail needs one channel (View → Channels → Mixed to mono)")
+            return
+        if self.__job_active:
+            self.__status_var.set("Busy; select the region again when rendering has finished")
+            return
+
+        waterfall = copy.copy(self.__waterfall)
+        samples, samplerate = self.__samples, int(self.__samplerate)
+        row_s, hz0, col_hz = waterfall.pixel_scale(samplerate)
+        time_s = (y0 * row_s, y1 * row_s)
+        band_hz = (max(0.0, hz0 + x0 * col_hz), min(samplerate / 2.0, hz0 + x1 * col_hz))
+        n_fft = waterfall.n_fft * REGION_NFFT_FACTOR
+        hop_length = max(1, waterfall.hop_length // REGION_HOP_DIVISOR)
+        aspect = (x1 - x0) / (y1 - y0)
+
+        def work(progress):
+            stats = RenderStats()
+            levels, extent = waterfall.render_region(
+                samples, samplerate, time_s, band_hz, n_fft=n_fft, hop_length=hop_length, progress=progress, stats=stats
+            )
+            return levels, extent, stats
+
+        self.__status_var.set("Analyzing region ...")
+        self._start_job(work, lambda result: self._show_region(result, aspect, n_fft, hop_length))
+
+    def _show_region(self, result, aspect: float, n_fft: int, hop_length: int):
+        """Detail window for a render_region result, stretched to the selection's on-screen aspect."""
+        levels, (t0, t1, f0, f1), stats = result
+        if aspect >= 1.0:
+            size = (DETAIL_VIEW_SIZE, max(1, round(DETAIL_VIEW_SIZE / aspect)))
+        else:
+            size = (max(1, round(DETAIL_VIEW_SIZE * aspect)), DETAIL_VIEW_SIZE)
+        img = array_to_image(levels, self.__waterfall.palette_table).resize(size, resample=Image.Resampling.NEAREST)
+
+        title = f"{t0:.3f}–{t1:.3f} s, {f0:.0f}–{f1:.0f} Hz"
+        window = tk.Toplevel(self)
+        window.title(f"Detail {title}")
+        photo = ImageTk.PhotoImage(img)
+        label = tk.Label(window, image=photo)
+        label.image = photo  # keep a reference
+        label.pack()
+        h, w = levels.shape
+        tk.Label(
+            window,
+            text=f"n_fft {n_fft}   hop {hop_length}   {w}×{h} px   |   {stats.summary()}",
+            anchor="w",
+        ).pack(fill="x", padx=6, pady=2)
+        self.__status_var.set(f"Region {title} analyzed")
+
+    # ---------- Live ----------
+
+    def onFollowFile(self):
+        file_path = filedialog.askopenfilename(
+            filetypes=[("WAV/AIFF recordings", "*.wav *.aiff *.aif"), ("All files", "*.*")]
+        )
+        if file_path:
+            self.follow_file(file_path)
+
+    def follow_file(self, file_path: str, reference=None):
+        """Live waterfall of a WAV/AIFF file that is still being recorded."""
+        try:
+            # start with enough history to fill the waterfall
+            source = GrowingFileSource(file_path, backlog_samples=LIVE_ROWS * self.__waterfall.hop_length)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Follow recording", str(e))
+            return
+        self.start_live(source, f"Following {file_path}", reference)
+
+    def start_live(self, source, description: str = "Live", reference=None):
+        """
+        Show a live waterfall of source (liveWaterfall.GrowingFileSource or
+        PcmStreamSource). New STFT frames are computed in a worker thread and
+        appended to a ring buffer of LIVE_ROWS rows, newest at the bottom.
+        reference is the dB reference ("running", "full_scale" or a magnitude).
+        """
+        self.stop_live()
+        self._cancel_jobs()
+        self.__samples = None
+        self.__audio_path = None
+        self.__samplerate = source.samplerate
+        self.__nyquist_var.set(f"Nyquist: {int(self.__samplerate / 2)} Hz")
+        self.__live_source = source
+        self.__live_description = description
+        if reference is not None:
+            self.__live_reference = reference
+        self._restart_live()
+        self._set_zoom_controls_enabled(True)
+
+    def stop_live(self):
+        if self.__live_source is None:
+            return
+        self._stop_live_worker()
+        self.__live_source.close()
+        self.__live_source = None
+
+    def _restart_live(self):
+        """(Re)start live processing of the current source with the current parameters."""
+        self._stop_live_worker()
+        source = self.__live_source
+        live = LiveSTFT(copy.copy(self.__waterfall), source.samplerate, self.__live_reference)
+        ring = WaterfallRing(LIVE_ROWS, live.bins)
+        stop = threading.Event()
+        rows = queue.Queue()
+
+        def run():
+            try:
+                while not stop.is_set():
+                    x = source.read_new()
+                    if len(x):
+                        new_rows = live.push(x)
+                        if len(new_rows):
+                            rows.put(new_rows)
+                    elif source.finished:
+                        break
+                    else:
+                        stop.wait(LIVE_POLL_MS / 1000.0)
+            except Exception as e:
+                rows.put(e)
+            rows.put(None)
+
+        self.__live = (stop, rows, live, ring)
+        self.__pil_img_full = None  # the first update fits the waterfall to the window
+        threading.Thread(target=run, daemon=True).start()
+        self.after(LIVE_POLL_MS, self._poll_live, stop)
+
+    def _stop_live_worker(self):
+        if self.__live is not None:
+            self.__live[0].set()
+            self.__live = None
+
+    def _poll_live(self, stop):
+        """Append the rows computed since the last poll and redraw the visible tiles."""
+        if self.__live is None or self.__live[0] is not stop:
+            return
+        _, rows, live, ring = self.__live
+
+        changed = False
+        ended = None
+        while True:
+            try:
+                item = rows.get_nowait()
+            except queue.Empty:
+                break
+            if item is None or isinstance(item, Exception):
+                ended = item
+                break
+            ring.append(item)
+            changed = True
+
+        if changed:
+            first = self.__pil_img_full is None
+            self.__pil_img_full = ring.image(self.__waterfall.palette_table)
+            self.__pyramid = [self.__pil_img_full]
+            self.__last_stats = None
+            self._clear_tiles()
+            if first:
+                self.__zoom = 1.0
+                self._set_slider_from_zoom()
+                self._redraw_at_current_zoom(anchor_canvas_xy=None)
+                self.fit_to_window()
+            else:
+                # Same size as before, newest rows at the bottom: keep zoom
+                # and scroll position
+                self._refresh_tiles()
+
+        seconds = live.frames * live.generator.hop_length / float(live.samplerate)
+        if ended is None:
+            self.__status_var.set(f"{self.__live_description}   {seconds:.1f} s")
+            self.after(LIVE_POLL_MS, self._poll_live, stop)
+        elif isinstance(ended, Exception):
+            self.__status_var.set(f"Live failed: {ended}")
+        else:
+            self.__status_var.set(f"{self.__live_description}   {seconds:.1f} s   (stream ended)")
+
+    # ---------- Background jobs ----------
+
+    def _start_job(self, work, on_done, on_partial=None):
+        """
+        Run work(progress) in a worker thread and call on_done(result) on the Tk
+        thread. Any job started earlier is cancelled: its progress callback
+        raises RenderCancelled and its result is discarded.
+
+        With on_partial, work is called as work(progress, partial) and may pass
+        intermediate results to partial(); on_partial gets the latest one on
+        the Tk thread (older ones are skipped if the UI falls behind).
+        """
+        self.__job_id += 1
+        job_id = self.__job_id
+        results = self.__job_queue
+
+        def progress(done, total):
+            if job_id != self.__job_id:
+                raise RenderCancelled()
+            results.put((job_id, "progress", (done, total)))
+
+        def partial(result):
+            if job_id != self.__job_id:
+                raise RenderCancelled()
+            results.put((job_id, "partial", result))
+
+        def run():
+            try:
+                results.put((job_id, "done", work(progress) if on_partial is None else work(progress, partial)))
+            except RenderCancelled:
+                pass
+            except Exception as e:
+                results.put((job_id, "error", e))
+
+        self.__job_on_done = on_done
+        self.__job_on_partial = on_partial
+        self.__partial_shown = False
+        threading.Thread(target=run, daemon=True).start()
+
+        if not self.__job_active:
+            self.__job_active = True
+            self.__job_poll = self.after(JOB_POLL_MS, self._poll_jobs)
+
+    def _cancel_jobs(self):
+        """Make any load or render in progress stale and stop polling for it."""
+        self.__job_id += 1
+        self.__job_active = False
+        if self.__job_poll is not None:
+            self.after_cancel(self.__job_poll)
+            self.__job_poll = None
+
+    def _poll_jobs(self):
+        """Deliver progress and results of the current job; drop stale ones."""
+        self.__job_poll = None
+        last_progress = None
+        last_partial = None
+        while self.__job_active:
+            try:
+                job_id, kind, payload = self.__job_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job_id != self.__job_id:
+                continue
+            if kind == "progress":
+                last_progress = payload
+                continue
+            if kind == "partial":
+                last_partial = payload
+                continue
+
+            self.__job_active = False
+            last_progress = None
+            last_partial = None
+            if kind == "done":
+                self.__job_on_done(payload)
+            else:
+                self.__status_var.set(f"Failed: {payload}")
+                messagebox.showerror("Rendering failed", f"{type(payload).__name__}: {payload}")
+
+        if last_partial is not None:
+            self.__job_on_partial(last_partial)
+        if last_progress is not None:
+            done, total = last_progress
+            pct = 100.0 * done / total if total else 100.0
+            self.__status_var.set(f"Rendering ... {pct:.0f}%  ({done}/{total} frames)")
+
+        if self.__job_active:
+            self.__job_poll = self.after(JOB_POLL_MS, self._poll_jobs)
 
     # ---------- Zoom / redraw ----------
 
@@ -420,15 +982,8 @@ class MyWindow(tk.Tk):
         new_w = max(1, int(full_w * self.__zoom))
         new_h = max(1, int(full_h * self.__zoom))
 
-        # Pixel-accurate zoom (no interpolation)
-        pil_zoomed = self.__pil_img_full.resize((new_w, new_h), resample=Image.Resampling.NEAREST)
-        self.__tk_img = ImageTk.PhotoImage(pil_zoomed)
-
-        if self.__canvas_img_id is None:
-            self.__canvas_img_id = self.__canvas.create_image(0, 0, anchor="nw", image=self.__tk_img)
-        else:
-            self.__canvas.itemconfigure(self.__canvas_img_id, image=self.__tk_img)
-
+        # Tiles of the previous zoom stay in the cache but leave the canvas
+        self._remove_placed_tiles()
         self.__canvas.configure(scrollregion=(0, 0, new_w, new_h))
 
         if rel_x is not None and rel_y is not None:
@@ -438,9 +993,104 @@ class MyWindow(tk.Tk):
             self.__canvas.xview_moveto(0.0)
             self.__canvas.yview_moveto(0.0)
 
+        self._refresh_tiles()
         self._update_status(full_w, full_h, new_w, new_h)
         self._set_slider_from_zoom()
 
+    # ---------- Tiles ----------
+
+    def _on_xscroll(self, first, last):
+        self.__hbar.set(first, last)
+        self._schedule_tile_refresh()
+
+    def _on_yscroll(self, first, last):
+        self.__vbar.set(first, last)
+        self._schedule_tile_refresh()
+
+    def _schedule_tile_refresh(self):
+        # Coalesce bursts of scroll/resize events into one refresh
+        if not self.__tile_refresh_pending:
+            self.__tile_refresh_pending = True
+            self.after_idle(self._refresh_tiles)
+
+    def _refresh_tiles(self):
+        """Place the tiles intersecting the visible region, drop the others."""
+        self.__tile_refresh_pending = False
+        if self.__pil_img_full is None:
+            return
+
+        full_w, full_h = self.__pil_img_full.size
+        new_w = max(1, int(full_w * self.__zoom))
+        new_h = max(1, int(full_h * self.__zoom))
+
+        x0 = max(0, int(self.__canvas.canvasx(0)))
+        y0 = max(0, int(self.__canvas.canvasy(0)))
+        x1 = min(new_w, int(self.__canvas.canvasx(self.__canvas.winfo_width())) + 1)
+        y1 = min(new_h, int(self.__canvas.canvasy(self.__canvas.winfo_height())) + 1)
+
+        visible = {
+            (tx, ty)
+            for tx in range(x0 // TILE_SIZE, (max(x0, x1 - 1)) // TILE_SIZE + 1)
+            for ty in range(y0 // TILE_SIZE, (max(y0, y1 - 1)) // TILE_SIZE + 1)
+        }
+
+        for key in [k for k in self.__tile_items if k not in visible]:
+            self.__canvas.delete(self.__tile_items.pop(key))
+
+        for tx, ty in visible:
+            if (tx, ty) in self.__tile_items:
+                continue
+            tile = self._get_tile(tx, ty, new_w, new_h)
+            self.__tile_items[(tx, ty)] = self.__canvas.create_image(
+                tx * TILE_SIZE, ty * TILE_SIZE, anchor="nw", image=tile
+            )
+
+    def _get_tile(self, tx: int, ty: int, new_w: int, new_h: int):
+        """PhotoImage for tile (tx, ty) at the current zoom, from the LRU cache if possible."""
+        key = (self.__zoom, tx, ty)
+        tile = self.__tile_cache.get(key)
+        if tile is not None:
+            self.__tile_cache.move_to_end(key)
+            return tile
+
+        # Zoomed out: sample the coarsest pyramid level that still has at least
+        # one pixel per screen pixel (level n is max-pooled by 2**n)
+        level = 0
+        while level + 1 < len(self.__pyramid) and self.__zoom * 2 ** (level + 1) <= 1.0:
+            level += 1
+        src = self.__pyramid[level]
+        f = 2.0 ** level
+
+        full_w, full_h = self.__pil_img_full.size
+        sx = full_w / new_w / f
+        sy = full_h / new_h / f
+        dx0, dy0 = tx * TILE_SIZE, ty * TILE_SIZE
+        dx1, dy1 = min(dx0 + TILE_SIZE, new_w), min(dy0 + TILE_SIZE, new_h)
+
+        # Pixel-accurate zoom (no interpolation); the box maps the tile back
+        # to the matching region of the source level
+        src_w, src_h = src.size
+        pil_tile = src.resize(
+            (dx1 - dx0, dy1 - dy0),
+            resample=Image.Resampling.NEAREST,
+            box=(dx0 * sx, dy0 * sy, min(dx1 * sx, src_w), min(dy1 * sy, src_h)),
+        )
+        tile = ImageTk.PhotoImage(pil_tile)
+
+        self.__tile_cache[key] = tile
+        while len(self.__tile_cache) > TILE_CACHE_SIZE:
+            self.__tile_cache.popitem(last=False)
+        return tile
+
+    def _remove_placed_tiles(self):
+        for item in self.__tile_items.values():
+            self.__canvas.delete(item)
+        self.__tile_items.clear()
+
+    def _clear_tiles(self):
+        self._remove_placed_tiles()
+        self.__tile_cache.clear()
+
     def _set_zoom(self, new_zoom, anchor_event):
         if self.__pil_img_full is None:
             return
@@ -574,4 +1224,24 @@ class MyWindow(tk.Tk):
 
 
 if __name__ == "__main__":
-    MyWindow().mainloop()
+    parser = argparse.ArgumentParser(description="STFT waterfall viewer")
+    parser.add_argument(
+        "--live", metavar="FILE",
+        help="follow a WAV/AIFF file that is being recorded, or '-' for raw PCM on stdin",
+    )
+    parser.add_argument("--rate", type=int, default=48000, help="sample rate of raw PCM input")
+    parser.add_argument("--channels", type=int, default=1, help="channels of raw PCM input")
+    parser.add_argument("--format", choices=sorted(PCM_FORMATS), default="s16le", help="raw PCM sample format")
+    parser.add_argument(
+        "--reference", choices=REFERENCES, default="running",
+        help="live dB reference: running peak or full-scale sine",
+    )
+    args = parser.parse_args()
+
+    window = MyWindow()
+    if args.live == "-":
+        source = PcmStreamSource(sys.stdin.buffer, args.rate, args.channels, args.format)
+        window.start_live(source, f"Live PCM from stdin ({args.rate} Hz, {args.format})", args.reference)
+    elif args.live:
+        window.follow_file(args.live, args.reference)
+    window.mainloop()
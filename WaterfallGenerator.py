@@ -1,16 +1,338 @@
 # waterfall.py
 
-import librosa
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Callable, Iterator
+
 import numpy as np
 from PIL import Image
 
-from falseColor import falseColorScreen
+import numpyStft
+from falseColor import FALSECOLORSCREEN_TABLE, SCREEN_COLORS, palette_table
+from spectrogramStore import DEFAULT_FLOOR_DB, SpectrogramStore, SpectrogramStoreWriter
+
+# Default number of STFT frames per block in the streaming path
+DEFAULT_BLOCK_FRAMES = 128
+
+
+# Overview levels are added until both image dimensions are <= this size
+PYRAMID_MIN_SIZE = 256
+
+# Progressive rendering: the first pass computes every PROGRESSIVE_STRIDE-th
+# frame, each further pass halves the stride
+PROGRESSIVE_STRIDE = 8
+
+# A cached full-rate render whose hop_length is 2, 4, ... up to this factor
+# times the current one provides every factor-th frame
+SEED_MAX_FACTOR = 8
+
+# How the channels of (channels, samples) input are arranged in the image
+CHANNEL_LAYOUTS = ("side", "stacked")
+
+
+def is_power_of_two(x: int) -> bool:
+    # True for 1,2,4,8,... (and only for those)
+    return x > 0 and (x & (x - 1)) == 0
+
+
+def max_pool2(a: np.ndarray) -> np.ndarray:
+    """2x2 max pooling of a 2-D array; an odd last row/column is pooled with itself."""
+    if a.shape[0] % 2:
+        a = np.concatenate([a, a[-1:]], axis=0)
+    if a.shape[1] % 2:
+        a = np.concatenate([a, a[:, -1:]], axis=1)
+    return np.maximum(
+        np.maximum(a[0::2, 0::2], a[1::2, 0::2]),
+        np.maximum(a[0::2, 1::2], a[1::2, 1::2]),
+    )
+
+
+def check_out(out: np.ndarray, shape: tuple, dtype=np.uint8) -> np.ndarray:
+    """Validate a caller-supplied output array: C-contiguous, writable, exactly shape and dtype."""
+    if not isinstance(out, np.ndarray):
+        raise TypeError(f"out must be a numpy array, got {type(out).__name__}")
+    if out.shape != tuple(shape) or out.dtype != np.dtype(dtype):
+        raise ValueError(f"out must have shape {tuple(shape)} and dtype {np.dtype(dtype)}, got {out.shape} {out.dtype}")
+    if not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError("out must be C-contiguous and writeable")
+    return out
+
+
+def levels_to_rgb(
+    levels: np.ndarray, out: np.ndarray | None = None, table: np.ndarray = FALSECOLORSCREEN_TABLE
+) -> np.ndarray:
+    """
+    False-color uint8 levels (time, freq) as a C-contiguous RGB array
+    (time, freq, 3), written into out if given. table is a (256, 3) palette
+    from falseColor.palette_table.
+    """
+    if out is not None:
+        check_out(out, levels.shape + (3,))
+    # levels are uint8, so they never leave the 256-entry table; "clip" skips
+    # the bounds check and lets take() write straight into out
+    return np.take(table, levels, axis=0, out=out, mode="clip")
+
+
+def array_to_image(a: np.ndarray, palette: np.ndarray | None = None) -> Image.Image:
+    """
+    PIL image of a uint8 array: levels (H, W) as mode "L", or as mode "P" with
+    a (256, 3) palette; RGB (H, W, 3) as "RGB".
+
+    Image.frombuffer reads the array memory directly, without an intermediate
+    bytes object. "L" and "P" images share the memory, so the array must not
+    be modified while the image is in use. PIL keeps RGB pixels 4 bytes wide,
+    so an RGB image is unpacked from the array once.
+    """
+    a = np.ascontiguousarray(a, dtype=np.uint8)
+    if a.ndim == 2 and palette is not None:
+        img = Image.frombuffer("P", (a.shape[1], a.shape[0]), a, "raw", "P", 0, 1)
+        set_palette(img, palette)
+        return img
+    if a.ndim == 2:
+        return Image.frombuffer("L", (a.shape[1], a.shape[0]), a, "raw", "L", 0, 1)
+    if a.ndim == 3 and a.shape[2] == 3:
+        return Image.frombuffer("RGB", (a.shape[1], a.shape[0]), a, "raw", "RGB", 0, 1)
+    raise ValueError(f"expected a (H, W) or (H, W, 3) array, got shape {a.shape}")
+
+
+def set_palette(img: Image.Image, palette) -> None:
+    """
+    Replace the palette of a "P" image in place: a (256, 3) table, a list of
+    colors or a palette name (see falseColor.palette_table). Costs O(256),
+    independent of the image size; the pixels are not touched.
+    """
+    if img.mode != "P":
+        raise ValueError(f"expected a palette (P mode) image, got mode {img.mode}")
+    table = palette if isinstance(palette, np.ndarray) else palette_table(palette)
+    img.putpalette(table.tobytes())
+
+
+# Band-limited analysis: the band edge may use at most 1/DECIMATION_MARGIN
+# of the decimated Nyquist range (room for the anti-aliasing filter)
+DECIMATION_MARGIN = 1.25
+
+# Stopband attenuation of the decimation filter
+DECIMATION_ATTENUATION_DB = 100.0
+
+# progress(frames_done, frames_total); may raise RenderCancelled to abort a render
+ProgressCallback = Callable[[int, int], None]
+
+# Structured per-render stats are logged here when enabled (log_stats, or the
+# WATERFALL_STATS_LOG=1 environment variable)
+stats_logger = logging.getLogger("waterfall.stats")
+
+# Default memory cap of the magnitude spectrogram cache
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# Parallel STFT: inputs with fewer frames than this are computed serially,
+# because process overhead would dominate
+PARALLEL_MIN_FRAMES = 256
+
+# Process pools for the parallel STFT, one per worker count, shared by all generators
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _process_pool(workers: int) -> "ProcessPoolExecutor":
+    # imported here: multiprocessing is only needed once a pool is started
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+
+@atexit.register
+def _shutdown_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+def _stft_segment_worker(
+    stft_params: dict, source: tuple, out_spec: tuple, frame_start: int, frame_stop: int, rows: slice = slice(None)
+) -> tuple:
+    """
+    Process pool task: magnitudes of the bins rows of frames [frame_start,
+    frame_stop) into the shared output array. Samples come from shared memory
+    ("shm", name, length, dtype) or are memory-mapped from the audio file
+    ("file", path), so only names and numbers cross the process boundary.
+    Returns the number of frames and their peak magnitude over all bins.
+    """
+    from multiprocessing import shared_memory
+
+    out_name, out_shape, out_dtype = out_spec
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    in_shm = None
+    try:
+        if source[0] == "shm":
+            in_shm = shared_memory.SharedMemory(name=source[1])
+            samples = np.ndarray((source[2],), dtype=source[3], buffer=in_shm.buf)
+        else:
+            from audioSource import MemmapAudio
+
+            samples = MemmapAudio(source[1])
+
+        out = np.ndarray(out_shape, dtype=out_dtype, buffer=out_shm.buf)
+        generator = WaterfallGenerator(cache_bytes=0, **stft_params)
+        peak = None
+        for f0 in range(frame_start, frame_stop, DEFAULT_BLOCK_FRAMES):
+            f1 = min(f0 + DEFAULT_BLOCK_FRAMES, frame_stop)
+            D = generator._stft_block(samples, f0, f1)
+            block = np.abs(D[rows], out=out[:, f0:f1])
+            block_peak = block.max() if rows == slice(None) else np.abs(D).max()
+            peak = block_peak if peak is None else max(peak, block_peak)
+            del D
+        del samples, out
+    finally:
+        out_shm.close()
+        if in_shm is not None:
+            in_shm.close()
+    return frame_stop - frame_start, peak
+
+
+class RenderCancelled(Exception):
+    """Raised (typically by a progress callback) to abort a render in progress."""
+
+
+class RenderStats:
+    """
+    Per-stage durations (seconds) and allocation sizes (bytes of the stage's
+    result) of one render. A stage recorded several times, e.g. once per block
+    in the streaming path, accumulates its time and keeps the largest size.
+    """
+
+    def __init__(self):
+        self.stages = {}  # name -> [seconds, nbytes], in execution order
+        self.info = {}  # extra facts about the render (cache hit, image size, ...)
+
+    def add(self, name: str, seconds: float, nbytes: int = 0) -> None:
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] = max(entry[1], int(nbytes))
+
+    def lap(self, name: str, t0: float, result=None) -> float:
+        """Record the time since t0 (and the size of result) as stage name; returns now."""
+        now = time.perf_counter()
+        self.add(name, now - t0, getattr(result, "nbytes", 0))
+        return now
+
+    @property
+    def total_s(self) -> float:
+        return sum(seconds for seconds, _ in self.stages.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "total_s": self.total_s,
+            "stages": {name: {"seconds": s, "bytes": b} for name, (s, b) in self.stages.items()},
+            **self.info,
+        }
+
+    def summary(self) -> str:
+        """One-line breakdown, e.g. 'stft 950 ms, db 20 ms, ... (total 1.10 s)'."""
+        parts = [f"{name} {seconds * 1000:.0f} ms" for name, (seconds, _) in self.stages.items()]
+        return ", ".join(parts) + f" (total {self.total_s:.2f} s)"
+
+
+class MagnitudeCache:
+    """
+    LRU cache of magnitude spectrograms (freq, time) with a memory cap in bytes.
+
+    Entries are keyed on the identity of the samples array plus the STFT
+    parameters. Only a weak reference to the samples is kept, so an entry
+    becomes invalid as soon as its audio is released. Samples must not be
+    modified in place while they are cached. The cache is thread-safe.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = int(max_bytes)
+        self.__entries = OrderedDict()  # key -> (weakref to samples, mag, peak)
+        self.__nbytes = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self.__nbytes
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, samples: np.ndarray, params: tuple):
+        """Return (mag, peak) or None."""
+        with self.__lock:
+            return self.__get(samples, params)
+
+    def put(self, samples: np.ndarray, params: tuple, mag: np.ndarray, peak) -> None:
+        with self.__lock:
+            self.__put(samples, params, mag, peak)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__nbytes = 0
+
+    def __get(self, samples, params: tuple):
+        key = (id(samples),) + params
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        ref, mag, peak = entry
+        if ref() is not samples:
+            self.__remove(key)
+            return None
+        self.__entries.move_to_end(key)
+        return mag, peak
+
+    def __put(self, samples, params: tuple, mag: np.ndarray, peak) -> None:
+        key = (id(samples),) + params
+        if key in self.__entries:
+            self.__remove(key)
+        if mag.nbytes > self.max_bytes:
+            return
+
+        # Drop entries whose audio is gone, then least recently used ones
+        for k in [k for k, (ref, _, _) in self.__entries.items() if ref() is None]:
+            self.__remove(k)
+        while self.__entries and self.__nbytes + mag.nbytes > self.max_bytes:
+            self.__remove(next(iter(self.__entries)))
+
+        self.__entries[key] = (weakref.ref(samples), mag, peak)
+        self.__nbytes += mag.nbytes
+
+    def __remove(self, key) -> None:
+        _, mag, _ = self.__entries.pop(key)
+        self.__nbytes -= mag.nbytes
 
 
 class WaterfallGenerator:
     """
     Builds a waterfall image (PIL.Image) from audio samples.
     This class has no Tkinter dependencies.
+
+    Samples can be a 1-D array or a lazily read source such as
+    audioSource.MemmapAudio (anything with len() and contiguous slicing);
+    full-rate analysis only reads the samples block by block. A
+    spectrogramStore.SpectrogramStore can be passed instead of samples: the
+    build_* methods then re-color the stored dB values without an STFT.
+
+    (channels, samples) input (e.g. MemmapAudio(path, mono=False)) renders
+    one waterfall per channel, arranged by channel_layout: "side" puts them
+    next to each other along the frequency axis, "stacked" one below the
+    other. All channels share one batched STFT per block of frames and one
+    dB reference (the peak over all channels).
+
+    The FFTs run on fft_backend, one of numpyStft.FFT_BACKENDS or "auto"
+    (see numpyStft.FftBackend), with fft_workers threads.
     """
 
     def __init__(
@@ -20,6 +342,17 @@ class WaterfallGenerator:
         win_length: int = 32768,
         hop_length: int = 4096,
         bandwidth_hz: int | None = 3000,
+        cache_bytes: int = DEFAULT_CACHE_BYTES,
+        decimate: bool = False,
+        band_hz: tuple[float, float] | None = None,
+        band_peak_reference: bool = False,
+        workers: int = 1,
+        disk_cache=None,
+        palette=SCREEN_COLORS,
+        low_memory: bool = False,
+        channel_layout: str = "side",
+        fft_backend: str = "numpy",
+        fft_workers: int = 1,
     ):
         self.dynamic_db = float(dynamic_db)
         self.n_fft = int(n_fft)
@@ -27,43 +360,1329 @@ class WaterfallGenerator:
         self.hop_length = int(hop_length)
         self.bandwidth_hz = None if bandwidth_hz is None else float(bandwidth_hz)  # None => no HF cut
 
-    def build_image(self, samples: np.ndarray, samplerate: int) -> Image.Image:
+        # Band-limited analysis: low-pass + decimate (or heterodyne band_hz to
+        # baseband) before a proportionally smaller FFT. band_hz = (f_lo, f_hi)
+        # replaces the 0..bandwidth_hz range when set.
+        self.decimate = bool(decimate)
+        self.band_hz = None if band_hz is None else (float(band_hz[0]), float(band_hz[1]))
+
+        # dB reference of band-limited analysis. By default the peak over all
+        # bins, as in the full-rate render: taken from a cached full-rate
+        # render, else found by a full-rate pass that keeps only the maximum
+        # (one block of frames at a time). band_peak_reference=True uses the
+        # peak of the analysed band instead, which skips that pass but shows a
+        # band next to a stronger signal brighter than the full-rate render.
+        self.band_peak_reference = bool(band_peak_reference)
+
+        # Magnitude spectrograms of recent renders, so that changing only
+        # dynamic_db or bandwidth_hz skips the STFT
+        self.cache = MagnitudeCache(cache_bytes)
+
+        # Optional diskCache.DiskCache: spectrograms of samples opened with
+        # audioSource.open_audio(path, disk_cache) persist across sessions
+        self.disk_cache = disk_cache
+
+        # Instrumentation: stats of the last build_* call, an optional
+        # stats_hook(RenderStats) called after each render, and opt-in
+        # structured logging to the "waterfall.stats" logger
+        self.last_stats = None
+        self.stats_hook = None
+        self.log_stats = os.environ.get("WATERFALL_STATS_LOG", "") not in ("", "0")
+
+        # Worker processes for the full-rate STFT (1 = serial). Results are
+        # identical to the serial path.
+        self.workers = max(1, int(workers))
+
+        # False colors: a list of two or more RGB colors or a name from
+        # falseColor.PALETTES. Indexed images only carry it as their palette.
+        self.palette = palette
+
+        # Low-memory mode: the full-rate STFT reads the samples as float32,
+        # returns complex64 and keeps only the displayed bins, and dB
+        # conversion and quantization run in place on one block of rows at a
+        # time. The windowed frames of each FFT call are still float64 (like
+        # librosa's), so levels are the same as in the default mode for
+        # float32 samples.
+        self.low_memory = bool(low_memory)
+
+        # Arrangement of multichannel input, one of CHANNEL_LAYOUTS
+        self.channel_layout = channel_layout
+
+        # FFT implementation and its threads; the backend (and its FFT plans)
+        # is shared by all generators with the same settings
+        self.fft_backend = fft_backend
+        self.fft_workers = max(1, int(fft_workers))
+        self._fft()
+
+    @property
+    def palette_table(self) -> np.ndarray:
+        """The palette as a (256, 3) uint8 table (cached per color list)."""
+        return palette_table(self.palette)
+
+    def build_image(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        indexed: bool = False,
+    ) -> Image.Image:
+        """
+        Render the waterfall. progress, if given, is called with (frames done,
+        frames total) while the STFT runs; raising RenderCancelled from it aborts.
+
+        Stage timings are recorded in stats (a new RenderStats unless the caller
+        passes one, e.g. with a "decode" stage already in it) and published as
+        last_stats.
+
+        indexed=True returns a palette ("P" mode) image that shares the level
+        matrix: one byte per pixel, and set_palette() recolors it without a
+        re-render.
+        """
+        stats = RenderStats() if stats is None else stats
+        if indexed:
+            levels = self.render_levels(samples, samplerate, progress, stats, publish=False)
+            img = self._image(levels, stats, self.palette_table, indexed=True)
+        else:
+            rgb = self.render_rgb(samples, samplerate, progress, stats, publish=False)
+            t = time.perf_counter()
+            img = array_to_image(rgb)
+            stats.lap("image", t, rgb)
+        self._publish_stats(stats, img.size)
+        return img
+
+    def render_levels(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        out: np.ndarray | None = None,
+        publish: bool = True,
+    ) -> np.ndarray:
+        """
+        Render the waterfall as a C-contiguous uint8 level matrix (time, freq):
+        0 is -dynamic_db or below, 255 the peak. With out (a uint8 array of
+        exactly that shape), the levels are written into it and out is returned.
+
+        progress and stats work as in build_image; publish=False leaves
+        last_stats and the stats hook to the caller.
+        """
+        stats = RenderStats() if stats is None else stats
+        levels = self._levels(samples, samplerate, progress, stats, out)
+        if publish:
+            self._publish_stats(stats, levels.shape[::-1])
+        return levels
+
+    def render_rgb(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        out: np.ndarray | None = None,
+        publish: bool = True,
+    ) -> np.ndarray:
+        """
+        Render the false-colored waterfall as a C-contiguous uint8 array
+        (time, freq, 3), written into out if given. Same pixels as build_image.
+        """
+        stats = RenderStats() if stats is None else stats
+        levels = self._levels(samples, samplerate, progress, stats)
+        t = time.perf_counter()
+        rgb = levels_to_rgb(levels, out, self.palette_table)
+        stats.lap("colormap", t, rgb)
+        if publish:
+            self._publish_stats(stats, levels.shape[::-1])
+        return rgb
+
+    def build_pyramid(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        min_size: int = PYRAMID_MIN_SIZE,
+        stats: RenderStats | None = None,
+        indexed: bool = False,
+    ) -> list[Image.Image]:
+        """
+        Render the waterfall plus overview levels. Level 0 is build_image's
+        result; each further level max-pools the previous one by 2 in time and
+        frequency, so short narrowband bursts stay visible when zoomed out.
+        Levels are added until both dimensions are <= min_size.
+
+        Pooling happens on the quantized dB levels before false coloring, which
+        gives the same result as pooling the dB values (quantization is monotonic).
+        With indexed=True all levels are palette images (see build_image).
+        """
+        stats = RenderStats() if stats is None else stats
+        levels = self._levels(samples, samplerate, progress, stats)
+        pyramid = self._pyramid(levels, stats, min_size, indexed)
+        self._publish_stats(stats, pyramid[0].size)
+        return pyramid
+
+    # ---------- Progressive ----------
+
+    def iter_progressive(
+        self,
+        samples,
+        samplerate: int,
+        stride: int = PROGRESSIVE_STRIDE,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        publish: bool = True,
+    ) -> Iterator[np.ndarray]:
+        """
+        Yield the waterfall as uint8 levels (time, freq), coarse to fine: the
+        first pass computes every stride-th frame, each further pass halves the
+        stride until all frames are done. Rows not computed yet repeat the
+        computed row above them, so every yield has the final shape; the last
+        one equals render_levels. Frames are computed once and land in the
+        magnitude cache like a normal render.
+
+        Frames of a cached render with 2, 4, ... SEED_MAX_FACTOR times the
+        hop_length are reused, so halving hop_length only computes the new
+        frames in between. A store, multichannel input, band-limited analysis
+        or a cached result is yielded once. progress counts the frames still to
+        be computed.
+        """
+        stats = RenderStats() if stats is None else stats
+        q = 1 if isinstance(samples, SpectrogramStore) else self._analysis(samplerate)[0]
+        if (
+            isinstance(samples, SpectrogramStore)
+            or self._is_multichannel(samples)
+            or q != 1
+            or stride <= 1
+            or self._cached_magnitude(samples, self._stft_params(samplerate), stats) is not None
+        ):
+            levels = self._levels(samples, samplerate, progress, stats)
+            if publish:
+                self._publish_stats(stats, levels.shape[::-1])
+            yield levels
+            return
+
+        t = time.perf_counter()
+        total = self.n_frames(len(samples))
+        seeded = self._seeded_magnitude(samples, samplerate)
+        mag, done, peak = self._empty_magnitude(samples, samplerate) if seeded is None else seeded
+        del seeded
+        rows = self._magnitude_rows(samplerate)
+        todo, counted = int(total - done.sum()), 0
+        while True:
+            frames = np.flatnonzero(~done[::stride]) * stride
+            block_peak = self._fill_frames(samples, mag, frames, progress, counted, todo, rows)
+            done[frames] = True
+            counted += len(frames)
+            if block_peak is not None:
+                peak = block_peak if peak is None else max(peak, block_peak)
+            t = stats.lap("stft", t, mag)
+            if stride == 1:
+                break
+            preview = self._levels_from_magnitude(mag[:, ::stride], peak, samplerate, stats)
+            yield np.repeat(preview, stride, axis=0)[:total]
+            stride = max(1, stride // 2)
+            t = time.perf_counter()
+
+        params = self._stft_params(samplerate)
+        self.cache.put(samples, params, mag, peak)
+        if self.disk_cache is not None:
+            self.disk_cache.put_magnitude(samples, params, mag, peak)
+        levels = self._levels_from_magnitude(mag, peak, samplerate, stats)
+        if publish:
+            self._publish_stats(stats, levels.shape[::-1])
+        yield levels
+
+    def iter_pyramids(
+        self,
+        samples,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        min_size: int = PYRAMID_MIN_SIZE,
+        stats: RenderStats | None = None,
+        indexed: bool = False,
+        stride: int = PROGRESSIVE_STRIDE,
+    ) -> Iterator[list[Image.Image]]:
+        """
+        build_pyramid for each pass of iter_progressive; the last pyramid is
+        build_pyramid's result.
+        """
+        stats = RenderStats() if stats is None else stats
+        pyramid = None
+        for levels in self.iter_progressive(samples, samplerate, stride, progress, stats, publish=False):
+            if pyramid is not None:
+                yield pyramid
+            pyramid = self._pyramid(levels, stats, min_size, indexed)
+        self._publish_stats(stats, pyramid[0].size)
+        yield pyramid
+
+    # ---------- Regions ----------
+
+    def pixel_scale(self, samplerate: int) -> tuple[float, float, float]:
+        """
+        (seconds per row, Hz of column 0, Hz per column) of the waterfall
+        rendered from samples, to map pixels to time and frequency.
+        """
+        k_lo, _ = self._bin_range(samplerate)
+        return self.hop_length / samplerate, k_lo * samplerate / self.n_fft, samplerate / self.n_fft
+
+    def render_region(
+        self,
+        samples,
+        samplerate: int,
+        time_s: tuple[float, float],
+        band_hz: tuple[float, float],
+        n_fft: int | None = None,
+        win_length: int | None = None,
+        hop_length: int | None = None,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+    ) -> tuple[np.ndarray, tuple[float, float, float, float]]:
+        """
+        Re-analyze part of a recording, typically at finer parameters than the
+        whole file (default: the generator's). Only frames centered between
+        time_s = (start, stop) seconds are computed, so only the samples under
+        them are read, and only bins inside band_hz = (f_lo, f_hi) are kept.
+
+        Returns uint8 levels (time, freq) relative to the region's own peak,
+        and (t0, t1, f0, f1): time of the first and last row and frequency of
+        the first and last column.
+        """
+        if self._is_multichannel(samples):
+            raise ValueError("render_region needs one channel; pass samples[c] for channel c")
+        n_fft = self.n_fft if n_fft is None else int(n_fft)
+        win_length = min(self.win_length, n_fft) if win_length is None else int(win_length)
+        hop_length = self.hop_length if hop_length is None else int(hop_length)
+        if win_length > n_fft or hop_length < 1:
+            raise ValueError("need win_length <= n_fft and hop_length >= 1")
+        f_lo, f_hi = float(band_hz[0]), float(band_hz[1])
+        if not 0.0 <= f_lo < f_hi <= samplerate / 2.0:
+            raise ValueError(f"band_hz must satisfy 0 <= f_lo < f_hi <= Nyquist, got {band_hz}")
+        s0 = max(0, int(round(time_s[0] * samplerate)))
+        s1 = min(len(samples), int(round(time_s[1] * samplerate)))
+        if s1 <= s0:
+            raise ValueError(f"time_s {time_s} selects no samples")
+        stats = RenderStats() if stats is None else stats
+
+        k_lo = int(np.ceil(f_lo * n_fft / samplerate))
+        k_hi = max(k_lo, int(np.floor(f_hi * n_fft / samplerate)))
+        frames = 1 + (s1 - s0 - 1) // hop_length
+        pad = n_fft // 2
+
+        t = time.perf_counter()
+        mag = None
+        for f0 in range(0, frames, DEFAULT_BLOCK_FRAMES):
+            f1 = min(f0 + DEFAULT_BLOCK_FRAMES, frames)
+            start = s0 + f0 * hop_length - pad
+            segment = self._segment(samples, start, start + (f1 - f0 - 1) * hop_length + n_fft)
+            D = numpyStft.stft(
+                segment, n_fft=n_fft, win_length=win_length, hop_length=hop_length, center=False, backend=self._fft()
+            )
+            if mag is None:
+                mag = np.empty((k_hi - k_lo + 1, frames), dtype=D.real.dtype)
+            np.abs(D[k_lo : k_hi + 1], out=mag[:, f0:f1])
+            if progress is not None:
+                progress(f1, frames)
+        t = stats.lap("stft", t, mag)
+        stats.info["fft_backend"] = repr(self._fft())
+
+        data = self._to_db(mag, mag.max())
+        t = stats.lap("db", t, data)
+        levels = self._quantize(np.swapaxes(data, 1, 0))
+        stats.lap("quantize", t, levels)
+
+        extent = (
+            s0 / samplerate,
+            (s0 + (frames - 1) * hop_length) / samplerate,
+            k_lo * samplerate / n_fft,
+            k_hi * samplerate / n_fft,
+        )
+        return levels, extent
+
+    # ---------- Streaming ----------
+
+    def n_frames(self, n_samples: int) -> int:
+        """Number of STFT frames (= waterfall rows) for a centered STFT of n_samples."""
+        pad = self.n_fft // 2
+        return 1 + (n_samples + 2 * pad - self.n_fft) // self.hop_length
+
+    def iter_db(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        floor_db: float | None = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Yield the displayed frequency range as consecutive float32 blocks of dB
+        values (time, freq), relative to the global peak and clipped to floor_db
+        (default -dynamic_db).
+
+        The audio is processed in overlapping, hop-aligned blocks of block_frames
+        frames, so peak memory is proportional to the block size, not to the length
+        of the recording. A first pass over the blocks finds the global peak, so the
+        result is identical to build_image (ref=np.max over the whole file).
+        This path always analyzes at the full sample rate (decimate is ignored).
+        progress counts the frames of both passes (total = 2 * frames).
+        """
+        if samples is None or samplerate is None:
+            raise ValueError("samples/samplerate must not be None")
+        if block_frames < 1:
+            raise ValueError("block_frames must be >= 1")
+        if self._is_multichannel(samples):
+            raise ValueError("streaming analysis takes one channel; render multichannel input with render_levels")
+
+        total = self.n_frames(len(samples))
+        stats = RenderStats() if stats is None else stats
+
+        # Pass 1: global peak magnitude
+        peak = None
+        for f0 in range(0, total, block_frames):
+            f1 = min(f0 + block_frames, total)
+            t = time.perf_counter()
+            D = self._stft_block(samples, f0, f1)
+            block_peak = np.abs(D).max()
+            stats.lap("peak", t, D)
+            del D
+            peak = block_peak if peak is None else max(peak, block_peak)
+            if progress is not None:
+                progress(f1, 2 * total)
+
+        # Pass 2: crop -> dB, block by block
+        k_lo, k_hi = self._bin_range(samplerate)
+        for f0 in range(0, total, block_frames):
+            f1 = min(f0 + block_frames, total)
+            t = time.perf_counter()
+            D = self._stft_block(samples, f0, f1)
+            mag = np.abs(D[k_lo : k_hi + 1])
+            t = stats.lap("stft", t, D)
+            del D
+            data = self._to_db(mag, peak, floor_db)
+            stats.lap("db", t, data)
+            if progress is not None:
+                progress(total + f1, 2 * total)
+            yield data.T
+
+    def iter_levels(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+    ) -> Iterator[np.ndarray]:
+        """Like iter_db, but yields blocks of uint8 levels (time, freq)."""
+        stats = RenderStats() if stats is None else stats
+        for data in self.iter_db(samples, samplerate, block_frames, progress, stats):
+            t = time.perf_counter()
+            levels = self._quantize(data)
+            stats.lap("quantize", t, levels)
+            yield levels
+
+    def iter_rows(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+    ) -> Iterator[np.ndarray]:
+        """Like iter_levels, but yields false-colored RGB blocks (time, freq, 3)."""
+        stats = RenderStats() if stats is None else stats
+        for levels in self.iter_levels(samples, samplerate, block_frames, progress, stats):
+            t = time.perf_counter()
+            rgb = levels_to_rgb(levels, table=self.palette_table)
+            stats.lap("colormap", t, rgb)
+            yield rgb
+
+    def build_image_streaming(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        indexed: bool = False,
+    ) -> Image.Image:
+        """
+        Same image as build_image, but computed with bounded working memory.
+        Only the final uint8 image (RGB, or levels with indexed=True) is held
+        in full. A store is always read block by block, so it is simply passed
+        to build_image.
+        """
+        if isinstance(samples, SpectrogramStore):
+            return self.build_image(samples, samplerate, progress, stats, indexed)
+        stats = RenderStats() if stats is None else stats
+        table = self.palette_table
+        total = self.n_frames(len(samples))
+        full = None
+        row = 0
+        for levels in self.iter_levels(samples, samplerate, block_frames, progress, stats):
+            if full is None:
+                shape = (total, levels.shape[1]) if indexed else (total, levels.shape[1], 3)
+                full = np.empty(shape, dtype=np.uint8)
+            rows = full[row : row + levels.shape[0]]
+            if indexed:
+                rows[:] = levels
+            else:
+                # color each block straight into its rows of the image
+                t = time.perf_counter()
+                block = levels_to_rgb(levels, rows, table)
+                stats.lap("colormap", t, block)
+            row += levels.shape[0]
+
+        t = time.perf_counter()
+        img = array_to_image(full, table if indexed else None)
+        stats.lap("image", t, full)
+        self._publish_stats(stats, img.size)
+        return img
+
+    def iter_level_blocks(
+        self,
+        samples,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Yield the waterfall as consecutive blocks of uint8 levels (time, freq)
+        for any input, holding as little of it as the input allows: a store is
+        read chunk by chunk, a cached (or band-limited) magnitude spectrogram
+        is converted block by block, and anything else streams like
+        iter_levels. The rows are those of build_image.
+        """
+        stats = RenderStats() if stats is None else stats
+        if isinstance(samples, SpectrogramStore):
+            for _, levels in self._iter_levels_from_store(samples, progress, stats):
+                yield levels
+            return
+
+        if self._is_multichannel(samples):
+            # The channels are arranged across the whole image; render in one piece
+            levels = self._levels(samples, samplerate, progress, stats)
+            for t0 in range(0, levels.shape[0], DEFAULT_BLOCK_FRAMES):
+                yield levels[t0 : t0 + DEFAULT_BLOCK_FRAMES]
+            return
+
+        q, _ = self._analysis(samplerate)
+        if q == 1 and self.cache.get(samples, self._stft_params(samplerate)) is None:
+            yield from self.iter_levels(samples, samplerate, progress=progress, stats=stats)
+            return
+        for data in self._iter_db_in_memory(samples, samplerate, progress, stats, None):
+            t = time.perf_counter()
+            levels = self._quantize(data)
+            stats.lap("quantize", t, levels)
+            yield levels
+
+    def export_image(
+        self,
+        samples,
+        samplerate: int,
+        path: str,
+        indexed: bool = True,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        **options,
+    ) -> tuple[int, int]:
+        """
+        Write the waterfall to a PNG or TIFF file (by suffix) block by block,
+        as the rows are produced (see iter_level_blocks and imageExport), so the
+        image never exists in memory as a whole. indexed=True writes a palette
+        image, else RGB. options go to the imageExport writer, e.g. tile=None
+        for a striped TIFF or text={...} for PNG text chunks.
+        Returns the (width, height) written.
+        """
+        from imageExport import open_image_writer
+
+        stats = RenderStats() if stats is None else stats
+        table = self.palette_table
+        if isinstance(samples, SpectrogramStore):
+            rows_hint = samples.frames
+        else:
+            rows_hint = self.n_frames(samples.shape[-1])
+            if self._is_multichannel(samples) and self.channel_layout == "stacked":
+                rows_hint *= samples.shape[0]
+        if os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+            options.setdefault("rows_hint", rows_hint)
+
+        writer = None
+        try:
+            for levels in self.iter_level_blocks(samples, samplerate, progress, stats):
+                if writer is None:
+                    writer = open_image_writer(path, levels.shape[1], table if indexed else None, **options)
+                t = time.perf_counter()
+                block = levels if indexed else levels_to_rgb(levels, table=table)
+                writer.write(block)
+                stats.lap("export", t, block)
+            if writer is None:
+                raise ValueError("nothing to export")
+            t = time.perf_counter()
+            writer.close()
+            stats.lap("export", t)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        size = (writer.width, writer.rows)
+        self._publish_stats(stats, size)
+        return size
+
+    # ---------- Spectrogram store ----------
+
+    def write_store(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        path: str,
+        dtype: str = "float16",
+        floor_db: float = DEFAULT_FLOOR_DB,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+    ) -> None:
+        """
+        Write the dB spectrogram of the displayed frequency range to a chunked
+        store file (see spectrogramStore). Values are kept down to floor_db, so
+        the store can later be re-colored with any dynamic_db <= -floor_db.
+
+        Full-rate analysis streams block by block (as iter_db); band-limited
+        analysis (decimate) computes the smaller magnitude spectrogram in memory.
+        """
+        if self._is_multichannel(samples):
+            raise ValueError("a spectrogram store holds one channel; pass samples[c] for channel c")
+        stats = RenderStats() if stats is None else stats
+        q, _ = self._analysis(samplerate)
+        if q == 1:
+            blocks = self.iter_db(samples, samplerate, progress=progress, stats=stats, floor_db=floor_db)
+        else:
+            blocks = self._iter_db_in_memory(samples, samplerate, progress, stats, floor_db)
+
+        k_lo, k_hi = self._bin_range(samplerate)
+        first_bin = max(k_lo, self._first_bin(samplerate))
+        attrs = {
+            "samplerate": int(samplerate),
+            "n_fft": self.n_fft,
+            "win_length": self.win_length,
+            "hop_length": self.hop_length,
+            "first_bin": first_bin,
+        }
+        with SpectrogramStoreWriter(path, k_hi - first_bin + 1, attrs, dtype, floor_db) as writer:
+            for data in blocks:
+                t = time.perf_counter()
+                writer.append(data)
+                stats.lap("store", t)
+
+    def _iter_db_in_memory(self, samples, samplerate: int, progress, stats: RenderStats, floor_db: float):
+        t = time.perf_counter()
+        mag, peak = self._magnitude(samples, samplerate, progress, stats)
+        t = stats.lap("stft", t, mag)
+        mag = self._crop(mag, samplerate)
+        for f0 in range(0, mag.shape[1], DEFAULT_BLOCK_FRAMES):
+            t = time.perf_counter()
+            data = self._to_db(mag[:, f0 : f0 + DEFAULT_BLOCK_FRAMES], peak, floor_db)
+            stats.lap("db", t, data)
+            yield data.T
+
+    def _levels_from_store(
+        self,
+        store: SpectrogramStore,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """
+        uint8 levels (time, freq) from a store, cropped to the displayed range.
+        The STFT parameters are the store's; n_fft etc. of this generator are ignored.
+        """
+        c0, c1 = self._store_columns(store)
+        shape = (store.frames, c1 - c0)
+        levels = np.empty(shape, dtype=np.uint8) if out is None else check_out(out, shape)
+        for _ in self._iter_levels_from_store(store, progress, stats, levels):
+            pass  # each block is quantized straight into its rows of levels
+        return levels
+
+    def _store_columns(self, store: SpectrogramStore):
+        """Columns [c0, c1) of a store inside the displayed range."""
+        k_lo, k_hi = self._bin_range(store.samplerate, store.n_fft)
+        c0 = max(0, k_lo - store.first_bin)
+        c1 = max(c0, min(store.bins, k_hi - store.first_bin + 1))
+        return c0, c1
+
+    def _iter_levels_from_store(
+        self,
+        store: SpectrogramStore,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        out: np.ndarray | None = None,
+    ):
+        """
+        Yield (first row, uint8 levels) per chunk row of a store. With out, each
+        block is written into its rows of out.
+        """
+        stats = RenderStats() if stats is None else stats
+        c0, c1 = self._store_columns(store)
+        for t0 in range(0, store.frames, store.chunk_frames):
+            t1 = min(t0 + store.chunk_frames, store.frames)
+            t = time.perf_counter()
+            data = store.read(t0, t1, c0, c1)
+            t = stats.lap("store", t, data)
+            np.maximum(data, -self.dynamic_db, out=data)
+            t = stats.lap("db", t)
+            levels = self._quantize(data, None if out is None else out[t0:t1])
+            stats.lap("quantize", t, levels)
+            if progress is not None:
+                progress(t1, store.frames)
+            yield t0, levels
+
+    # ---------- Stages ----------
+
+    def _levels(
+        self,
+        samples,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Waterfall as uint8 levels (time, freq): magnitude -> crop -> dB -> quantize."""
+        if isinstance(samples, SpectrogramStore):
+            return self._levels_from_store(samples, progress, stats, out)
         if samples is None or samplerate is None:
             raise ValueError("samples/samplerate must not be None")
+        stats = RenderStats() if stats is None else stats
+
+        # STFT -> magnitude (cached)
+        t = time.perf_counter()
+        mag, peak = self._magnitude(samples, samplerate, progress, stats)
+        stats.lap("stft", t, mag)
+        if mag.ndim == 3:
+            return self._levels_channels(mag, peak, samplerate, stats, out)
+        return self._levels_from_magnitude(mag, peak, samplerate, stats, out)
+
+    def _levels_channels(
+        self,
+        mag: np.ndarray,
+        peak,
+        samplerate: int,
+        stats: RenderStats,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Levels of a (channels, freq, time) magnitude spectrogram, arranged by channel_layout."""
+        if self.channel_layout not in CHANNEL_LAYOUTS:
+            raise ValueError(f"channel_layout must be one of {CHANNEL_LAYOUTS}, got {self.channel_layout!r}")
+        channels = [self._levels_from_magnitude(m, peak, samplerate, stats) for m in mag]
+        rows, cols = channels[0].shape
+        t = time.perf_counter()
+        if self.channel_layout == "side":
+            shape, grid = (rows, len(channels) * cols), (rows, len(channels), cols)
+        else:
+            shape, grid = (len(channels) * rows, cols), (len(channels), rows, cols)
+        levels = np.empty(shape, dtype=np.uint8) if out is None else check_out(out, shape)
+        arranged = levels.reshape(grid)
+        for c, channel in enumerate(channels):
+            if self.channel_layout == "side":
+                arranged[:, c] = channel
+            else:
+                arranged[c] = channel
+        stats.lap("channels", t, levels)
+        return levels
+
+    def _levels_from_magnitude(
+        self,
+        mag: np.ndarray,
+        peak,
+        samplerate: int,
+        stats: RenderStats,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Levels (time, freq) of a _magnitude result: crop -> dB -> quantize."""
+        # Keep the displayed frequency range, then -> dB
+        t = time.perf_counter()
+        mag = self._crop(mag, samplerate)
+        t = stats.lap("crop", t)
+        if self.low_memory:
+            return self._levels_in_place(mag, peak, stats, out)
+        data = self._to_db(mag, peak)
+        t = stats.lap("db", t, data)
 
-        # STFT -> magnitude -> dB
-        D = librosa.stft(
-            samples,
+        # (freq, time) -> (time, freq), quantize dB -> 0..255
+        if out is not None:
+            check_out(out, data.shape[::-1])
+        levels = self._quantize(np.swapaxes(data, 1, 0), out)
+        stats.lap("quantize", t, levels)
+        return levels
+
+    def _levels_in_place(
+        self,
+        mag: np.ndarray,
+        peak,
+        stats: RenderStats,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """
+        _to_db and _quantize for low_memory: DEFAULT_BLOCK_FRAMES rows at a time
+        go through one float32 (time, freq) buffer, in place, and are written
+        straight into the C-contiguous uint8 result. Same operations as the
+        default path, so float32 magnitudes give identical levels.
+        """
+        shape = mag.shape[::-1]
+        levels = np.empty(shape, dtype=np.uint8) if out is None else check_out(out, shape)
+        work = np.empty((min(DEFAULT_BLOCK_FRAMES, shape[0]), shape[1]), dtype=np.float32)
+        for t0 in range(0, shape[0], DEFAULT_BLOCK_FRAMES):
+            t = time.perf_counter()
+            block = work[: min(DEFAULT_BLOCK_FRAMES, shape[0] - t0)]
+            np.copyto(block, mag[:, t0 : t0 + len(block)].T, casting="same_kind")
+            self._to_db(block, peak, out=block)
+            t = stats.lap("db", t, work)
+            self._quantize(block, levels[t0 : t0 + len(block)], in_place=True)
+            stats.lap("quantize", t, levels)
+        return levels
+
+    def _pyramid(self, levels: np.ndarray, stats: RenderStats, min_size: int, indexed: bool) -> list[Image.Image]:
+        """Images of levels and of its max-pooled overview levels (see build_pyramid)."""
+        table = self.palette_table
+        pyramid = [self._image(levels, stats, table, indexed)]
+        t = time.perf_counter()
+        while max(levels.shape) > min_size:
+            levels = max_pool2(levels)
+            pyramid.append(self._image(levels, None, table, indexed))
+        stats.lap("pyramid", t)
+        return pyramid
+
+    @staticmethod
+    def _image(
+        levels: np.ndarray,
+        stats: RenderStats | None = None,
+        table: np.ndarray = FALSECOLORSCREEN_TABLE,
+        indexed: bool = False,
+    ) -> Image.Image:
+        """
+        False color mapping to RGB by indexing the LUT with the levels, or a
+        palette image sharing the levels (indexed=True).
+        """
+        if indexed:
+            t = time.perf_counter()
+            img = array_to_image(levels, table)
+            if stats is not None:
+                stats.lap("image", t, levels)
+            return img
+        t = time.perf_counter()
+        rgb = levels_to_rgb(levels, table=table)
+        t1 = time.perf_counter()
+        img = array_to_image(rgb)
+        if stats is not None:
+            stats.add("colormap", t1 - t, rgb.nbytes)
+            stats.lap("image", t1, rgb)
+        return img
+
+    def _publish_stats(self, stats: RenderStats, size: tuple) -> None:
+        """size is the (width, height) of the rendered waterfall."""
+        stats.info["image_size"] = list(size)
+        if "stft" in stats.stages:
+            stats.info["fft_backend"] = repr(self._fft())
+        self.last_stats = stats
+        if self.stats_hook is not None:
+            self.stats_hook(stats)
+        if self.log_stats:
+            stats_logger.info(json.dumps({"event": "waterfall_render", **stats.as_dict()}))
+
+    def _fft(self) -> numpyStft.FftBackend:
+        return numpyStft.get_backend(self.fft_backend, self.fft_workers)
+
+    def _stft_params(self, samplerate: int, hop_length: int | None = None) -> tuple:
+        """Cache key of the magnitude spectrogram (at hop_length, default the current one)."""
+        q, k_c = self._analysis(samplerate)
+        hop_length = self.hop_length if hop_length is None else hop_length
+        params = (int(samplerate), self.n_fft, self.win_length, hop_length, q, k_c)
+        if self.low_memory and q == 1:
+            params += ("float32", *self._bin_range(samplerate))
+        if self.band_peak_reference and q != 1:
+            params += ("band_peak",)
+        return params
+
+    def _magnitude_rows(self, samplerate: int) -> slice:
+        """Bins of the full-rate STFT that _magnitude keeps (only the displayed ones in low_memory mode)."""
+        if not self.low_memory:
+            return slice(None)
+        k_lo, k_hi = self._bin_range(samplerate)
+        return slice(k_lo, k_hi + 1)
+
+    def _magnitude(
+        self,
+        samples: np.ndarray,
+        samplerate: int,
+        progress: ProgressCallback | None = None,
+        stats: RenderStats | None = None,
+    ):
+        """
+        Magnitude spectrogram (freq, time) and its peak value.
+        Served from the cache if samples and STFT parameters are unchanged.
+
+        With band-limited analysis the rows are a contiguous range of bins of the
+        n_fft grid starting at _first_bin(); the peak is taken over that range.
+        In low_memory mode full-rate rows start at _first_bin() too, but the
+        peak is still that of all bins.
+        """
+        params = self._stft_params(samplerate)
+        cached = self._cached_magnitude(samples, params, stats)
+        if cached is not None:
+            if progress is not None:
+                progress(cached[0].shape[-1], cached[0].shape[-1])
+            return cached
+
+        q, k_c = self._analysis(samplerate)
+        multichannel = self._is_multichannel(samples)
+        seeded = self._seeded_magnitude(samples, samplerate) if q == 1 and not multichannel else None
+        if multichannel and q != 1:
+            # Band-limited analysis works on one channel at a time
+            data = np.asarray(samples)
+            mag = np.stack([self._decimated_magnitude(channel, samplerate, q, k_c) for channel in data])
+            del data
+        elif multichannel:
+            mag, peak = self._magnitude_blocks(samples, progress, self._magnitude_rows(samplerate))
+        elif seeded is not None:
+            # Halved hop_length: only the frames between the cached ones are new
+            mag, done, peak = seeded
+            rows = self._magnitude_rows(samplerate)
+            fill_peak = self._fill_frames(samples, mag, np.flatnonzero(~done), progress, rows=rows)
+            if fill_peak is not None:
+                peak = max(peak, fill_peak)
+        elif q == 1 and self.workers > 1 and self.n_frames(len(samples)) >= max(PARALLEL_MIN_FRAMES, self.workers):
+            mag, peak = self._magnitude_parallel(samples, progress, self._magnitude_rows(samplerate))
+        elif q == 1:
+            mag, peak = self._magnitude_blocks(samples, progress, self._magnitude_rows(samplerate))
+        else:
+            mag = self._decimated_magnitude(samples[:], samplerate, q, k_c)
+        if q != 1:
+            if progress is not None:
+                # decimated analysis runs in one piece: report completion only
+                progress(mag.shape[-1], mag.shape[-1])
+            if self.band_peak_reference:
+                peak = mag.max()
+            else:
+                # The decimated window is q times shorter, so its magnitudes are 1/q of the full-rate ones
+                peak = mag.dtype.type(self._full_band_peak(samples, samplerate) / q)
+
+        self.cache.put(samples, params, mag, peak)
+        if self.disk_cache is not None:
+            self.disk_cache.put_magnitude(samples, params, mag, peak)
+        return mag, peak
+
+    def _decimated_magnitude(self, samples: np.ndarray, samplerate: int, q: int, k_c: int | None) -> np.ndarray:
+        """
+        Magnitudes of the band-limited analysis (see _analysis) of a 1-D signal,
+        with as many frames as the full-rate STFT: the decimated signal has
+        ceil(len / q) samples, which can add one frame at the end.
+        """
+        if k_c is not None:
+            D = self._baseband_stft(samples, samplerate, q, k_c)
+        else:
+            D = numpyStft.stft(
+                self._decimated(samples, q),
+                n_fft=self.n_fft // q,
+                win_length=self.win_length // q,
+                hop_length=self.hop_length // q,
+                backend=self._fft(),
+            )
+        frames = self.n_frames(len(samples))
+        mag = np.abs(D[:, :frames])
+        del D
+        return mag
+
+    def _full_band_peak(self, samples, samplerate: int):
+        """
+        Peak over all bins of the full-rate STFT (of all channels): from a
+        cached full-rate render if there is one, else computed block by block
+        without keeping the magnitudes.
+        """
+        full_rate = (int(samplerate), self.n_fft, self.win_length, self.hop_length, 1, None)
+        for params in (full_rate, full_rate + ("float32", *self._bin_range(samplerate))):
+            cached = self.cache.get(samples, params)
+            if cached is None and self.disk_cache is not None:
+                cached = self.disk_cache.get_magnitude(samples, params)
+            if cached is not None:
+                return cached[1]
+
+        total = self.n_frames(samples.shape[-1])
+        peak = None
+        for f0 in range(0, total, DEFAULT_BLOCK_FRAMES):
+            block_peak = np.abs(self._stft_block(samples, f0, min(f0 + DEFAULT_BLOCK_FRAMES, total))).max()
+            peak = block_peak if peak is None else max(peak, block_peak)
+        return peak
+
+    @staticmethod
+    def _is_multichannel(samples) -> bool:
+        return getattr(samples, "ndim", 1) == 2
+
+    def _cached_magnitude(self, samples, params: tuple, stats: RenderStats | None = None):
+        """(mag, peak) from the memory or disk cache, or None."""
+        cached = self.cache.get(samples, params)
+        if stats is not None:
+            stats.info["cache_hit"] = cached is not None
+        if cached is None and self.disk_cache is not None:
+            cached = self.disk_cache.get_magnitude(samples, params)
+            if stats is not None:
+                stats.info["disk_cache_hit"] = cached is not None
+            if cached is not None:
+                self.cache.put(samples, params, *cached)
+        return cached
+
+    def _seeded_magnitude(self, samples, samplerate: int):
+        """
+        (mag, done, peak) to fill in for a full-rate render, if the memory cache
+        holds a render with a multiple of hop_length (2, 4, ... SEED_MAX_FACTOR):
+        its frames are the same as every factor-th frame here. They are copied
+        into an otherwise uninitialized magnitude spectrogram (freq, time),
+        done flags the valid columns and peak is their maximum. None if there
+        is no such render.
+        """
+        total = self.n_frames(len(samples))
+        factor = 2
+        while factor <= SEED_MAX_FACTOR:
+            cached = self.cache.get(samples, self._stft_params(samplerate, self.hop_length * factor))
+            if cached is not None and cached[0].shape[1] == len(range(0, total, factor)):
+                coarse, peak = cached
+                mag = np.empty((coarse.shape[0], total), dtype=coarse.dtype)
+                mag[:, ::factor] = coarse
+                done = np.zeros(total, dtype=bool)
+                done[::factor] = True
+                return mag, done, peak
+            factor *= 2
+        return None
+
+    def _empty_magnitude(self, samples, samplerate: int):
+        """(mag, done, peak) like _seeded_magnitude, with no column computed yet."""
+        total = self.n_frames(len(samples))
+        # dtype of the STFT's magnitudes
+        dtype = np.float32 if samples.dtype == np.float32 or self.low_memory else np.float64
+        n_rows = len(range(1 + self.n_fft // 2)[self._magnitude_rows(samplerate)])
+        return np.empty((n_rows, total), dtype=dtype), np.zeros(total, dtype=bool), None
+
+    def _fill_frames(
+        self,
+        samples,
+        mag: np.ndarray,
+        frames: np.ndarray,
+        progress: ProgressCallback | None = None,
+        counted: int = 0,
+        total: int | None = None,
+        rows: slice = slice(None),
+    ):
+        """
+        Compute the magnitudes of the given frames (ascending indices) into
+        their columns of mag, DEFAULT_BLOCK_FRAMES at a time, keeping the bins
+        rows. progress gets counted + frames done out of total (default:
+        len(frames)). Returns the maximum of the new frames over all bins, or
+        None if there were none.
+        """
+        total = len(frames) if total is None else total
+        peak = None
+        for b0 in range(0, len(frames), DEFAULT_BLOCK_FRAMES):
+            block = frames[b0 : b0 + DEFAULT_BLOCK_FRAMES]
+            column = np.abs(self._stft_frames(samples, block))
+            mag[:, block] = column[rows]
+            peak = column.max() if peak is None else max(peak, column.max())
+            if progress is not None:
+                progress(counted + b0 + len(block), total)
+        return peak
+
+    def _magnitude_blocks(self, samples, progress: ProgressCallback | None = None, rows: slice = slice(None)):
+        """
+        Full-rate magnitude spectrogram of the bins rows and the peak over all
+        bins, computed in blocks of frames so that only one block of complex
+        STFT values (and of samples) exists at a time. Multichannel input gives
+        (channels, freq, time), from one batched STFT per block.
+        """
+        total = self.n_frames(samples.shape[-1])
+        mag = None
+        peak = None
+        for f0 in range(0, total, DEFAULT_BLOCK_FRAMES):
+            f1 = min(f0 + DEFAULT_BLOCK_FRAMES, total)
+            D = self._stft_block(samples, f0, f1)
+            if mag is None:
+                n_rows = len(range(D.shape[-2])[rows])
+                mag = np.empty(D.shape[:-2] + (n_rows, total), dtype=D.real.dtype)
+            block = np.abs(D[..., rows, :], out=mag[..., f0:f1])
+            block_peak = block.max() if rows == slice(None) else np.abs(D).max()
+            peak = block_peak if peak is None else max(peak, block_peak)
+            if progress is not None:
+                progress(f1, total)
+        return mag, peak
+
+    def _magnitude_parallel(self, samples, progress: ProgressCallback | None = None, rows: slice = slice(None)):
+        """
+        Like _magnitude_blocks, but the frame range is split into contiguous
+        segments that worker processes compute concurrently. Each worker reads
+        the samples its segment needs (including the overlap at its edges) from
+        shared memory and writes the magnitudes of the bins rows into a shared
+        output array of that size, and reports its segment's peak over all bins.
+        """
+        from multiprocessing import shared_memory
+
+        from audioSource import MemmapAudio
+
+        total = self.n_frames(len(samples))
+        stft_params = {
+            "n_fft": self.n_fft,
+            "win_length": self.win_length,
+            "hop_length": self.hop_length,
+            "fft_backend": self.fft_backend,
+            "fft_workers": self.fft_workers,
+            "low_memory": self.low_memory,
+        }
+
+        in_shm = None
+        if isinstance(samples, MemmapAudio):
+            source = ("file", samples.path)
+            out_dtype = np.dtype(np.float32)
+        else:
+            samples = np.ascontiguousarray(samples)
+            in_shm = shared_memory.SharedMemory(create=True, size=max(1, samples.nbytes))
+            np.ndarray(samples.shape, dtype=samples.dtype, buffer=in_shm.buf)[:] = samples
+            source = ("shm", in_shm.name, len(samples), samples.dtype.str)
+            out_dtype = np.dtype(np.float64 if samples.dtype == np.float64 and not self.low_memory else np.float32)
+
+        out_shape = (len(range(1 + self.n_fft // 2)[rows]), total)
+        out_shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(out_shape)) * out_dtype.itemsize))
+        pending = set()
+        try:
+            pool = _process_pool(self.workers)
+            n_segments = min(total, 4 * self.workers)
+            bounds = [total * i // n_segments for i in range(n_segments + 1)]
+            pending = {
+                pool.submit(
+                    _stft_segment_worker, stft_params, source, (out_shm.name, out_shape, out_dtype.str), f0, f1, rows
+                )
+                for f0, f1 in zip(bounds[:-1], bounds[1:])
+                if f1 > f0
+            }
+            done_frames = 0
+            peak = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    frames, segment_peak = future.result()
+                    done_frames += frames
+                    peak = segment_peak if peak is None else max(peak, segment_peak)
+                if progress is not None:
+                    progress(done_frames, total)
+
+            # Copy out, so the shared block can be released right away
+            shared = np.ndarray(out_shape, dtype=out_dtype, buffer=out_shm.buf)
+            mag = shared.copy()
+            del shared
+        finally:
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            out_shm.close()
+            out_shm.unlink()
+            if in_shm is not None:
+                in_shm.close()
+                in_shm.unlink()
+        return mag, peak
+
+    def _analysis(self, samplerate: int):
+        """
+        Decimation factor q and, for a band of interest, the n_fft bin k_c that is
+        mixed down to 0 Hz (None for real low-pass decimation).
+
+        q is the largest power of two that keeps the displayed band inside the
+        decimated Nyquist range (with DECIMATION_MARGIN) and divides n_fft,
+        win_length and hop_length, so bin spacing and time step are unchanged.
+        """
+        if not self.decimate:
+            return 1, None
+
+        nyquist = samplerate / 2.0
+        if self.band_hz is not None:
+            f_lo, f_hi = self._checked_band(samplerate)
+            k_c = int(round((f_lo + f_hi) / 2.0 * self.n_fft / samplerate))
+            f_c = k_c * samplerate / self.n_fft
+            # complex baseband: decimated rate must cover [-half, +half]
+            half = max(f_hi - f_c, f_c - f_lo, samplerate / self.n_fft)
+            q_max = samplerate / (2.0 * half * DECIMATION_MARGIN)
+        elif self.bandwidth_hz is not None:
+            k_c = None
+            bandwidth = max(min(self.bandwidth_hz, nyquist), samplerate / self.n_fft)
+            q_max = samplerate / (2.0 * bandwidth * DECIMATION_MARGIN)
+        else:
+            return 1, None
+
+        q = 1
+        while 2 * q <= min(q_max, self.win_length, self.hop_length):
+            q *= 2
+        if q == 1 and k_c is not None:
+            k_c = None  # no gain from mixing; crop the full STFT instead
+        return q, k_c
+
+    def _checked_band(self, samplerate: int):
+        f_lo, f_hi = self.band_hz
+        if not 0.0 <= f_lo < f_hi <= samplerate / 2.0:
+            raise ValueError(f"band_hz must satisfy 0 <= f_lo < f_hi <= Nyquist, got {self.band_hz}")
+        return f_lo, f_hi
+
+    def _first_bin(self, samplerate: int) -> int:
+        """n_fft bin index of the first row returned by _magnitude."""
+        q, k_c = self._analysis(samplerate)
+        if q == 1:
+            return self._magnitude_rows(samplerate).start or 0
+        return 0 if k_c is None else k_c - (self.n_fft // q) // 2
+
+    def _crop(self, mag: np.ndarray, samplerate: int) -> np.ndarray:
+        """Rows of a _magnitude result inside the displayed range."""
+        k_lo, k_hi = self._bin_range(samplerate)
+        bin0 = self._first_bin(samplerate)
+        return mag[..., max(0, k_lo - bin0) : k_hi - bin0 + 1, :]
+
+    def _bin_range(self, samplerate: int, n_fft: int | None = None):
+        """First and last n_fft bin displayed: band_hz, or 0..bandwidth_hz."""
+        n_fft = self.n_fft if n_fft is None else n_fft
+        if self.band_hz is not None:
+            f_lo, f_hi = self._checked_band(samplerate)
+            k_lo = int(np.ceil(f_lo * n_fft / samplerate))
+            k_hi = int(np.floor(f_hi * n_fft / samplerate))
+        else:
+            k_lo = 0
+            k_hi = self._fcut(1 + n_fft // 2, samplerate)
+        return k_lo, k_hi
+
+    @staticmethod
+    def _decimated(samples: np.ndarray, q: int) -> np.ndarray:
+        """
+        Zero-phase anti-aliasing low-pass and downsampling by q, in stages of at
+        most 8. The result is flat up to 1/DECIMATION_MARGIN of the new Nyquist
+        frequency, and anything that would alias into that range is attenuated by
+        DECIMATION_ATTENUATION_DB. Early stages only have to protect this final
+        band, so they get away with short filters.
+        """
+        import scipy.signal  # only band-limited analysis needs scipy
+
+        y = samples
+        edge = 1.0 / (q * DECIMATION_MARGIN)  # passband edge, relative to the input Nyquist
+        nyquist = 1.0
+        while q > 1:
+            r = min(q, 8)
+            width = 2.0 * (nyquist / r - edge) / nyquist
+            numtaps, beta = scipy.signal.kaiserord(DECIMATION_ATTENUATION_DB, width)
+            taps = scipy.signal.firwin(numtaps | 1, 1.0 / r, window=("kaiser", beta))
+            y = scipy.signal.resample_poly(y, 1, r, window=taps)
+            y = y.astype(np.complex64 if np.iscomplexobj(y) else np.float32, copy=False)
+            nyquist /= r
+            q //= r
+        return y
+
+    def _baseband_stft(self, samples: np.ndarray, samplerate: int, q: int, k_c: int) -> np.ndarray:
+        """
+        Mix bin k_c down to 0 Hz, decimate by q and compute a complex STFT of size
+        n_fft // q. Rows are fftshifted, i.e. bins k_c - n/2 .. k_c + n/2 - 1.
+        """
+        # Oscillator phase is (n * k_c mod n_fft) / n_fft turns: exact on long
+        # files, and one table of n_fft values covers every sample.
+        table = np.exp(-2j * np.pi * np.arange(self.n_fft) / self.n_fft).astype(np.complex64)
+        phase = np.arange(len(samples), dtype=np.int64)
+        phase *= k_c
+        phase %= self.n_fft
+        mixed = table[phase]
+        del phase
+        mixed *= samples
+        lo = self._decimated(mixed, q)
+        del mixed
+
+        n_fft = self.n_fft // q
+        hop = self.hop_length // q
+        window = numpyStft.hann_window(self.win_length // q, n_fft)
+
+        padded = np.pad(lo, n_fft // 2)
+        del lo
+        frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop]
+        D = np.empty((n_fft, frames.shape[0]), dtype=np.complex64)
+        backend = self._fft()
+        for b0 in range(0, frames.shape[0], DEFAULT_BLOCK_FRAMES):
+            block = backend.fft(frames[b0 : b0 + DEFAULT_BLOCK_FRAMES], window)
+            D[:, b0 : b0 + block.shape[0]] = np.fft.fftshift(block, axes=1).T
+        return D
+
+    def _stft_block(self, samples: np.ndarray, frame_start: int, frame_stop: int) -> np.ndarray:
+        """
+        STFT frames [frame_start, frame_stop) of a centered, zero-padded STFT,
+        as (freq, time), or (channels, freq, time) for multichannel input.
+        Only the samples covered by these frames are touched.
+        """
+        pad = self.n_fft // 2
+        start = frame_start * self.hop_length - pad
+        stop = (frame_stop - 1) * self.hop_length - pad + self.n_fft
+
+        return numpyStft.stft(
+            self._segment(samples, start, stop, np.float32 if self.low_memory else None),
             n_fft=self.n_fft,
             win_length=self.win_length,
             hop_length=self.hop_length,
+            center=False,
+            backend=self._fft(),
         )
-        data = librosa.amplitude_to_db(np.abs(D), ref=np.max, top_db=self.dynamic_db)
-
-        # (freq, time) -> (time, freq)
-        data = np.swapaxes(data, 1, 0)
-        t_size, f_size = data.shape
-
-        # Optionally cut high frequencies
-        if self.bandwidth_hz is not None:
-            nyquist = samplerate / 2.0
-            bandwidth = min(float(self.bandwidth_hz), nyquist)
-
-            fcut = int((f_size - 1) * bandwidth / nyquist)
-            fcut = max(0, min(fcut, f_size - 1))
-            data = data[:, : fcut + 1]
-            t_size, f_size = data.shape
-
-        # False color mapping to RGB
-        dataRgb = bytearray(3 * f_size * t_size)
-        scale = 255.0 / self.dynamic_db
-        fc = falseColorScreen  # local reference for speed
-        i = 0
-        for pixel in data.flat:
-            value = int(pixel * scale + 255.0)
-            if value > 255:
-                value = 255
-            dataRgb[i:i+3] = fc(value)
-            i += 3
-
-        return Image.frombytes("RGB", (f_size, t_size), bytes(dataRgb))
+
+    def _stft_frames(self, samples, frames: np.ndarray) -> np.ndarray:
+        """
+        The given frames (ascending indices) of the centered STFT, as (freq,
+        len(frames)); columns equal those of _stft_block. Reads the samples
+        from the first to the last frame once.
+        """
+        starts = frames * self.hop_length - self.n_fft // 2
+        start, stop = int(starts[0]), int(starts[-1]) + self.n_fft
+        segment = self._segment(samples, start, stop, np.float32 if self.low_memory else None)
+        return numpyStft.stft_frames(segment, starts - start, self.n_fft, self.win_length, self._fft())
+
+    @staticmethod
+    def _segment(samples, start: int, stop: int, dtype=None) -> np.ndarray:
+        """
+        samples[start:stop] (samples[:, start:stop] for multichannel input)
+        with zeros outside the recording (start may be negative).
+        """
+        lo = max(0, start)
+        hi = min(samples.shape[-1], stop)
+        shape = tuple(samples.shape[:-1]) + (stop - start,)
+        segment = np.zeros(shape, dtype=samples.dtype if dtype is None else dtype)
+        if hi > lo:
+            segment[..., lo - start : hi - start] = samples[lo:hi] if len(shape) == 1 else samples[:, lo:hi]
+        return segment
+
+    def _fcut(self, f_size: int, samplerate: int) -> int:
+        """Index of the last frequency bin kept by the bandwidth limit."""
+        if self.bandwidth_hz is None:
+            return f_size - 1
+
+        nyquist = samplerate / 2.0
+        bandwidth = min(float(self.bandwidth_hz), nyquist)
+
+        fcut = int((f_size - 1) * bandwidth / nyquist)
+        return max(0, min(fcut, f_size - 1))
+
+    def _to_db(self, mag: np.ndarray, peak, floor_db: float | None = None, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        Magnitude -> dB relative to the global peak, clipped to floor_db
+        (default -dynamic_db). Equivalent to amplitude_to_db(ref=np.max,
+        top_db=dynamic_db) on the whole spectrogram (its maximum is 0 dB), but
+        also valid for parts of it. out may be mag itself.
+        """
+        data = numpyStft.amplitude_to_db(mag, peak, out=out)
+        np.maximum(data, -self.dynamic_db if floor_db is None else floor_db, out=data)
+        return data
+
+    def _quantize(self, data: np.ndarray, out: np.ndarray | None = None, in_place: bool = False) -> np.ndarray:
+        """
+        Map dB values in [-dynamic_db, 0] to uint8 levels 0..255, written into
+        out (same shape, uint8) if given. in_place=True uses data as scratch
+        space instead of a temporary.
+        Truncates like int() did in the former per-pixel loop.
+        """
+        if in_place:
+            levels = np.multiply(data, 255.0 / self.dynamic_db, out=data)
+            levels += 255.0
+        else:
+            levels = data * (255.0 / self.dynamic_db) + 255.0
+        np.clip(levels, 0.0, 255.0, out=levels)
+        if out is None:
+            return np.ascontiguousarray(levels, dtype=np.uint8)
+        np.copyto(out, levels, casting="unsafe")
+        return out
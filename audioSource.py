@@ -0,0 +1,257 @@
+# audioSource.py
+"""
+Lazy access to audio samples.
+
+Uncompressed WAV (RIFF/RF64) and AIFF/AIFC files are memory-mapped: opening
+them only parses the header, and samples are converted to float32 when a
+range is sliced. Other formats are decoded with librosa.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+
+class MemmapAudio:
+    """
+    Read-only, memory-mapped view of the samples of an uncompressed audio file.
+
+    Behaves like a 1-D float32 sample array for len() and slicing, and yields
+    the same values as librosa.load(path, sr=None): integer PCM is scaled to
+    [-1, 1) and several channels are averaged to mono. Only the sliced range is
+    read and converted.
+
+    mono=False keeps the channels: the view then behaves like a (channels,
+    samples) array and is sliced as audio[:, start:stop], like
+    librosa.load(path, sr=None, mono=False) (always 2-D here).
+
+    growing=True maps everything after the header up to the end of the file,
+    ignoring the data size in the header, for files still being recorded
+    (recorders typically write 0 or 0xFFFFFFFF there until they finish).
+    """
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, path: str, growing: bool = False, mono: bool = True):
+        self.path = path
+        self.mono = bool(mono)
+        with open(path, "rb") as f:
+            header = f.read(12)
+            if header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+                fmt = _parse_wav(f, header[:4] == b"RF64")
+            elif header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+                fmt = _parse_aiff(f, header[8:12] == b"AIFC")
+            else:
+                raise ValueError(f"{path}: not an uncompressed WAV or AIFF file")
+
+        self.samplerate, self.channels, bits, is_float, big_endian, offset, data_size = fmt
+        if self.channels < 1:
+            raise ValueError(f"{path}: invalid channel count {self.channels}")
+        sample_dtype, self.__scale = _pcm_dtype(bits, is_float, big_endian, signed8=header[:4] == b"FORM")
+        self.__packed24 = bits == 24 and not is_float
+        self.__big_endian = big_endian
+
+        # A file that is still being written may claim more data than it holds
+        frame_size = sample_dtype.itemsize * self.channels * (3 if self.__packed24 else 1)
+        file_data_size = os.path.getsize(path) - offset
+        data_size = file_data_size if growing else min(data_size, file_data_size)
+        frames = max(0, data_size // frame_size)
+
+        shape = (frames, self.channels, 3) if self.__packed24 else (frames, self.channels)
+        if frames:
+            self.__data = np.memmap(path, dtype=sample_dtype, mode="r", offset=offset, shape=shape)
+        else:
+            self.__data = np.zeros(shape, dtype=sample_dtype)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def shape(self):
+        n = self.__data.shape[0]
+        return (n,) if self.mono else (self.channels, n)
+
+    @property
+    def ndim(self) -> int:
+        return 1 if self.mono else 2
+
+    @property
+    def duration(self) -> float:
+        return self.__data.shape[0] / float(self.samplerate)
+
+    def __getitem__(self, key):
+        if not self.mono:
+            if not isinstance(key, tuple) or len(key) != 2 or key[0] not in (slice(None), Ellipsis):
+                raise TypeError("multichannel MemmapAudio only supports audio[:, start:stop]")
+            key = key[1]
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("MemmapAudio only supports contiguous slices")
+        start, stop = key.indices(self.__data.shape[0])[:2]
+        return self.read(start, stop) if self.mono else self.read(start, stop, mono=False).T
+
+    def read(self, start: int, stop: int, mono: bool = True) -> np.ndarray:
+        """Samples [start, stop) as float32, averaged to mono or as (frames, channels)."""
+        raw = self.__data[start:stop]
+        if self.__packed24:
+            b = raw.astype(np.int32)
+            if self.__big_endian:
+                b = b[..., ::-1]
+            ints = b[..., 0] | (b[..., 1] << 8) | (b[..., 2] << 16)
+            ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+            x = ints.astype(np.float32)
+        elif raw.dtype == np.uint8:
+            x = raw.astype(np.float32) - 128.0
+        else:
+            x = raw.astype(np.float32)
+
+        if self.__scale != 1.0:
+            x *= np.float32(1.0 / self.__scale)
+        if not mono:
+            return x
+        if self.channels == 1:
+            return x[:, 0]
+        return np.mean(x, axis=1)
+
+    def __array__(self, dtype=None, copy=None):
+        n = self.__data.shape[0]
+        x = self.read(0, n) if self.mono else np.ascontiguousarray(self.read(0, n, mono=False).T)
+        return x if dtype is None else x.astype(dtype, copy=False)
+
+
+def open_audio(path: str, cache=None, mono: bool = True):
+    """
+    Open an audio file for analysis. Returns (samples, samplerate), where
+    samples is a MemmapAudio for uncompressed WAV/AIFF and a decoded float32
+    array for everything else. mono=False keeps the channels as (channels,
+    samples), also for single-channel files.
+
+    With a diskCache.DiskCache, decoded samples are taken from (or added to)
+    the cache, and the samples are registered with the file's content digest
+    so that a WaterfallGenerator using the same cache finds their spectrograms.
+    Memory-mapped files are not read to hash them, so opening and rendering
+    them starts right away (see DiskCache.register_file).
+    """
+    suffix = "" if mono else "-channels"  # separate cache entries for the downmix and the channels
+    try:
+        samples = MemmapAudio(path, mono=mono)
+        if cache is not None:
+            cache.register_file(samples, path, suffix)
+        return samples, samples.samplerate
+    except ValueError:
+        pass
+
+    # The audio cache is keyed by the content digest up front
+    digest = None if cache is None else cache.digest(path) + suffix
+    cached = None if cache is None else cache.get_audio(digest)
+    if cached is not None:
+        samples, samplerate = cached
+    else:
+        import librosa
+
+        samples, samplerate = librosa.load(path, sr=None, mono=mono)
+        if not mono:
+            samples = np.atleast_2d(samples)
+        if cache is not None:
+            cache.put_audio(digest, samples, samplerate)
+
+    if cache is not None:
+        cache.register(samples, digest)
+    return samples, samplerate
+
+
+# ---------- Header parsing ----------
+
+def _pcm_dtype(bits: int, is_float: bool, big_endian: bool, signed8: bool):
+    """
+    numpy dtype and full-scale value for a PCM sample format.
+    24-bit samples are mapped as three uint8 bytes each.
+    """
+    order = ">" if big_endian else "<"
+    if is_float:
+        if bits not in (32, 64):
+            raise ValueError(f"unsupported float sample size {bits}")
+        return np.dtype(f"{order}f{bits // 8}"), 1.0
+    if bits == 8:
+        # WAV stores 8-bit samples unsigned, AIFF signed
+        return np.dtype(np.int8 if signed8 else np.uint8), 128.0
+    if bits == 16:
+        return np.dtype(f"{order}i2"), float(1 << 15)
+    if bits == 24:
+        return np.dtype(np.uint8), float(1 << 23)
+    if bits == 32:
+        return np.dtype(f"{order}i4"), float(1 << 31)
+    raise ValueError(f"unsupported sample size {bits}")
+
+
+def _chunks(f, big_endian: bool):
+    """Yield (id, size, data_offset) for the chunks following the file header."""
+    fmt = ">4sI" if big_endian else "<4sI"
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            return
+        cid, size = struct.unpack(fmt, head)
+        pos = f.tell()
+        yield cid, size, pos
+        f.seek(pos + size + (size & 1))
+
+
+def _parse_wav(f, rf64: bool):
+    fmt = None
+    ds64_data_size = None
+    for cid, size, pos in _chunks(f, big_endian=False):
+        if cid == b"ds64":
+            ds64_data_size = struct.unpack("<QQ", f.read(16))[1]
+        elif cid == b"fmt ":
+            tag, channels, samplerate, _, _, bits = struct.unpack("<HHIIHH", f.read(16))
+            if tag == 0xFFFE and size >= 40:
+                f.seek(pos + 24)
+                tag = struct.unpack("<H", f.read(2))[0]  # first bytes of the subformat GUID
+            if tag not in (1, 3):
+                raise ValueError(f"unsupported WAV format tag {tag:#x}")
+            fmt = (channels, samplerate, bits, tag == 3)
+        elif cid == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            channels, samplerate, bits, is_float = fmt
+            if rf64 and size == 0xFFFFFFFF and ds64_data_size is not None:
+                size = ds64_data_size
+            return samplerate, channels, bits, is_float, False, pos, size
+    raise ValueError("WAV file has no data chunk")
+
+
+def _extended_to_float(b: bytes) -> float:
+    """80-bit IEEE 754 extended precision (AIFF sample rate) -> float."""
+    exp, mant = struct.unpack(">HQ", b)
+    sign = -1.0 if exp & 0x8000 else 1.0
+    exp &= 0x7FFF
+    if exp == 0 and mant == 0:
+        return 0.0
+    return sign * mant * 2.0 ** (exp - 16383 - 63)
+
+
+def _parse_aiff(f, aifc: bool):
+    fmt = None
+    for cid, size, pos in _chunks(f, big_endian=True):
+        if cid == b"COMM":
+            channels, _, bits = struct.unpack(">hIh", f.read(8))
+            samplerate = _extended_to_float(f.read(10))
+            compression = f.read(4) if aifc else b"NONE"
+            if compression in (b"NONE", b"twos"):
+                big_endian, is_float = True, False
+            elif compression == b"sowt":
+                big_endian, is_float = False, False
+            elif compression in (b"fl32", b"FL32", b"fl64", b"FL64"):
+                big_endian, is_float = True, True
+            else:
+                raise ValueError(f"unsupported AIFC compression {compression!r}")
+            fmt = (channels, int(round(samplerate)), bits, is_float, big_endian)
+        elif cid == b"SSND":
+            if fmt is None:
+                raise ValueError("AIFF SSND chunk before COMM chunk")
+            channels, samplerate, bits, is_float, big_endian = fmt
+            data_offset = struct.unpack(">I", f.read(4))[0]
+            start = pos + 8 + data_offset
+            return samplerate, channels, bits, is_float, big_endian, start, size - 8 - data_offset
+    raise ValueError("AIFF file has no SSND chunk")
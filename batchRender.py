@@ -0,0 +1,338 @@
+# batchRender.py
+"""
+Headless batch rendering of waterfall images.
+
+Example:
+    python batchRender.py "recordings/*.wav" -o waterfalls --jobs 8 --n-fft 65536
+
+Each input file is rendered by a worker process and written as PNG to the
+output directory. Outputs that are newer than their input and were rendered
+with the same parameters are skipped.
+
+Inputs can also be spectrogram stores (*.wfs), which are re-colored without
+an STFT. --write-store saves a store next to each image, for re-rendering
+later with other colors or bandwidths.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from audioSource import open_audio
+from diskCache import DEFAULT_DISK_CACHE_BYTES, DiskCache
+from falseColor import PALETTES
+from numpyStft import FFT_BACKENDS, backend_available
+from spectrogramStore import DEFAULT_FLOOR_DB, STORE_DTYPES, STORE_SUFFIX, SpectrogramStore, is_store_path
+from WaterfallGenerator import CHANNEL_LAYOUTS, RenderStats, WaterfallGenerator, is_power_of_two
+
+# PNG text chunk holding the parameters an image was rendered with
+PARAMS_KEY = "waterfall-params"
+
+
+def expand_inputs(patterns):
+    """Expand files and glob patterns into a sorted list of unique file paths."""
+    paths = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if not matches and os.path.exists(pattern):
+            matches = [pattern]
+        paths.update(p for p in matches if os.path.isfile(p))
+    return sorted(paths)
+
+
+def output_path(input_path: str, out_dir: str, suffix: str = ".png") -> str:
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(out_dir, stem + suffix)
+
+
+def is_up_to_date(input_path: str, out_path: str, params: dict) -> bool:
+    """True if out_path is newer than input_path and was rendered with params."""
+    try:
+        if os.path.getmtime(out_path) < os.path.getmtime(input_path):
+            return False
+        with Image.open(out_path) as img:
+            stored = img.text.get(PARAMS_KEY)
+    except (OSError, AttributeError):
+        return False
+    return stored == json.dumps(params, sort_keys=True)
+
+
+def render_file(
+    input_path: str,
+    out_path: str,
+    params: dict,
+    streaming: bool = False,
+    log_stats: bool = False,
+    stft_workers: int = 1,
+    store: tuple | None = None,
+    cache: tuple | None = None,
+    low_memory: bool = False,
+    fft_backend: str = "numpy",
+) -> dict:
+    """
+    Render one audio file (or spectrogram store) to out_path. Runs in a worker
+    process. store = (path, dtype, floor_db) first writes a spectrogram store
+    and renders the image from it. cache = (directory, max_bytes) enables the
+    persistent disk cache. low_memory selects WaterfallGenerator's low-memory
+    mode, fft_backend its FFT backend.
+    """
+    if log_stats:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    stats = RenderStats()
+    stats.info["file"] = input_path
+    t0 = time.perf_counter()
+    disk_cache = None if cache is None else DiskCache(*cache)
+    if is_store_path(input_path):
+        samples = SpectrogramStore(input_path)
+        samplerate = samples.samplerate
+    else:
+        # channel_layout is only set when the channels are rendered separately
+        samples, samplerate = open_audio(input_path, disk_cache, mono="channel_layout" not in params)
+    t_load = time.perf_counter() - t0
+    stats.add("decode", t_load)
+    n_samples = len(samples) * samples.hop_length if isinstance(samples, SpectrogramStore) else samples.shape[-1]
+
+    generator = WaterfallGenerator(
+        workers=stft_workers, disk_cache=disk_cache, low_memory=low_memory, fft_backend=fft_backend, **params
+    )
+    generator.log_stats = generator.log_stats or log_stats
+    if store is not None and not isinstance(samples, SpectrogramStore):
+        store_path, dtype, floor_db = store
+        generator.write_store(samples, int(samplerate), store_path, dtype, floor_db, stats=stats)
+        samples = SpectrogramStore(store_path)
+
+    text = {PARAMS_KEY: json.dumps(params, sort_keys=True)}
+    if streaming:
+        # Rows go to the PNG as they are computed; the image is never held whole
+        size = generator.export_image(samples, int(samplerate), out_path, stats=stats, text=text)
+    else:
+        # Palette images: one byte per pixel in memory, and smaller PNGs
+        img = generator.build_image(samples, int(samplerate), stats=stats, indexed=True)
+        size = img.size
+
+        info = PngInfo()
+        info.add_text(PARAMS_KEY, text[PARAMS_KEY])
+
+        # Write to a temporary name first so an interrupted run never leaves a
+        # truncated image that looks up to date.
+        tmp_path = out_path + ".part"
+        img.save(tmp_path, format="PNG", pnginfo=info)
+        os.replace(tmp_path, out_path)
+
+    return {
+        "samples": n_samples,
+        "duration_s": n_samples / float(samplerate),
+        "load_s": t_load,
+        "wall_s": time.perf_counter() - t0,
+        "size": size,
+        "stats": stats.summary(),
+    }
+
+
+def _positive_power_of_two(text: str) -> int:
+    value = int(text)
+    if not is_power_of_two(value):
+        raise argparse.ArgumentTypeError(f"{value} is not a power of two")
+    return value
+
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = WaterfallGenerator()
+
+    parser = argparse.ArgumentParser(description="Render waterfall images for many audio files in parallel.")
+    parser.add_argument("inputs", nargs="+", help="audio files or glob patterns")
+    parser.add_argument("-o", "--output-dir", required=True, help="directory for the rendered images")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument(
+        "--stft-workers", type=int, default=1,
+        help="processes per file for the STFT (output is identical; useful with few, long files)",
+    )
+    parser.add_argument("--force", action="store_true", help="render even if the output is up to date")
+    parser.add_argument(
+        "--streaming", action="store_true",
+        help="use the block-wise STFT and write the PNG row by row (bounded memory)",
+    )
+    parser.add_argument(
+        "--low-memory", action="store_true",
+        help="float32 STFT, only the displayed bins, in-place dB conversion (same images, less memory)",
+    )
+    parser.add_argument(
+        "--fft-backend", choices=("auto", *FFT_BACKENDS), default="numpy",
+        help="FFT implementation (default: %(default)s); auto picks pyfftw or scipy when installed",
+    )
+    parser.add_argument(
+        "--write-store", choices=STORE_DTYPES, metavar="DTYPE",
+        help=f"also write a spectrogram store ({STORE_SUFFIX}) per file, as {'/'.join(STORE_DTYPES)}; "
+        "the image is then rendered from it",
+    )
+    parser.add_argument(
+        "--floor-db", type=float, default=DEFAULT_FLOOR_DB,
+        help="lowest dB value kept in written stores (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-dir", metavar="DIR",
+        help="persistent cache for decoded audio and spectrograms (shared by all jobs)",
+    )
+    parser.add_argument(
+        "--cache-mb", type=int, default=DEFAULT_DISK_CACHE_BYTES >> 20,
+        help="size limit of the --cache-dir cache in MiB (default: %(default)s)",
+    )
+    parser.add_argument("--stats", action="store_true", help="print the per-stage breakdown of each file")
+    parser.add_argument(
+        "--log-stats", action="store_true",
+        help="log per-stage timings as JSON lines to stderr (also: WATERFALL_STATS_LOG=1)",
+    )
+
+    parser.add_argument("--palette", choices=sorted(PALETTES), default="screen", help="false colors (default: %(default)s)")
+    parser.add_argument("--dynamic-db", type=float, default=defaults.dynamic_db)
+    parser.add_argument("--n-fft", type=_positive_power_of_two, default=defaults.n_fft)
+    parser.add_argument("--win-length", type=_positive_power_of_two, default=defaults.win_length)
+    parser.add_argument("--hop-length", type=_positive_power_of_two, default=defaults.hop_length)
+    bw = parser.add_mutually_exclusive_group()
+    bw.add_argument("--bandwidth-hz", type=float, default=defaults.bandwidth_hz)
+    bw.add_argument("--no-bandwidth-limit", action="store_true", help="keep all frequencies up to Nyquist")
+    bw.add_argument("--band", nargs=2, type=float, metavar=("F_LO", "F_HI"), help="show only this band (Hz)")
+    parser.add_argument(
+        "--channels", choices=("mono", *CHANNEL_LAYOUTS), default="mono",
+        help="mix down to mono (default), or render the channels side by side or stacked",
+    )
+    parser.add_argument(
+        "--decimate", action="store_true",
+        help="low-pass and decimate (or mix the band down) before a smaller FFT",
+    )
+    parser.add_argument(
+        "--band-peak-reference", action="store_true",
+        help="with --decimate, use the peak of the shown band as 0 dB instead of the full-band peak (faster)",
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.dynamic_db <= 0:
+        parser.error("--dynamic-db must be > 0")
+    if args.win_length > args.n_fft:
+        parser.error("--win-length must be <= --n-fft")
+    if args.jobs < 1:
+        parser.error("--jobs must be >= 1")
+    if args.stft_workers < 1:
+        parser.error("--stft-workers must be >= 1")
+    if not args.no_bandwidth_limit and args.bandwidth_hz is not None and args.bandwidth_hz < 0:
+        parser.error("--bandwidth-hz must be >= 0")
+    if args.band is not None and not 0 <= args.band[0] < args.band[1]:
+        parser.error("--band needs 0 <= F_LO < F_HI")
+    if args.floor_db >= 0:
+        parser.error("--floor-db must be < 0")
+    if args.cache_mb < 0:
+        parser.error("--cache-mb must be >= 0")
+    if args.fft_backend != "auto" and not backend_available(args.fft_backend):
+        parser.error(f"--fft-backend {args.fft_backend} is not installed")
+    if args.write_store and args.channels != "mono":
+        parser.error("--write-store needs --channels mono (stores hold one channel)")
+    cache = None if args.cache_dir is None else (args.cache_dir, args.cache_mb << 20)
+
+    params = {
+        "dynamic_db": args.dynamic_db,
+        "n_fft": args.n_fft,
+        "win_length": args.win_length,
+        "hop_length": args.hop_length,
+        "bandwidth_hz": None if args.no_bandwidth_limit else args.bandwidth_hz,
+        "decimate": args.decimate,
+        "band_peak_reference": args.band_peak_reference,
+        "band_hz": args.band,
+        "palette": args.palette,
+    }
+    if args.channels != "mono":
+        params["channel_layout"] = args.channels
+
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        print("No input files found.", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = {}
+    seen = {}
+    skipped = 0
+    for path in inputs:
+        out_path = output_path(path, args.output_dir)
+        if out_path in seen:
+            print(f"error: {path} and {seen[out_path]} would both write {out_path}", file=sys.stderr)
+            return 1
+        seen[out_path] = path
+
+        store = None
+        if args.write_store and not is_store_path(path):
+            store = (output_path(path, args.output_dir, STORE_SUFFIX), args.write_store, args.floor_db)
+
+        store_ok = store is None or (
+            os.path.exists(store[0]) and os.path.getmtime(store[0]) >= os.path.getmtime(path)
+        )
+        if not args.force and store_ok and is_up_to_date(path, out_path, params):
+            skipped += 1
+            print(f"skip    {path} (up to date)")
+            continue
+        jobs[path] = (out_path, store)
+
+    t_start = time.perf_counter()
+    total_samples = 0
+    total_audio_s = 0.0
+    failed = 0
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(jobs))) as pool:
+            futures = {
+                pool.submit(
+                    render_file, path, out_path, params, args.streaming, args.log_stats, args.stft_workers, store, cache,
+                    args.low_memory, args.fft_backend,
+                ): path
+                for path, (out_path, store) in jobs.items()
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    r = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"FAILED  {path}: {e}", file=sys.stderr)
+                    continue
+
+                total_samples += r["samples"]
+                total_audio_s += r["duration_s"]
+                w, h = r["size"]
+                print(
+                    f"ok      {path}  {w}×{h} px  {r['wall_s']:.2f} s "
+                    f"(load {r['load_s']:.2f} s)  {r['duration_s'] / r['wall_s']:.1f}× realtime  "
+                    f"{r['samples'] / r['wall_s'] / 1e6:.2f} Msamples/s"
+                )
+                if args.stats:
+                    print(f"        {r['stats']}")
+
+    wall = time.perf_counter() - t_start
+    rendered = len(jobs) - failed
+    print(
+        f"\n{rendered} rendered, {skipped} skipped, {failed} failed in {wall:.2f} s "
+        f"with {args.jobs} worker(s)"
+    )
+    if rendered and wall > 0:
+        print(
+            f"throughput: {total_audio_s / wall:.1f}× realtime, "
+            f"{total_samples / wall / 1e6:.2f} Msamples/s, {rendered / wall:.2f} files/s"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
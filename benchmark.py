@@ -0,0 +1,423 @@
+# benchmark.py
+"""
+Reproducible benchmarks for the WaterfallGenerator pipeline.
+
+Run a parameter matrix on synthetic signals and write the results as JSON:
+    python benchmark.py run -o base.json --seconds 120 --n-fft 16384 65536
+
+Compare two runs and flag regressions (exit code 1 if any):
+    python benchmark.py compare base.json new.json --threshold 0.1
+
+Time module imports and the first window in fresh interpreters:
+    python benchmark.py startup --repeat 5
+
+Check the peak memory of the default and the low-memory mode (exit code 1
+if the low-memory target is missed):
+    python benchmark.py memory --seconds 300 --max-ratio 2
+
+Time the STFT on each installed FFT backend against numpy.fft:
+    python benchmark.py fft --seconds 120 --fft-workers 4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import numpyStft
+from WaterfallGenerator import WaterfallGenerator
+
+SIGNALS = ("tone", "chirp", "noise", "mix")
+
+# Entry points whose import time the startup benchmark measures
+STARTUP_MODULES = ("WaterfallGenerator", "batchRender", "MyWindow")
+
+# Modules that should only be imported on first use
+HEAVY_MODULES = ("librosa", "numba", "scipy")
+
+# Run in a fresh interpreter: prints seconds and the heavy modules loaded
+_STARTUP_SNIPPET = """
+import sys, time
+t = time.perf_counter()
+{code}
+print(time.perf_counter() - t)
+print("heavy:" + ",".join(sorted(m for m in {heavy!r} if m in sys.modules)))
+"""
+
+
+def make_signal(kind: str, seconds: float, samplerate: int, seed: int = 0) -> np.ndarray:
+    """Deterministic float32 test signal."""
+    n = int(seconds * samplerate)
+    t = np.arange(n, dtype=np.float64) / samplerate
+    rng = np.random.default_rng(seed)
+    nyquist = samplerate / 2.0
+
+    if kind == "tone":
+        y = 0.5 * np.sin(2 * np.pi * 1000.0 * t)
+    elif kind == "chirp":
+        # linear sweep from 100 Hz to 0.9 * Nyquist over the whole signal
+        f1 = 0.9 * nyquist
+        y = 0.5 * np.sin(2 * np.pi * (100.0 * t + (f1 - 100.0) * t * t / (2.0 * max(seconds, 1e-9))))
+    elif kind == "noise":
+        y = 0.1 * rng.standard_normal(n)
+    elif kind == "mix":
+        y = (
+            0.3 * np.sin(2 * np.pi * 700.0 * t)
+            + 0.2 * np.sin(2 * np.pi * 1900.0 * t)
+            + 0.01 * rng.standard_normal(n)
+        )
+    else:
+        raise ValueError(f"unknown signal kind {kind!r}")
+    return y.astype(np.float32)
+
+
+def max_rss_bytes() -> int:
+    """Peak resident set size of this process over its whole lifetime (not of one case)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # Linux reports KiB
+
+
+def run_case(samples: np.ndarray, samplerate: int, params: dict, repeat: int) -> dict:
+    generator = WaterfallGenerator(cache_bytes=0, **params)
+
+    # Warm-up (imports, FFT setup, STFT worker processes), then the best of `repeat` timed runs
+    generator.build_image(samples if generator.workers > 1 else samples[: min(len(samples), samplerate)], samplerate)
+    walls = []
+    stage_runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        img = generator.build_image(samples, samplerate)
+        walls.append(time.perf_counter() - t0)
+        stage_runs.append({name: seconds for name, (seconds, _) in generator.last_stats.stages.items()})
+    best = int(np.argmin(walls))
+
+    tracemalloc.start()
+    generator.build_image(samples, samplerate)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "wall_s": walls[best],
+        "stages_s": {name: min(r[name] for r in stage_runs) for name in stage_runs[0]},
+        "stages_bytes": {name: nbytes for name, (_, nbytes) in generator.last_stats.stages.items()},
+        "samples_per_s": len(samples) / walls[best],
+        "tracemalloc_peak_bytes": peak,
+        "image_size": list(img.size),
+    }
+
+
+def case_key(case: dict) -> str:
+    return json.dumps({k: case[k] for k in ("signal", "seconds", "samplerate", "params")}, sort_keys=True)
+
+
+def cmd_run(args) -> int:
+    cases = []
+    for kind in args.signals:
+        samples = make_signal(kind, args.seconds, args.samplerate, args.seed)
+        for n_fft, win_length, hop_length, bandwidth, workers, backend in itertools.product(
+            args.n_fft, args.win_length, args.hop_length, args.bandwidth, args.workers, args.fft_backend
+        ):
+            if win_length > n_fft:
+                continue
+            params = {
+                "n_fft": n_fft,
+                "win_length": win_length,
+                "hop_length": hop_length,
+                "bandwidth_hz": None if bandwidth.lower() == "none" else float(bandwidth),
+            }
+            if workers > 1:
+                params["workers"] = workers
+            if backend != "numpy":
+                params["fft_backend"] = backend
+                params["fft_workers"] = args.fft_workers
+            case = {"signal": kind, "seconds": args.seconds, "samplerate": args.samplerate, "params": params}
+            case.update(run_case(samples, args.samplerate, params, args.repeat))
+            cases.append(case)
+
+            stages = "  ".join(f"{k} {v * 1000:.0f} ms" for k, v in case["stages_s"].items())
+            print(
+                f"{kind:5s} n_fft={n_fft:<6d} win={win_length:<6d} hop={hop_length:<5d} bw={bandwidth:>6s} w={workers:<2d} "
+                f"fft={backend:<6s}  {case['wall_s']:.3f} s  {case['samples_per_s'] / 1e6:.2f} Msamples/s  "
+                f"peak {case['tracemalloc_peak_bytes'] / 2**20:.0f} MiB  [{stages}]"
+            )
+
+    import PIL
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "argv": sys.argv[1:],
+            # All cases run in this process; per-case memory is tracemalloc_peak_bytes
+            "process_max_rss_bytes": max_rss_bytes(),
+        },
+        "results": cases,
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n{len(cases)} case(s) written to {args.output}")
+    return 0
+
+
+def cmd_compare(args) -> int:
+    with open(args.base) as f:
+        base = {case_key(c): c for c in json.load(f)["results"]}
+    with open(args.new) as f:
+        new = {case_key(c): c for c in json.load(f)["results"]}
+
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        b, n = base[key], new[key]
+        p = b["params"]
+        label = (
+            f"{b['signal']:5s} n_fft={p['n_fft']:<6d} win={p['win_length']:<6d} "
+            f"hop={p['hop_length']:<5d} bw={str(p['bandwidth_hz']):>6s} w={p.get('workers', 1):<2d} "
+            f"fft={p.get('fft_backend', 'numpy'):<6s}"
+        )
+        metrics = [("wall", b["wall_s"], n["wall_s"]), ("memory", b["tracemalloc_peak_bytes"], n["tracemalloc_peak_bytes"])]
+        metrics += [(f"  {s}", b["stages_s"][s], n["stages_s"].get(s, 0.0)) for s in b["stages_s"]]
+        for name, old, cur in metrics:
+            change = (cur - old) / old if old else 0.0
+            flag = change > args.threshold
+            if flag and not name.startswith("  "):
+                regressions += 1
+            if flag or args.verbose:
+                print(f"{label}  {name:10s} {old:.4g} -> {cur:.4g}  ({change:+.1%}){'  REGRESSION' if flag else ''}")
+
+    missing = len(base.keys() - new.keys())
+    if missing:
+        print(f"{missing} case(s) of the base run are missing in the new run")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%} in {len(base.keys() & new.keys())} common case(s)")
+    return 1 if regressions else 0
+
+
+def traced_peak(fn) -> int:
+    """Peak traced allocation (bytes) while fn() runs."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def memory_case(samples: np.ndarray, samplerate: int, params: dict, low_memory: bool) -> dict:
+    """
+    Peak memory of a whole render (nothing cached) and of the stages after the
+    STFT alone (magnitudes cached), relative to the uint8 level matrix.
+    """
+    generator = WaterfallGenerator(low_memory=low_memory, cache_bytes=0, **params)
+    generator.render_levels(samples[: min(len(samples), samplerate)], samplerate)  # warm-up
+    render_peak = traced_peak(lambda: generator.render_levels(samples, samplerate))
+
+    generator = WaterfallGenerator(low_memory=low_memory, **params)
+    levels = generator.render_levels(samples, samplerate)
+    levels_peak = traced_peak(lambda: generator.render_levels(samples, samplerate))
+    if not generator.last_stats.info.get("cache_hit"):
+        levels_peak = None  # magnitudes too large for the cache
+
+    return {
+        "render_peak_bytes": render_peak,
+        "levels_peak_bytes": levels_peak,
+        "levels_bytes": levels.nbytes,
+    }
+
+
+def cmd_memory(args) -> int:
+    samples = make_signal(args.signal, args.seconds, args.samplerate, args.seed)
+    params = {
+        "n_fft": args.n_fft,
+        "win_length": args.win_length,
+        "hop_length": args.hop_length,
+        "bandwidth_hz": None if args.bandwidth.lower() == "none" else float(args.bandwidth),
+    }
+    results = {}
+    for name, low_memory in (("default", False), ("low_memory", True)):
+        r = results[name] = memory_case(samples, args.samplerate, params, low_memory)
+        levels = "n/a" if r["levels_peak_bytes"] is None else f"{r['levels_peak_bytes'] / r['levels_bytes']:.2f}"
+        print(
+            f"{name:10s} render peak {r['render_peak_bytes'] / 2**20:7.1f} MiB   "
+            f"after STFT {levels} x the {r['levels_bytes'] / 2**20:.1f} MiB level matrix"
+        )
+
+    low = results["low_memory"]
+    ok = low["render_peak_bytes"] <= results["default"]["render_peak_bytes"] and (
+        low["levels_peak_bytes"] is None or low["levels_peak_bytes"] <= args.max_ratio * low["levels_bytes"]
+    )
+    print("low-memory target met" if ok else f"low-memory target missed (max ratio {args.max_ratio})")
+
+    if args.output:
+        meta = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version()}
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "params": params, "memory": results}, f, indent=2)
+        print(f"\nwritten to {args.output}")
+    return 0 if ok else 1
+
+
+def cmd_fft(args) -> int:
+    samples = make_signal(args.signal, args.seconds, args.samplerate, args.seed)
+    params = {
+        "n_fft": args.n_fft,
+        "win_length": args.win_length,
+        "hop_length": args.hop_length,
+        "bandwidth_hz": None if args.bandwidth.lower() == "none" else float(args.bandwidth),
+    }
+    results = {}
+    reference = None
+    for backend in numpyStft.FFT_BACKENDS:
+        if not numpyStft.backend_available(backend):
+            print(f"{backend:6s} not installed")
+            continue
+        backend_params = {**params, "fft_backend": backend, "fft_workers": 1 if backend == "numpy" else args.fft_workers}
+        r = results[backend] = run_case(samples, args.samplerate, backend_params, args.repeat)
+
+        levels = WaterfallGenerator(cache_bytes=0, **backend_params).render_levels(samples, args.samplerate)
+        reference = levels if reference is None else reference
+        r["max_level_diff"] = int(np.abs(levels.astype(np.int16) - reference).max())
+        r["fft_backend"] = repr(numpyStft.get_backend(backend, backend_params["fft_workers"]))
+
+        base = results["numpy"]
+        print(
+            f"{r['fft_backend']:18s} stft {r['stages_s']['stft'] * 1000:7.0f} ms  wall {r['wall_s']:.3f} s  "
+            f"speedup {base['stages_s']['stft'] / r['stages_s']['stft']:.2f}x (stft) "
+            f"{base['wall_s'] / r['wall_s']:.2f}x (wall)  max level diff {r['max_level_diff']}"
+        )
+
+    if args.output:
+        meta = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version()}
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "params": params, "fft": results}, f, indent=2)
+        print(f"\nwritten to {args.output}")
+    return 0
+
+
+def time_startup(code: str, repeat: int) -> dict:
+    """
+    Best of repeat runs of code in a fresh interpreter: time inside the
+    process, time including interpreter start, and the heavy modules loaded.
+    """
+    snippet = _STARTUP_SNIPPET.format(code=code, heavy=HEAVY_MODULES)
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", snippet], cwd=here, capture_output=True, text=True)
+        process_s = time.perf_counter() - t0
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            return {"error": lines[-1] if lines else f"exit code {proc.returncode}"}
+        seconds, heavy = proc.stdout.strip().splitlines()[-2:]
+        heavy = heavy[len("heavy:") :]
+        run = {"in_process_s": float(seconds), "process_s": process_s, "heavy_modules": heavy.split(",") if heavy else []}
+        if best is None or run["process_s"] < best["process_s"]:
+            best = run
+    return best
+
+
+def cmd_startup(args) -> int:
+    cases = {f"import {m}": f"import {m}" for m in STARTUP_MODULES}
+    # the window is mapped and drawn once; needs a display
+    cases["first window"] = "from MyWindow import MyWindow\nw = MyWindow()\nw.update()\nw.destroy()"
+
+    results = {}
+    for name, code in cases.items():
+        r = results[name] = time_startup(code, args.repeat)
+        if "error" in r:
+            print(f"{name:28s} failed: {r['error']}")
+            continue
+        heavy = ", ".join(r["heavy_modules"]) or "none"
+        print(
+            f"{name:28s} {r['in_process_s'] * 1000:7.0f} ms in process  "
+            f"{r['process_s'] * 1000:7.0f} ms with interpreter start  heavy modules: {heavy}"
+        )
+
+    if args.output:
+        meta = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version()}
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "startup": results}, f, indent=2)
+        print(f"\nwritten to {args.output}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the WaterfallGenerator pipeline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmark matrix")
+    run.add_argument("-o", "--output", default="benchmark.json", help="JSON result file")
+    run.add_argument("--signals", nargs="+", choices=SIGNALS, default=["mix"])
+    run.add_argument("--seconds", type=float, default=60.0, help="signal length")
+    run.add_argument("--samplerate", type=int, default=48000)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--repeat", type=int, default=3, help="timed runs per case (best is kept)")
+    run.add_argument("--n-fft", type=int, nargs="+", default=[65536])
+    run.add_argument("--win-length", type=int, nargs="+", default=[32768])
+    run.add_argument("--hop-length", type=int, nargs="+", default=[4096])
+    run.add_argument("--bandwidth", nargs="+", default=["3000"], help="Hz, or 'none' for no limit")
+    run.add_argument("--workers", type=int, nargs="+", default=[1], help="STFT worker processes")
+    run.add_argument("--fft-backend", nargs="+", choices=numpyStft.FFT_BACKENDS, default=["numpy"])
+    run.add_argument("--fft-workers", type=int, default=1, help="FFT threads of the scipy and pyfftw backends")
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser("compare", help="compare two result files")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.10, help="relative slowdown that counts as regression")
+    compare.add_argument("-v", "--verbose", action="store_true", help="show all metrics, not only regressions")
+    compare.set_defaults(func=cmd_compare)
+
+    startup = sub.add_parser("startup", help="time imports and the first window in fresh interpreters")
+    startup.add_argument("-o", "--output", help="also write the results as JSON")
+    startup.add_argument("--repeat", type=int, default=5, help="runs per case (best is kept)")
+    startup.set_defaults(func=cmd_startup)
+
+    memory = sub.add_parser("memory", help="peak memory of the default and the low-memory mode")
+    memory.add_argument("-o", "--output", help="also write the results as JSON")
+    memory.add_argument("--signal", choices=SIGNALS, default="mix")
+    memory.add_argument("--seconds", type=float, default=120.0, help="signal length")
+    memory.add_argument("--samplerate", type=int, default=48000)
+    memory.add_argument("--seed", type=int, default=0)
+    memory.add_argument("--n-fft", type=int, default=65536)
+    memory.add_argument("--win-length", type=int, default=32768)
+    memory.add_argument("--hop-length", type=int, default=4096)
+    memory.add_argument("--bandwidth", default="3000", help="Hz, or 'none' for no limit")
+    memory.add_argument(
+        "--max-ratio", type=float, default=2.0,
+        help="low-memory peak after the STFT, in multiples of the level matrix",
+    )
+    memory.set_defaults(func=cmd_memory)
+
+    fft = sub.add_parser("fft", help="STFT time on each installed FFT backend")
+    fft.add_argument("-o", "--output", help="also write the results as JSON")
+    fft.add_argument("--signal", choices=SIGNALS, default="mix")
+    fft.add_argument("--seconds", type=float, default=60.0, help="signal length")
+    fft.add_argument("--samplerate", type=int, default=48000)
+    fft.add_argument("--seed", type=int, default=0)
+    fft.add_argument("--repeat", type=int, default=3, help="timed runs per backend (best is kept)")
+    fft.add_argument("--n-fft", type=int, default=65536)
+    fft.add_argument("--win-length", type=int, default=32768)
+    fft.add_argument("--hop-length", type=int, default=4096)
+    fft.add_argument("--bandwidth", default="3000", help="Hz, or 'none' for no limit")
+    fft.add_argument("--fft-workers", type=int, default=os.cpu_count() or 1, help="FFT threads of scipy and pyfftw")
+    fft.set_defaults(func=cmd_fft)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
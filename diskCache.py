@@ -0,0 +1,317 @@
+# diskCache.py
+"""
+Persistent, content-addressed cache for decoded audio, magnitude
+spectrograms and image tiles.
+
+Entries are keyed by a SHA-256 hash of the audio file's content plus the
+analysis parameters, so renamed or copied files still hit and edited files
+miss. Each entry is a .npy array (opened memory-mapped) plus a small JSON
+file written after it, which marks the entry as complete. Files are written
+under temporary names and moved into place atomically, so several processes
+can share one cache directory without locking. Once the total size exceeds
+max_bytes, the least recently used entries (by file mtime, refreshed on
+every hit) are deleted.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+# Bump when the meaning of cached data changes, to invalidate old entries
+CACHE_VERSION = 2
+
+DEFAULT_DISK_CACHE_BYTES = 4 * 1024**3
+
+# Temporary files older than this are leftovers of crashed writers
+STALE_TMP_S = 3600.0
+
+# Tiles are small and written often; the directory is scanned for eviction
+# only after this many of them
+TILE_EVICT_INTERVAL = 64
+
+
+def default_cache_dir() -> str:
+    """$WATERFALL_CACHE_DIR, else the user's cache directory."""
+    path = os.environ.get("WATERFALL_CACHE_DIR")
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "stft-waterfall")
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of the file content, as hex."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Cache directory shared by all processes of a user.
+
+    register() associates a samples object with the digest of the file it
+    came from; get/put_magnitude look spectrograms up by that digest, so
+    WaterfallGenerator can use the cache for any samples opened through
+    audioSource.open_audio(path, cache). register_file() does the same for
+    a file that has not been hashed yet, without reading it.
+    """
+
+    def __init__(self, root: str | None = None, max_bytes: int = DEFAULT_DISK_CACHE_BYTES):
+        self.root = default_cache_dir() if root is None else root
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.root, exist_ok=True)
+        # id(samples) -> (weakref to samples, digest or None, (path, stamp, suffix) or None)
+        self.__sources = {}
+        self.__lock = threading.Lock()
+        self.__hash_lock = threading.Lock()  # one file hashed at a time, so none twice
+        self.__tile_puts = 0
+
+    # ---------- Content keys ----------
+
+    def digest(self, path: str) -> str:
+        """
+        Content digest of a file. Remembered per (path, size, mtime), so an
+        unchanged file is only hashed once.
+        """
+        digest = self.known_digest(path)
+        if digest is not None:
+            return digest
+        with self.__hash_lock:
+            stamp = _stamp(path)
+            digest = self.known_digest(path, stamp)  # another thread may have hashed it meanwhile
+            if digest is None:
+                digest = file_digest(path)
+                try:
+                    self.__write_meta(self.__stamp_name(stamp), {"digest": digest})
+                except OSError:
+                    pass
+        return digest
+
+    def known_digest(self, path: str, stamp: str | None = None) -> str | None:
+        """
+        Content digest of a file hashed before with the same (path, size,
+        mtime) stamp, else None. Never reads the file itself.
+        """
+        meta = self.__read_meta(self.__stamp_name(_stamp(path) if stamp is None else stamp))
+        return None if meta is None else meta["digest"]
+
+    def register(self, samples, digest: str) -> None:
+        self.__register(samples, digest, None)
+
+    def register_file(self, samples, path: str, suffix: str = "") -> None:
+        """
+        Register samples read from path by the file's digest (plus suffix)
+        without hashing it now. Lookups find the file only if it was hashed
+        before in this state (see known_digest); otherwise put_magnitude
+        hashes it in a background thread and stores the entry afterwards.
+        """
+        self.__register(samples, None, (path, _stamp(path), suffix))
+
+    def digest_of(self, samples) -> str | None:
+        """Digest registered for samples, or None (also for a file not hashed yet)."""
+        entry = self.__entry(samples)
+        if entry is None:
+            return None
+        ref, digest, source = entry
+        if digest is None and source is not None:
+            path, stamp, suffix = source
+            digest = self.known_digest(path, stamp)
+            if digest is None:
+                return None
+            digest += suffix
+            with self.__lock:
+                if self.__sources.get(id(samples)) is entry:
+                    self.__sources[id(samples)] = (ref, digest, None)
+        return digest
+
+    # ---------- Entries ----------
+
+    def get_audio(self, digest: str):
+        """(samples, samplerate) of a decoded file, or None."""
+        return self.__get(self.__name("audio", digest), "samplerate")
+
+    def put_audio(self, digest: str, samples: np.ndarray, samplerate: int) -> None:
+        self.__put(self.__name("audio", digest), samples, {"samplerate": int(samplerate)})
+
+    def get_magnitude(self, samples, params: tuple):
+        """(mag, peak) for samples registered with a digest, or None."""
+        digest = self.digest_of(samples)
+        if digest is None:
+            return None
+        entry = self.__get(self.__name("mag", digest, params), "peak")
+        if entry is None:
+            return None
+        mag, peak = entry
+        return mag, mag.dtype.type(peak)  # peak = mag.max(), in the same precision
+
+    def put_magnitude(self, samples, params: tuple, mag: np.ndarray, peak) -> None:
+        digest = self.digest_of(samples)
+        if digest is not None:
+            self.__put(self.__name("mag", digest, params), mag, {"peak": float(peak)})
+            return
+        entry = self.__entry(samples)
+        if entry is not None and entry[2] is not None:
+            # Not hashed yet: do that off the render thread, then store
+            args = (entry[2], params, mag, peak)
+            threading.Thread(target=self.__put_magnitude_of_file, args=args, daemon=True).start()
+
+    def get_tile(self, digest: str, key: tuple) -> bytes | None:
+        """Encoded image tile of a file (key = rendering parameters and position), or None."""
+        entry = self.__get(self.__name("tile", digest, key), "format")
+        return None if entry is None else entry[0].tobytes()
+
+    def put_tile(self, digest: str, key: tuple, data: bytes, fmt: str = "png") -> None:
+        with self.__lock:
+            self.__tile_puts += 1
+            evict = self.__tile_puts % TILE_EVICT_INTERVAL == 0
+        self.__put(self.__name("tile", digest, key), np.frombuffer(data, dtype=np.uint8), {"format": fmt}, evict)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(size for _, size, _ in self.__files())
+
+    def clear(self) -> None:
+        for path, _, _ in self.__files():
+            _remove(path)
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits max_bytes."""
+        now = time.time()
+        entries = {}  # stem -> [last use, size]
+        for path, size, mtime in self.__files():
+            if path.endswith(".tmp"):
+                if now - mtime > STALE_TMP_S:
+                    _remove(path)
+                continue
+            entry = entries.setdefault(os.path.splitext(path)[0], [0.0, 0])
+            entry[0] = max(entry[0], mtime)
+            entry[1] += size
+
+        total = sum(size for _, size in entries.values())
+        for stem, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            # Remove the marker first, so readers see the entry as missing
+            # before its data disappears
+            _remove(stem + ".json")
+            _remove(stem + ".npy")
+            total -= size
+
+    # ---------- Internals ----------
+
+    def __register(self, samples, digest: str | None, source: tuple | None) -> None:
+        key = id(samples)
+
+        def forget(_ref, key=key):
+            with self.__lock:
+                self.__sources.pop(key, None)
+
+        with self.__lock:
+            self.__sources[key] = (weakref.ref(samples, forget), digest, source)
+
+    def __entry(self, samples):
+        with self.__lock:
+            entry = self.__sources.get(id(samples))
+        if entry is None or entry[0]() is not samples:
+            return None
+        return entry
+
+    def __put_magnitude_of_file(self, source: tuple, params: tuple, mag: np.ndarray, peak) -> None:
+        path, stamp, suffix = source
+        try:
+            if _stamp(path) != stamp:
+                return  # changed since it was opened; mag may not match its content
+            digest = self.digest(path) + suffix
+        except OSError:
+            return
+        self.__put(self.__name("mag", digest, params), mag, {"peak": float(peak)})
+
+    @staticmethod
+    def __stamp_name(stamp: str) -> str:
+        return "path-" + hashlib.sha256(stamp.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def __name(kind: str, digest: str, params: tuple = ()) -> str:
+        text = json.dumps([CACHE_VERSION, kind, digest, [str(p) for p in params]])
+        return f"{kind}-{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def __get(self, name: str, field: str):
+        meta = self.__read_meta(name)
+        if meta is None:
+            return None
+        path = os.path.join(self.root, name + ".npy")
+        try:
+            data = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data, meta[field]
+
+    def __put(self, name: str, data: np.ndarray, meta: dict, evict: bool = True) -> None:
+        if data.nbytes > self.max_bytes:
+            return
+        try:
+            self.__atomic_write(name + ".npy", lambda f: np.save(f, np.asarray(data), allow_pickle=False))
+            self.__write_meta(name, meta)
+        except OSError:
+            return  # a full or read-only cache only costs speed
+        if evict:
+            self.evict()
+
+    def __read_meta(self, name: str):
+        path = os.path.join(self.root, name + ".json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def __write_meta(self, name: str, meta: dict) -> None:
+        self.__atomic_write(name + ".json", lambda f: f.write(json.dumps(meta).encode("utf-8")))
+
+    def __atomic_write(self, filename: str, write) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, os.path.join(self.root, filename))
+        except BaseException:
+            _remove(tmp)
+            raise
+
+    def __files(self):
+        """(path, size, mtime) of every file in the cache directory."""
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue  # removed by another process
+            yield entry.path, st.st_size, st.st_mtime
+
+
+def _stamp(path: str) -> str:
+    """(path, size, mtime) of a file as a string; changes whenever the file is rewritten."""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
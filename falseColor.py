@@ -1,37 +1,32 @@
-from typing import List, Tuple
+import math
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+import numpy as np
 
 def falseColor(gray, colors):
     '''
     This function takes a gray value between 0 and 255 (integer or floating point) and an array of
-    four rgb colors, e.g. [ [228, 228, 228], [192, 192, 192], [255, 255, 128], [255, 0, 0], [128, 0, 0] ]. The
-    first color stands for the lowest gray value and the last one for the highest.
+    two or more rgb colors, e.g. [ [228, 228, 228], [192, 192, 192], [255, 255, 128], [255, 0, 0], [128, 0, 0] ]. The
+    first color stands for the lowest gray value and the last one for the highest. The gray range is
+    split into len(colors)-1 equal intervals, and each interval blends two neighbouring colors.
     
     Returns a bytearray with values for red, green and blue.
     '''
     if gray<0 or gray>255:
         raise ValueError('Gray must be between 0 and 255. The value of gray was {}'.format(gray))
-    if len(colors)!=5:
-        raise ValueError('Need five RGB colors. The length of colors was {}'.format(len(colors)))
+    if len(colors)<2:
+        raise ValueError('Need at least two RGB colors. The length of colors was {}'.format(len(colors)))
 
 
     # select an interval between two colours based on the gray value
     # and calculate the distance to the lower color between 0 and 1
-    if gray<=64:
-        color1 = colors[0]
-        color2 = colors[1]
-        distance = gray/64.0
-    elif gray<=128:
-        color1 = colors[1]
-        color2 = colors[2]
-        distance = (gray-64)/64.0
-    elif gray<=192:
-        color1 = colors[2]
-        color2 = colors[3]
-        distance = (gray-128)/64.0
-    else:
-        color1 = colors[3]
-        color2 = colors[4]
-        distance = (gray-192)/64.0
+    # (five colors give the intervals [0, 64], (64, 128], (128, 192], (192, 255])
+    step = 256.0/(len(colors)-1)
+    index = max(0, min(int(math.ceil(gray/step))-1, len(colors)-2))
+    color1 = colors[index]
+    color2 = colors[index+1]
+    distance = (gray-index*step)/step
     
     # interpolation
     red =   int ((color1[0]*(1-distance) + color2[0]*distance))
@@ -57,10 +52,55 @@ SCREEN_COLORS: List[Tuple[int, int, int]] = [
     (255, 255, 0),
 ]
 
+# Colors of printed waterfalls: light background, dark red peaks
+PRINT_COLORS: List[Tuple[int, int, int]] = [
+    (228, 228, 228),
+    (192, 192, 192),
+    (255, 255, 128),
+    (255, 0, 0),
+    (128, 0, 0),
+]
+
+GRAY_COLORS: List[Tuple[int, int, int]] = [
+    (0, 0, 0),
+    (255, 255, 255),
+]
+
+# Named palettes, e.g. for WaterfallGenerator(palette="print")
+PALETTES = {
+    "screen": SCREEN_COLORS,
+    "print": PRINT_COLORS,
+    "gray": GRAY_COLORS,
+}
+
+
+def palette_table(colors: Sequence[Sequence[int]] | str) -> np.ndarray:
+    """
+    256-entry palette for a list of two or more RGB colors (or a name from
+    PALETTES), as a read-only (256, 3) uint8 array: entry i is
+    falseColor(i, colors). Tables are cached per color list.
+    """
+    if isinstance(colors, str):
+        try:
+            colors = PALETTES[colors]
+        except KeyError:
+            raise ValueError(f"unknown palette {colors!r}, expected one of {sorted(PALETTES)}") from None
+    return _palette_table(tuple(tuple(int(v) for v in c) for c in colors))
+
+
+@lru_cache(maxsize=32)
+def _palette_table(colors: tuple) -> np.ndarray:
+    lut = b"".join(bytes(falseColor(i, colors)) for i in range(256))
+    return np.frombuffer(lut, dtype=np.uint8).reshape(256, 3)
+
+
 _FALSECOLORSCREEN_LUT = [
     bytes(falseColor(i, SCREEN_COLORS)) for i in range(256)
 ]
 
+# Same LUT as a (256, 3) uint8 array, for vectorized indexing with a level matrix
+FALSECOLORSCREEN_TABLE = palette_table(SCREEN_COLORS)
+
 
 def falseColorScreen(gray) -> bytearray:
     """
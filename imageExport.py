@@ -0,0 +1,312 @@
+# imageExport.py
+"""
+Streaming export of waterfall images that are too large to hold in memory.
+
+The writers take the image as consecutive blocks of rows, e.g. straight
+from WaterfallGenerator.iter_level_blocks, and only buffer what one output
+unit needs: nothing for PNG (rows go through a zlib stream), and one row of
+tiles (or one strip) for TIFF. The height does not have to be known in
+advance; it is filled in when the writer is closed.
+
+Rows are palette indices (uint8, (rows, width)) when a palette is given,
+otherwise RGB ((rows, width, 3)). Files are written under a temporary name
+and moved into place by close(), like spectrogram stores.
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+EXPORT_SUFFIXES = (".png", ".tif", ".tiff")
+
+# TIFF tile edge (must be a multiple of 16) and rows per strip of striped TIFFs
+DEFAULT_TILE_SIZE = 256
+DEFAULT_STRIP_ROWS = 64
+
+# PNG limits width and height to 2**31 - 1
+PNG_MAX_SIZE = 2**31 - 1
+
+# Uncompressed size from which TIFFs are written as BigTIFF when not specified
+BIGTIFF_THRESHOLD = 2**32 - 2**28
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class _StreamWriter:
+    """Row validation and atomic write/abort shared by the writers."""
+
+    def __init__(self, path: str, width: int, palette: np.ndarray | None):
+        if width < 1:
+            raise ValueError("width must be >= 1")
+        self.path = path
+        self.width = int(width)
+        self.palette = None if palette is None else np.asarray(palette, dtype=np.uint8).reshape(256, 3)
+        self.samples_per_pixel = 1 if self.palette is not None else 3
+        self.rows = 0
+        self._tmp_path = path + ".part"
+        self._file = open(self._tmp_path, "w+b")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, block: np.ndarray) -> None:
+        """Append rows: (rows, width) palette indices or (rows, width, 3) RGB, uint8."""
+        shape = (self.width,) if self.palette is not None else (self.width, 3)
+        if block.ndim != 1 + len(shape) or block.shape[1:] != shape:
+            raise ValueError(f"expected (rows, {', '.join(map(str, shape))}) block, got {block.shape}")
+        block = np.ascontiguousarray(block, dtype=np.uint8)
+        if len(block):
+            self._write(block)
+            self.rows += len(block)
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        if self.rows == 0:
+            self.abort()
+            raise ValueError("no rows were written")
+        try:
+            self._finish()
+        except BaseException:
+            self.abort()
+            raise
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Discard the partially written file."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._tmp_path)
+
+    def _write(self, block: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def _finish(self) -> None:
+        raise NotImplementedError
+
+
+class PngStreamWriter(_StreamWriter):
+    """
+    PNG written row by row through one zlib stream (filter type 0). A
+    palette gives an 8-bit indexed PNG, otherwise 8-bit RGB. text is written
+    as tEXt chunks (keyword -> Latin-1 text).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        width: int,
+        palette: np.ndarray | None = None,
+        text: dict | None = None,
+        level: int = 6,
+    ):
+        if width > PNG_MAX_SIZE:
+            raise ValueError(f"PNG width must be <= {PNG_MAX_SIZE}")
+        super().__init__(path, width, palette)
+        self.__zlib = zlib.compressobj(level)
+        self._file.write(PNG_SIGNATURE)
+        self.__ihdr_offset = self._file.tell()
+        self.__chunk(b"IHDR", self.__ihdr(0))  # height is patched in by close()
+        if self.palette is not None:
+            self.__chunk(b"PLTE", self.palette.tobytes())
+        for key, value in (text or {}).items():
+            self.__chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1"))
+
+    def _write(self, block: np.ndarray) -> None:
+        if self.rows + len(block) > PNG_MAX_SIZE:
+            raise ValueError(f"PNG height must be <= {PNG_MAX_SIZE}")
+        raw = np.zeros((len(block), 1 + self.width * self.samples_per_pixel), dtype=np.uint8)
+        raw[:, 1:] = block.reshape(len(block), -1)  # column 0: filter type 0 (None)
+        data = self.__zlib.compress(raw)
+        if data:
+            self.__chunk(b"IDAT", data)
+
+    def _finish(self) -> None:
+        self.__chunk(b"IDAT", self.__zlib.flush())
+        self.__chunk(b"IEND", b"")
+        self._file.seek(self.__ihdr_offset)
+        self.__chunk(b"IHDR", self.__ihdr(self.rows))
+
+    def __ihdr(self, height: int) -> bytes:
+        color_type = 3 if self.palette is not None else 2
+        return struct.pack(">IIBBBBB", self.width, height, 8, color_type, 0, 0, 0)
+
+    def __chunk(self, kind: bytes, data: bytes) -> None:
+        self._file.write(struct.pack(">I", len(data)) + kind + data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+class TiffStreamWriter(_StreamWriter):
+    """
+    Tiled (tile × tile pixels) or, with tile=None, striped TIFF, optionally
+    deflate-compressed. Only one row of tiles (or one strip) is buffered;
+    the directory with the tile offsets is written at the end.
+
+    bigtiff=None chooses BigTIFF when rows_hint rows would exceed
+    BIGTIFF_THRESHOLD bytes uncompressed, or when rows_hint is not given.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        width: int,
+        palette: np.ndarray | None = None,
+        tile: int | None = DEFAULT_TILE_SIZE,
+        compress: bool = True,
+        bigtiff: bool | None = None,
+        rows_hint: int | None = None,
+        strip_rows: int = DEFAULT_STRIP_ROWS,
+    ):
+        if tile is not None and (tile < 16 or tile % 16):
+            raise ValueError("tile must be a positive multiple of 16")
+        super().__init__(path, width, palette)
+        self.tile = None if tile is None else int(tile)
+        self.compress = bool(compress)
+        if bigtiff is None:
+            bigtiff = rows_hint is None or rows_hint * self.width * self.samples_per_pixel >= BIGTIFF_THRESHOLD
+        self.bigtiff = bool(bigtiff)
+
+        # One row of tiles (padded to whole tiles) or one strip
+        block_rows = int(strip_rows) if self.tile is None else self.tile
+        block_width = self.width if self.tile is None else -(-self.width // self.tile) * self.tile
+        shape = (block_rows, block_width) if self.palette is not None else (block_rows, block_width, 3)
+        self.__buffer = np.zeros(shape, dtype=np.uint8)
+        self.__buffered = 0
+        self.__offsets = []
+        self.__counts = []
+
+        if self.bigtiff:
+            self._file.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+        else:
+            self._file.write(b"II" + struct.pack("<HI", 42, 0))
+
+    def _write(self, block: np.ndarray) -> None:
+        row = 0
+        while row < len(block):
+            n = min(len(block) - row, len(self.__buffer) - self.__buffered)
+            self.__buffer[self.__buffered : self.__buffered + n, : self.width] = block[row : row + n]
+            self.__buffered += n
+            row += n
+            if self.__buffered == len(self.__buffer):
+                self.__flush()
+
+    def _finish(self) -> None:
+        if self.__buffered:
+            if self.tile is not None:
+                self.__buffer[self.__buffered :] = 0  # tiles are always whole
+            self.__flush()
+        self.__write_ifd()
+
+    def __flush(self) -> None:
+        if self.tile is None:
+            units = [self.__buffer[: self.__buffered]]
+        else:
+            t = self.tile
+            units = [self.__buffer[:, x : x + t] for x in range(0, self.__buffer.shape[1], t)]
+        for unit in units:
+            data = np.ascontiguousarray(unit).tobytes()
+            if self.compress:
+                data = zlib.compress(data, 6)
+            self.__offsets.append(self.__append(data))
+            self.__counts.append(len(data))
+        self.__buffered = 0
+
+    def __append(self, data: bytes) -> int:
+        """Write data at the (word aligned) end of the file; returns its offset."""
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() % 2:
+            self._file.write(b"\0")
+        offset = self._file.tell()
+        self._file.write(data)
+        return offset
+
+    def __write_ifd(self) -> None:
+        SHORT, LONG, LONG8 = 3, 4, 16
+        offset_type = LONG8 if self.bigtiff else LONG
+        end = self._file.seek(0, os.SEEK_END)
+        if not self.bigtiff and end + 8 * len(self.__offsets) + 4096 >= 2**32:
+            raise ValueError("image too large for classic TIFF; use bigtiff=True")
+
+        spp = self.samples_per_pixel
+        entries = [
+            (256, LONG, [self.width]),
+            (257, LONG, [self.rows]),
+            (258, SHORT, [8] * spp),
+            (259, SHORT, [8 if self.compress else 1]),
+            (262, SHORT, [3 if self.palette is not None else 2]),
+            (277, SHORT, [spp]),
+            (284, SHORT, [1]),
+        ]
+        if self.tile is None:
+            entries += [
+                (273, offset_type, self.__offsets),
+                (278, LONG, [len(self.__buffer)]),
+                (279, offset_type, self.__counts),
+            ]
+        else:
+            entries += [
+                (322, LONG, [self.tile]),
+                (323, LONG, [self.tile]),
+                (324, offset_type, self.__offsets),
+                (325, offset_type, self.__counts),
+            ]
+        if self.palette is not None:
+            # TIFF color maps are 16 bit, all reds, then all greens, then all blues
+            entries.append((320, SHORT, (self.palette.T.astype(np.uint32) * 257).ravel().tolist()))
+        entries.sort()
+
+        sizes = {SHORT: "H", LONG: "I", LONG8: "Q"}
+        inline = 8 if self.bigtiff else 4
+        fields = []
+        for tag, kind, values in entries:
+            data = struct.pack(f"<{len(values)}{sizes[kind]}", *values)
+            if len(data) > inline:
+                data = struct.pack("<Q" if self.bigtiff else "<I", self.__append(data))
+            fields.append((tag, kind, len(values), data.ljust(inline, b"\0")))
+
+        if self.bigtiff:
+            ifd = struct.pack("<Q", len(fields))
+            ifd += b"".join(struct.pack("<HHQ", tag, kind, count) + data for tag, kind, count, data in fields)
+            ifd += struct.pack("<Q", 0)
+        else:
+            ifd = struct.pack("<H", len(fields))
+            ifd += b"".join(struct.pack("<HHI", tag, kind, count) + data for tag, kind, count, data in fields)
+            ifd += struct.pack("<I", 0)
+        ifd_offset = self.__append(ifd)
+
+        # Point the header at the directory
+        if self.bigtiff:
+            self._file.seek(8)
+            self._file.write(struct.pack("<Q", ifd_offset))
+        else:
+            self._file.seek(4)
+            self._file.write(struct.pack("<I", ifd_offset))
+
+
+def open_image_writer(path: str, width: int, palette: np.ndarray | None = None, **options) -> _StreamWriter:
+    """
+    Streaming writer for path, chosen by its suffix (.png, .tif, .tiff).
+    options go to PngStreamWriter or TiffStreamWriter.
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".png":
+        return PngStreamWriter(path, width, palette, **options)
+    if suffix in (".tif", ".tiff"):
+        return TiffStreamWriter(path, width, palette, **options)
+    raise ValueError(f"cannot stream {suffix or 'files without suffix'}; use one of {EXPORT_SUFFIXES}")
+
+
+def is_export_path(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in EXPORT_SUFFIXES
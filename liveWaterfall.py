@@ -0,0 +1,209 @@
+# liveWaterfall.py
+"""
+Live waterfall for audio that is still arriving: a WAV/AIFF file being
+recorded, or raw PCM on stdin or a pipe.
+
+Only the STFT frames completed by newly arrived samples are computed, and
+their rows go into a fixed-height ring buffer, so the cost of an update does
+not depend on how long the stream has been running. There is no global
+peak to normalize to, so dB values are relative to a running peak or to a
+fixed reference.
+"""
+
+import os
+import queue
+import threading
+
+import numpy as np
+from PIL import Image
+
+import numpyStft
+from audioSource import MemmapAudio
+from falseColor import FALSECOLORSCREEN_TABLE
+from WaterfallGenerator import array_to_image
+
+# Raw PCM sample formats: numpy dtype and full-scale value
+PCM_FORMATS = {
+    "u8": (np.dtype(np.uint8), 128.0),
+    "s16le": (np.dtype("<i2"), float(1 << 15)),
+    "s32le": (np.dtype("<i4"), float(1 << 31)),
+    "f32le": (np.dtype("<f4"), 1.0),
+}
+
+# dB reference of the live waterfall: the largest magnitude seen so far, or
+# the magnitude of a full-scale sine (0 dB = full scale)
+REFERENCES = ("running", "full_scale")
+
+
+class GrowingFileSource:
+    """
+    New samples of a WAV/AIFF file that is still being written. With
+    backlog_samples, the first read starts that far before the current end
+    instead of at the beginning of the file.
+    """
+
+    def __init__(self, path: str, backlog_samples: int | None = None):
+        self.path = path
+        audio = MemmapAudio(path, growing=True)
+        self.samplerate = audio.samplerate
+        self.finished = False  # a file may always grow further
+        self.__size = None
+        self.__pos = 0 if backlog_samples is None else max(0, len(audio) - int(backlog_samples))
+
+    def read_new(self) -> np.ndarray:
+        """Mono float32 samples appended since the last call (possibly none)."""
+        size = os.path.getsize(self.path)
+        if size == self.__size:
+            return np.zeros(0, dtype=np.float32)
+        self.__size = size
+        audio = MemmapAudio(self.path, growing=True)  # re-map to see the new data
+        start, self.__pos = self.__pos, max(self.__pos, len(audio))
+        return audio.read(start, self.__pos)
+
+    def close(self) -> None:
+        pass
+
+
+class PcmStreamSource:
+    """
+    Raw interleaved PCM from a binary stream (e.g. sys.stdin.buffer). A
+    background thread reads whatever arrives, so read_new() never blocks.
+    """
+
+    def __init__(self, stream, samplerate: int, channels: int = 1, fmt: str = "s16le"):
+        if fmt not in PCM_FORMATS:
+            raise ValueError(f"format must be one of {sorted(PCM_FORMATS)}, got {fmt!r}")
+        if channels < 1:
+            raise ValueError("channels must be >= 1")
+        self.samplerate = int(samplerate)
+        self.channels = int(channels)
+        self.__dtype, self.__scale = PCM_FORMATS[fmt]
+        self.__frame_bytes = self.__dtype.itemsize * self.channels
+        self.__chunks = queue.Queue()
+        self.__pending = b""
+        self.__eof = threading.Event()
+        threading.Thread(target=self.__reader, args=(stream,), daemon=True).start()
+
+    @property
+    def finished(self) -> bool:
+        """True once the stream has ended and every sample was read."""
+        return self.__eof.is_set() and self.__chunks.empty()
+
+    def read_new(self) -> np.ndarray:
+        """Mono float32 samples received since the last call (possibly none)."""
+        parts = [self.__pending]
+        while True:
+            try:
+                parts.append(self.__chunks.get_nowait())
+            except queue.Empty:
+                break
+        data = b"".join(parts)
+        usable = len(data) - len(data) % self.__frame_bytes
+        self.__pending = data[usable:]
+
+        x = np.frombuffer(data[:usable], dtype=self.__dtype).reshape(-1, self.channels).astype(np.float32)
+        if self.__dtype == np.uint8:
+            x -= 128.0
+        if self.__scale != 1.0:
+            x *= np.float32(1.0 / self.__scale)
+        return x[:, 0] if self.channels == 1 else np.mean(x, axis=1)
+
+    def close(self) -> None:
+        self.__eof.set()
+
+    def __reader(self, stream) -> None:
+        read = getattr(stream, "read1", stream.read)
+        try:
+            while not self.__eof.is_set():
+                data = read(1 << 16)
+                if not data:
+                    break
+                self.__chunks.put(data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.__eof.set()
+
+
+class LiveSTFT:
+    """
+    Incremental STFT with the parameters of a WaterfallGenerator. push()
+    takes any number of new samples and returns the uint8 levels (time, freq)
+    of the frames they complete.
+
+    Frames are aligned like the centered offline STFT (n_fft // 2 zeros in
+    front of the first sample), so with a fixed reference equal to the
+    offline peak the rows match build_image's rows exactly.
+    """
+
+    def __init__(self, generator, samplerate: int, reference="running"):
+        if isinstance(reference, str) and reference not in REFERENCES:
+            raise ValueError(f"reference must be a magnitude or one of {REFERENCES}, got {reference!r}")
+        self.generator = generator
+        self.samplerate = int(samplerate)
+        self.k_lo, self.k_hi = generator._bin_range(self.samplerate)
+        if reference == "full_scale":
+            window = numpyStft.hann_window(generator.win_length)
+            reference = float(np.sum(window)) / 2.0
+        self.reference = reference
+        self.peak = None  # largest magnitude seen so far
+        self.frames = 0  # frames computed so far
+        self.__buffer = np.zeros(generator.n_fft // 2, dtype=np.float32)
+
+    @property
+    def bins(self) -> int:
+        return self.k_hi - self.k_lo + 1
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        g = self.generator
+        buf = np.concatenate((self.__buffer, np.asarray(samples, dtype=np.float32)))
+        n = 0 if len(buf) < g.n_fft else 1 + (len(buf) - g.n_fft) // g.hop_length
+        if n == 0:
+            self.__buffer = buf
+            return np.zeros((0, self.bins), dtype=np.uint8)
+
+        D = numpyStft.stft(
+            buf[: (n - 1) * g.hop_length + g.n_fft],
+            n_fft=g.n_fft,
+            win_length=g.win_length,
+            hop_length=g.hop_length,
+            center=False,
+            backend=g._fft(),
+        )
+        self.__buffer = buf[n * g.hop_length :]
+        self.frames += n
+
+        mag = np.abs(D)
+        del D
+        block_peak = mag.max()
+        self.peak = block_peak if self.peak is None else max(self.peak, block_peak)
+        ref = self.peak if isinstance(self.reference, str) else self.reference
+        data = g._to_db(mag[self.k_lo : self.k_hi + 1], max(ref, np.finfo(np.float32).tiny))
+        return g._quantize(data.T)
+
+
+class WaterfallRing:
+    """
+    Fixed-height waterfall of uint8 levels. append() overwrites the oldest
+    rows; image() shows the newest row at the bottom.
+    """
+
+    def __init__(self, rows: int, bins: int):
+        self.levels = np.zeros((int(rows), int(bins)), dtype=np.uint8)
+        self.__head = 0  # next row to write
+
+    def append(self, rows: np.ndarray) -> None:
+        n_rows = self.levels.shape[0]
+        rows = rows[-n_rows:]
+        first = min(len(rows), n_rows - self.__head)
+        self.levels[self.__head : self.__head + first] = rows[:first]
+        self.levels[: len(rows) - first] = rows[first:]
+        self.__head = (self.__head + len(rows)) % n_rows
+
+    def ordered(self) -> np.ndarray:
+        """Rows from oldest to newest."""
+        return np.concatenate((self.levels[self.__head :], self.levels[: self.__head]))
+
+    def image(self, palette: np.ndarray = FALSECOLORSCREEN_TABLE) -> Image.Image:
+        """Palette ("P" mode) image of the rows; palette is a (256, 3) table."""
+        return array_to_image(self.ordered(), palette)
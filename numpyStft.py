@@ -0,0 +1,265 @@
+# numpyStft.py
+"""
+STFT and dB conversion with nothing but NumPy.
+
+Reproduces librosa.stft (periodic Hann window, constant padding) and
+librosa.amplitude_to_db for the parameters WaterfallGenerator uses, step by
+step and with the same dtypes, so the values match librosa's. Importing
+librosa pulls in numba and scipy and takes seconds; this module loads as
+fast as NumPy itself.
+
+The FFTs run on numpy.fft by default. FftBackend runs them on scipy.fft or
+pyFFTW instead, which are imported only when selected.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Frames per rfft call are limited so that the windowed float64 frames of one
+# call take at most this many bytes
+MAX_BLOCK_BYTES = 1 << 24
+
+# librosa.amplitude_to_db's default floor
+AMIN = 1e-5
+
+# FFT implementations FftBackend can run on. "auto" selects the first of
+# pyfftw, scipy, numpy that is installed.
+FFT_BACKENDS = ("numpy", "scipy", "pyfftw")
+
+# pyFFTW plans (with their aligned input and output arrays) kept per backend,
+# least recently used first out. FFTW keeps the wisdom of evicted plans, so
+# planning the same shape again is fast.
+MAX_PLANS = 4
+
+_windows = {}
+_backends = {}
+
+
+def hann_window(win_length: int, n_fft: int | None = None, dtype=np.float64) -> np.ndarray:
+    """
+    Periodic Hann window of win_length samples, zero-padded on both sides to
+    n_fft (default win_length) like librosa.util.pad_center. Read-only and
+    cached per size and dtype.
+    """
+    n_fft = win_length if n_fft is None else n_fft
+    if win_length > n_fft:
+        raise ValueError(f"win_length ({win_length}) must be <= n_fft ({n_fft})")
+    key = (int(win_length), int(n_fft), np.dtype(dtype))
+    window = _windows.get(key)
+    if window is None:
+        if win_length <= 1:
+            w = np.ones(win_length, dtype=np.float64)
+        else:
+            # scipy.signal.get_window("hann", win_length, fftbins=True), term by term
+            fac = np.linspace(-np.pi, np.pi, win_length + 1, dtype=np.float64)
+            w = np.zeros(win_length + 1, dtype=np.float64)
+            for k, a in enumerate((0.5, 0.5)):
+                w += a * np.cos(k * fac)
+            w = w[:-1]
+        lpad = (n_fft - win_length) // 2
+        window = np.pad(w, (lpad, n_fft - win_length - lpad)).astype(dtype, copy=False)
+        window.flags.writeable = False
+        _windows[key] = window
+    return window
+
+
+class FftBackend:
+    """
+    Forward FFTs along the last axis on numpy.fft, scipy.fft (split across
+    workers threads) or pyFFTW (workers threads, with one FFTW plan per
+    input shape and dtype, built once and reused). rfft() takes real input
+    and returns the 1 + n // 2 non-negative frequencies, fft() takes complex
+    input. numpy and scipy give identical values; pyFFTW's agree to within
+    floating-point rounding.
+    """
+
+    def __init__(self, name: str = "numpy", workers: int = 1):
+        name = _resolve_backend(name)
+        if name not in FFT_BACKENDS:
+            raise ValueError(f"FFT backend must be 'auto' or one of {FFT_BACKENDS}, got {name!r}")
+        if not backend_available(name):
+            raise ValueError(f"FFT backend {name!r} is not installed")
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.__plans = OrderedDict()
+        self.__lock = threading.Lock()  # pyFFTW plans own their input and output arrays
+
+    def __repr__(self) -> str:
+        return self.name if self.workers == 1 else f"{self.name} ({self.workers} workers)"
+
+    def rfft(self, a: np.ndarray, window: np.ndarray | None = None, out: np.ndarray | None = None) -> np.ndarray:
+        """FFT of the real array a (times window, if given) along its last axis, into out if given."""
+        return self._transform(a, window, out, real=True)
+
+    def fft(self, a: np.ndarray, window: np.ndarray | None = None, out: np.ndarray | None = None) -> np.ndarray:
+        """FFT of the complex array a (times window, if given) along its last axis, into out if given."""
+        return self._transform(a, window, out, real=False)
+
+    def _transform(self, a, window, out, real: bool) -> np.ndarray:
+        if self.name == "pyfftw":
+            dtype = a.dtype if window is None else np.result_type(a, window)
+            if not real:
+                dtype = np.result_type(dtype, np.complex64)
+            with self.__lock:
+                plan = self._plan(a.shape, dtype, real)
+                if window is None:
+                    plan.input_array[...] = a
+                else:
+                    np.multiply(a, window, out=plan.input_array)
+                plan.execute()
+                if out is None:
+                    return plan.output_array.copy()
+                out[...] = plan.output_array
+                return out
+
+        if window is not None:
+            a = a * window
+        if self.name == "scipy":
+            import scipy.fft
+
+            result = (scipy.fft.rfft if real else scipy.fft.fft)(a, axis=-1, workers=self.workers)
+        else:
+            result = (np.fft.rfft if real else np.fft.fft)(a, axis=-1)
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    def _plan(self, shape: tuple, dtype: np.dtype, real: bool):
+        """The cached pyFFTW plan for input of this shape and dtype (planned with FFTW_MEASURE)."""
+        key = (shape, dtype, real)
+        plan = self.__plans.get(key)
+        if plan is not None:
+            self.__plans.move_to_end(key)
+            return plan
+
+        import pyfftw
+
+        out_shape = shape[:-1] + ((shape[-1] // 2 + 1) if real else shape[-1],)
+        out_dtype = np.result_type(dtype, np.complex64)
+        plan = pyfftw.FFTW(
+            pyfftw.empty_aligned(shape, dtype=dtype),
+            pyfftw.empty_aligned(out_shape, dtype=out_dtype),
+            axes=(-1,),
+            flags=("FFTW_MEASURE",),
+            threads=self.workers,
+        )
+        self.__plans[key] = plan
+        while len(self.__plans) > MAX_PLANS:
+            self.__plans.popitem(last=False)
+        return plan
+
+
+def backend_available(name: str) -> bool:
+    """True if the FFT backend name (one of FFT_BACKENDS) can be imported."""
+    if name == "numpy":
+        return True
+    import importlib.util
+
+    return importlib.util.find_spec({"scipy": "scipy.fft", "pyfftw": "pyfftw"}.get(name, name)) is not None
+
+
+def _resolve_backend(name: str) -> str:
+    """name, with "auto" replaced by the first installed of pyfftw, scipy, numpy."""
+    if name == "auto":
+        return next(n for n in reversed(FFT_BACKENDS) if backend_available(n))
+    return name
+
+
+def get_backend(name: str = "numpy", workers: int = 1) -> FftBackend:
+    """Shared FftBackend per (name, workers), so that its plans are reused across renders."""
+    key = (_resolve_backend(name), max(1, int(workers)))
+    backend = _backends.get(key)
+    if backend is None:
+        backend = _backends[key] = FftBackend(name, workers)
+    return backend
+
+
+def stft(
+    y: np.ndarray,
+    n_fft: int,
+    win_length: int | None = None,
+    hop_length: int | None = None,
+    center: bool = True,
+    backend: FftBackend | None = None,
+) -> np.ndarray:
+    """
+    Complex STFT (1 + n_fft // 2, frames) of a real 1-D signal, like
+    librosa.stft(y, n_fft=..., win_length=..., hop_length=..., center=...):
+    complex64 for float32 input, complex128 otherwise. center=True pads
+    n_fft // 2 zeros on both sides.
+
+    Multichannel input (..., samples) gives (..., 1 + n_fft // 2, frames);
+    all channels go through the same padding, windowing and rfft calls.
+    The FFTs run on backend (default numpy.fft).
+    """
+    win_length = n_fft if win_length is None else win_length
+    hop_length = win_length // 4 if hop_length is None else hop_length
+    y = np.asarray(y)
+    if y.ndim < 1:
+        raise ValueError("expected a signal with samples along the last axis, got a scalar")
+    if hop_length < 1:
+        raise ValueError("hop_length must be >= 1")
+    if center:
+        y = np.pad(y, [(0, 0)] * (y.ndim - 1) + [(n_fft // 2, n_fft // 2)])
+    if y.shape[-1] < n_fft:
+        raise ValueError(f"n_fft={n_fft} is too large for a signal of length {y.shape[-1]}")
+
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft, axis=-1)[..., ::hop_length, :]
+    return _rfft_frames(frames, hann_window(win_length, n_fft), y.dtype, backend)
+
+
+def stft_frames(
+    y: np.ndarray,
+    starts: np.ndarray,
+    n_fft: int,
+    win_length: int | None = None,
+    backend: FftBackend | None = None,
+) -> np.ndarray:
+    """
+    STFT of the frames of y that begin at the sample offsets starts (each
+    frame must lie inside y), as (1 + n_fft // 2, len(starts)). Every column
+    equals the matching column of stft(y, ..., center=False), so frames can
+    be computed in any order or subset.
+    """
+    win_length = n_fft if win_length is None else win_length
+    y = np.asarray(y)
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[np.asarray(starts, dtype=np.intp)]
+    return _rfft_frames(frames, hann_window(win_length, n_fft), y.dtype, backend)
+
+
+def _rfft_frames(frames: np.ndarray, window: np.ndarray, dtype, backend: FftBackend | None = None) -> np.ndarray:
+    """Windowed rfft of (..., frames, n_fft) as (..., freq, frames), in blocks of MAX_BLOCK_BYTES."""
+    n_fft = frames.shape[-1]
+    out_dtype = np.complex64 if dtype == np.float32 else np.complex128
+    out = np.empty(frames.shape[:-1] + (1 + n_fft // 2,), dtype=out_dtype)
+
+    backend = get_backend() if backend is None else backend
+    channels = int(np.prod(frames.shape[:-2]))
+    step = max(1, MAX_BLOCK_BYTES // (8 * n_fft * max(1, channels)))
+    for f0 in range(0, frames.shape[-2], step):
+        backend.rfft(frames[..., f0 : f0 + step, :], window, out=out[..., f0 : f0 + step, :])
+    return np.swapaxes(out, -1, -2)
+
+
+def amplitude_to_db(magnitude: np.ndarray, ref, amin: float = AMIN, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    20 * log10(magnitude / ref) with magnitudes floored at amin, like
+    librosa.amplitude_to_db(magnitude, ref=ref, amin=amin, top_db=None).
+    Returns a new array unless out is given; out may be magnitude itself
+    (real), and the result is then computed in place without temporaries.
+    """
+    ref_power = np.abs(ref) ** 2
+    if out is None:
+        power = np.square(np.abs(magnitude))
+        db = 10.0 * np.log10(np.maximum(amin**2, power))
+    else:
+        db = np.abs(magnitude, out=out)
+        np.square(db, out=db)
+        np.maximum(db, amin**2, out=db)
+        np.log10(db, out=db)
+        db *= 10.0
+    db -= 10.0 * np.log10(np.maximum(amin**2, ref_power))
+    return db
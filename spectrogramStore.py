@@ -0,0 +1,268 @@
+# spectrogramStore.py
+"""
+Chunked on-disk store for dB spectrograms.
+
+A store file holds one (time, freq) matrix of dB values relative to the
+peak, as float32, float16 or uint8 (with scale and offset in the header).
+The matrix is split into fixed-size chunks of chunk_frames × chunk_bins
+values. Each chunk is contiguous on disk, so a time×frequency window only
+touches the chunks it overlaps. The data part is memory-mapped, and
+opening a store only reads its header.
+
+Layout: MAGIC, uint32 length of the JSON header, the JSON header, zero
+padding up to HEADER_SIZE bytes, then the chunk rows in time order. The
+last chunk row only holds the remaining frames, so short stores are not
+padded to a full chunk row.
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"WFSTORE1"
+HEADER_SIZE = 4096
+STORE_SUFFIX = ".wfs"
+STORE_DTYPES = ("float32", "float16", "uint8")
+
+# Chunk shape (frames × bins) and the lowest dB value that is kept
+DEFAULT_CHUNK_FRAMES = 256
+DEFAULT_CHUNK_BINS = 256
+DEFAULT_FLOOR_DB = -120.0
+
+
+class SpectrogramStore:
+    """
+    Read-only view of a store file. read() and slicing return float32 dB
+    values (time, freq) for a window, reading only the chunks it overlaps.
+
+    attrs holds what the writer recorded about the analysis: samplerate,
+    n_fft, win_length, hop_length and first_bin (the n_fft bin of column 0).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(len(MAGIC) + 4)
+            if len(head) < len(MAGIC) + 4 or head[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path}: not a spectrogram store")
+            (n,) = struct.unpack("<I", head[len(MAGIC) :])
+            header = json.loads(f.read(n).decode("utf-8"))
+
+        self.frames, self.bins = header["shape"]
+        self.chunk_frames, self.chunk_bins = header["chunks"]
+        self.dtype = np.dtype(header["dtype"])
+        self.scale = float(header["scale"])
+        self.offset = float(header["offset"])
+        self.floor_db = float(header["floor_db"])
+        self.attrs = header["attrs"]
+
+        # Full chunk rows, and the shorter last row
+        n_full, tail = divmod(self.frames, self.chunk_frames)
+        n_fc = -(-self.bins // self.chunk_bins)
+        self.__chunks = self.__map(HEADER_SIZE, (n_full, n_fc, self.chunk_frames, self.chunk_bins))
+        offset = HEADER_SIZE + self.__chunks.size * self.dtype.itemsize
+        self.__tail = self.__map(offset, (1, n_fc, tail, self.chunk_bins))
+
+    @property
+    def shape(self):
+        return (self.frames, self.bins)
+
+    def __len__(self) -> int:
+        return self.frames
+
+    @property
+    def samplerate(self) -> int:
+        return int(self.attrs["samplerate"])
+
+    @property
+    def n_fft(self) -> int:
+        return int(self.attrs["n_fft"])
+
+    @property
+    def hop_length(self) -> int:
+        return int(self.attrs["hop_length"])
+
+    @property
+    def first_bin(self) -> int:
+        return int(self.attrs.get("first_bin", 0))
+
+    def frequencies(self) -> np.ndarray:
+        """Center frequency (Hz) of each column."""
+        return (self.first_bin + np.arange(self.bins)) * (self.samplerate / self.n_fft)
+
+    def times(self) -> np.ndarray:
+        """Center time (s) of each row."""
+        return np.arange(self.frames) * (self.hop_length / self.samplerate)
+
+    def read(self, t0: int = 0, t1: int | None = None, f0: int = 0, f1: int | None = None) -> np.ndarray:
+        """dB values of rows [t0, t1) and columns [f0, f1) as float32 (time, freq)."""
+        t0, t1, _ = slice(t0, t1).indices(self.frames)
+        f0, f1, _ = slice(f0, f1).indices(self.bins)
+        if t1 <= t0 or f1 <= f0:
+            return np.zeros((max(0, t1 - t0), max(0, f1 - f0)), dtype=np.float32)
+
+        split = self.__chunks.shape[0] * self.chunk_frames
+        parts = []
+        if t0 < split:
+            parts.append(self.__read_chunks(self.__chunks, t0, min(t1, split), f0, f1))
+        if t1 > split:
+            parts.append(self.__read_chunks(self.__tail, max(t0, split) - split, t1 - split, f0, f1))
+        raw = parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+        if self.dtype == np.uint8:
+            data = raw.astype(np.float32)
+            data *= np.float32(self.scale)
+            data += np.float32(self.offset)
+            return data
+        return np.array(raw, dtype=np.float32)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2 or not all(isinstance(k, slice) for k in key):
+            raise TypeError("SpectrogramStore only supports slices, e.g. store[t0:t1, f0:f1]")
+        rows, cols = (key + (slice(None),))[:2]
+        t0, t1, t_step = rows.indices(self.frames)
+        f0, f1, f_step = cols.indices(self.bins)
+        if t_step < 0 or f_step < 0:
+            raise TypeError("SpectrogramStore does not support negative steps")
+        return self.read(t0, t1, f0, f1)[::t_step, ::f_step]
+
+    def __map(self, offset: int, shape: tuple) -> np.ndarray:
+        if 0 in shape:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", offset=offset, shape=shape)
+
+    def __read_chunks(self, chunks: np.ndarray, t0: int, t1: int, f0: int, f1: int) -> np.ndarray:
+        """Rows [t0, t1) and columns [f0, f1) of a (rows, cols, frames, bins) chunk grid."""
+        cf, cb = chunks.shape[2:]
+        ct0, cb0 = t0 // cf, f0 // cb
+        sub = chunks[ct0 : -(-t1 // cf), cb0 : -(-f1 // cb)]
+        block = sub.transpose(0, 2, 1, 3).reshape(sub.shape[0] * cf, sub.shape[1] * cb)
+        return block[t0 - ct0 * cf : t1 - ct0 * cf, f0 - cb0 * cb : f1 - cb0 * cb]
+
+    def iter_blocks(self, block_frames: int = DEFAULT_CHUNK_FRAMES, f0: int = 0, f1: int | None = None):
+        """Yield consecutive (time, freq) dB blocks of columns [f0, f1)."""
+        for t0 in range(0, self.frames, block_frames):
+            yield self.read(t0, min(t0 + block_frames, self.frames), f0, f1)
+
+
+class SpectrogramStoreWriter:
+    """
+    Writes a store row block by row block, e.g. straight from
+    WaterfallGenerator.iter_db. Values below floor_db are clipped; uint8
+    maps [floor_db, 0] dB linearly to 0..255.
+
+    The file is written under a temporary name and moved into place by
+    close(), so an interrupted write never leaves a truncated store behind.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        bins: int,
+        attrs: dict,
+        dtype: str = "float16",
+        floor_db: float = DEFAULT_FLOOR_DB,
+        chunk_frames: int = DEFAULT_CHUNK_FRAMES,
+        chunk_bins: int = DEFAULT_CHUNK_BINS,
+    ):
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"dtype must be one of {STORE_DTYPES}, got {dtype!r}")
+        if floor_db >= 0:
+            raise ValueError("floor_db must be < 0")
+        self.path = path
+        self.bins = int(bins)
+        self.attrs = dict(attrs)
+        self.dtype = np.dtype(dtype)
+        self.floor_db = float(floor_db)
+        self.chunk_frames = int(chunk_frames)
+        self.chunk_bins = int(chunk_bins)
+        if self.dtype == np.uint8:
+            self.scale, self.offset = -self.floor_db / 255.0, self.floor_db
+        else:
+            self.scale, self.offset = 1.0, 0.0
+
+        self.frames = 0
+        n_fc = -(-self.bins // self.chunk_bins)
+        self.__buffer = np.zeros((self.chunk_frames, n_fc * self.chunk_bins), dtype=self.dtype)
+        self.__buffered = 0
+        self.__tmp_path = path + ".part"
+        self.__file = open(self.__tmp_path, "wb")
+        self.__file.write(bytes(HEADER_SIZE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, db: np.ndarray) -> None:
+        """Append rows of dB values (time, bins)."""
+        if db.ndim != 2 or db.shape[1] != self.bins:
+            raise ValueError(f"expected (time, {self.bins}) block, got {db.shape}")
+        row = 0
+        while row < db.shape[0]:
+            n = min(db.shape[0] - row, self.chunk_frames - self.__buffered)
+            dst = self.__buffer[self.__buffered : self.__buffered + n, : self.bins]
+            dst[:] = self.__encode(db[row : row + n])
+            self.__buffered += n
+            row += n
+            if self.__buffered == self.chunk_frames:
+                self.__flush()
+        self.frames += db.shape[0]
+
+    def close(self) -> None:
+        if self.__file is None:
+            return
+        if self.__buffered:
+            self.__flush()
+
+        header = json.dumps(
+            {
+                "shape": [self.frames, self.bins],
+                "chunks": [self.chunk_frames, self.chunk_bins],
+                "dtype": self.dtype.name,
+                "scale": self.scale,
+                "offset": self.offset,
+                "floor_db": self.floor_db,
+                "attrs": self.attrs,
+            }
+        ).encode("utf-8")
+        if len(MAGIC) + 4 + len(header) > HEADER_SIZE:
+            self.abort()
+            raise ValueError("store header too large (attrs too big)")
+        self.__file.seek(0)
+        self.__file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.__file.close()
+        self.__file = None
+        os.replace(self.__tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Discard the partially written store."""
+        if self.__file is None:
+            return
+        self.__file.close()
+        self.__file = None
+        os.remove(self.__tmp_path)
+
+    def __encode(self, db: np.ndarray) -> np.ndarray:
+        data = np.clip(db, self.floor_db, 0.0)
+        if self.dtype == np.uint8:
+            return np.rint((data - self.offset) / self.scale).astype(np.uint8)
+        return data.astype(self.dtype, copy=False)
+
+    def __flush(self) -> None:
+        # one chunk row: (frames, n_fc * cb) -> n_fc contiguous chunks of (frames, cb)
+        chunks = self.__buffer[: self.__buffered].reshape(self.__buffered, -1, self.chunk_bins).transpose(1, 0, 2)
+        self.__file.write(np.ascontiguousarray(chunks).tobytes())
+        self.__buffered = 0
+
+
+def is_store_path(path: str) -> bool:
+    return path.lower().endswith(STORE_SUFFIX)
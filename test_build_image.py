@@ -0,0 +1,82 @@
+# test_build_image.py
+"""
+Regression test: build_image gives the same pixels as the original
+per-pixel false-color loop (librosa STFT, falseColorScreen per pixel).
+
+    python -m pytest test_build_image.py
+"""
+
+import numpy as np
+import pytest
+
+from falseColor import falseColorScreen
+from WaterfallGenerator import WaterfallGenerator
+
+librosa = pytest.importorskip("librosa")
+
+SAMPLERATE = 8000
+SECONDS = 3.0
+
+
+def reference_image_bytes(generator: WaterfallGenerator, samples: np.ndarray, samplerate: int) -> tuple:
+    """(size, RGB bytes) of the waterfall as the former per-pixel loop built it."""
+    D = librosa.stft(
+        samples,
+        n_fft=generator.n_fft,
+        win_length=generator.win_length,
+        hop_length=generator.hop_length,
+    )
+    data = librosa.amplitude_to_db(np.abs(D), ref=np.max, top_db=generator.dynamic_db)
+    data = np.swapaxes(data, 1, 0)
+    t_size, f_size = data.shape
+
+    if generator.bandwidth_hz is not None:
+        nyquist = samplerate / 2.0
+        bandwidth = min(float(generator.bandwidth_hz), nyquist)
+        fcut = int((f_size - 1) * bandwidth / nyquist)
+        fcut = max(0, min(fcut, f_size - 1))
+        data = data[:, : fcut + 1]
+        t_size, f_size = data.shape
+
+    dataRgb = bytearray(3 * f_size * t_size)
+    scale = 255.0 / generator.dynamic_db
+    i = 0
+    for pixel in data.flat:
+        value = int(pixel * scale + 255.0)
+        if value > 255:
+            value = 255
+        dataRgb[i : i + 3] = falseColorScreen(value)
+        i += 3
+    return (f_size, t_size), bytes(dataRgb)
+
+
+def make_signal(kind: str) -> np.ndarray:
+    t = np.arange(int(SECONDS * SAMPLERATE)) / SAMPLERATE
+    if kind == "tone":
+        y = 0.5 * np.sin(2 * np.pi * 440.0 * t)
+    elif kind == "noise":
+        y = 0.1 * np.random.default_rng(0).standard_normal(len(t))
+    else:  # chirp from 100 Hz to 3500 Hz
+        y = 0.5 * np.sin(2 * np.pi * (100.0 * t + (3500.0 - 100.0) * t * t / (2.0 * SECONDS)))
+    return y.astype(np.float32)
+
+
+@pytest.mark.parametrize("kind", ["tone", "noise", "chirp"])
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"n_fft": 2048, "win_length": 1024, "hop_length": 256, "bandwidth_hz": 1000},
+        {"n_fft": 4096, "win_length": 4096, "hop_length": 512, "bandwidth_hz": None},
+        {"n_fft": 1024, "win_length": 512, "hop_length": 128, "bandwidth_hz": 3000, "dynamic_db": 60},
+    ],
+)
+def test_build_image_matches_per_pixel_loop(kind, params):
+    generator = WaterfallGenerator(cache_bytes=0, **params)
+    samples = make_signal(kind)
+
+    img = generator.build_image(samples, SAMPLERATE)
+    size, expected = reference_image_bytes(generator, samples, SAMPLERATE)
+
+    assert img.mode == "RGB"
+    assert img.size == size
+    assert img.tobytes() == expected
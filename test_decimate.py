@@ -0,0 +1,60 @@
+# test_decimate.py
+"""
+Band-limited analysis (decimate=True) must keep the image geometry of the
+full-rate STFT: same number of rows and columns, so that row -> time and
+column -> frequency mappings, pyramids and tiles agree between the paths.
+Its dB reference is the peak of the full band, as in the full-rate render,
+unless band_peak_reference is set.
+
+    python -m pytest test_decimate.py
+"""
+
+import numpy as np
+import pytest
+
+from WaterfallGenerator import WaterfallGenerator
+
+SAMPLERATE = 48000
+
+
+@pytest.mark.parametrize("n_samples", [700, 701, 4000, 3 * SAMPLERATE + 17])
+@pytest.mark.parametrize("band", [{"band_hz": (500.0, 900.0)}, {"bandwidth_hz": 3000}])
+def test_decimated_image_has_full_rate_geometry(n_samples, band):
+    samples = np.random.default_rng(0).standard_normal(n_samples).astype(np.float32)
+    params = {"n_fft": 512, "win_length": 512, "hop_length": 64, **band}
+
+    full_rate = WaterfallGenerator(cache_bytes=0, **params)
+    decimated = WaterfallGenerator(cache_bytes=0, decimate=True, **params)
+    assert decimated._analysis(SAMPLERATE)[0] > 1
+
+    expected = full_rate.render_levels(samples, SAMPLERATE).shape
+    assert expected[0] == full_rate.n_frames(n_samples)
+    assert decimated.render_levels(samples, SAMPLERATE).shape == expected
+
+
+@pytest.mark.parametrize("band", [{"band_hz": (2000.0, 2600.0)}, {"bandwidth_hz": 3000}])
+def test_decimated_levels_use_full_band_peak(band):
+    # The strongest tone lies outside band_hz
+    t = np.arange(3 * SAMPLERATE) / SAMPLERATE
+    noise = 0.001 * np.random.default_rng(0).standard_normal(len(t))
+    samples = (0.8 * np.sin(2 * np.pi * 700.0 * t) + 0.05 * np.sin(2 * np.pi * 2300.0 * t) + noise).astype(np.float32)
+    params = {"n_fft": 4096, "win_length": 4096, "hop_length": 512, **band}
+
+    expected = WaterfallGenerator(cache_bytes=0, **params).render_levels(samples, SAMPLERATE).astype(int)
+    decimated = WaterfallGenerator(cache_bytes=0, decimate=True, **params)
+    assert decimated._analysis(SAMPLERATE)[0] > 1
+
+    diff = np.abs(decimated.render_levels(samples, SAMPLERATE).astype(int) - expected)
+    assert np.median(diff) == 0
+    assert np.percentile(diff, 99) <= 10
+
+
+def test_band_peak_reference_uses_in_band_peak():
+    t = np.arange(3 * SAMPLERATE) / SAMPLERATE
+    samples = (0.8 * np.sin(2 * np.pi * 700.0 * t) + 0.05 * np.sin(2 * np.pi * 2300.0 * t)).astype(np.float32)
+    params = {"n_fft": 4096, "win_length": 4096, "hop_length": 512, "band_hz": (2000.0, 2600.0), "decimate": True}
+
+    full_band = WaterfallGenerator(cache_bytes=0, **params).render_levels(samples, SAMPLERATE)
+    in_band = WaterfallGenerator(cache_bytes=0, band_peak_reference=True, **params).render_levels(samples, SAMPLERATE)
+    assert in_band.max() == 255
+    assert full_band.max() < 255
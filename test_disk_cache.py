@@ -0,0 +1,66 @@
+# test_disk_cache.py
+"""
+Disk cache of memory-mapped recordings: opening and rendering a file that
+was never hashed does not read it for its digest; the spectrogram is stored
+once it has been hashed in the background, and found when the file is
+opened again.
+
+    python -m pytest test_disk_cache.py
+"""
+
+import time
+import wave
+
+import numpy as np
+
+import diskCache
+from audioSource import MemmapAudio, open_audio
+from WaterfallGenerator import RenderStats, WaterfallGenerator
+
+SAMPLERATE = 8000
+PARAMS = {"n_fft": 1024, "win_length": 1024, "hop_length": 256, "bandwidth_hz": 2000}
+
+
+def write_wav(path, seconds: float = 2.0) -> None:
+    t = np.arange(int(seconds * SAMPLERATE)) / SAMPLERATE
+    pcm = (0.5 * 32767 * np.sin(2 * np.pi * 440.0 * t)).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLERATE)
+        f.writeframes(pcm.tobytes())
+
+
+def test_memmap_render_does_not_hash_until_stored(tmp_path, monkeypatch):
+    hashed = []
+    file_digest = diskCache.file_digest
+    monkeypatch.setattr(diskCache, "file_digest", lambda path: hashed.append(path) or file_digest(path))
+
+    path = tmp_path / "tone.wav"
+    write_wav(path)
+    cache = diskCache.DiskCache(str(tmp_path / "cache"))
+
+    samples, samplerate = open_audio(str(path), cache)
+    assert isinstance(samples, MemmapAudio)
+    assert cache.get_magnitude(samples, ("any",)) is None
+    assert hashed == []
+
+    levels = WaterfallGenerator(cache_bytes=0, disk_cache=cache, **PARAMS).render_levels(samples, samplerate)
+
+    # The first lookup missed without hashing; storing hashes in the background
+    deadline = time.monotonic() + 10.0
+    while cache.known_digest(str(path)) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert hashed == [str(path)]
+
+    # The entry is complete once its marker is written
+    while not list((tmp_path / "cache").glob("mag-*.json")):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    reopened, _ = open_audio(str(path), cache)
+    stats = RenderStats()
+    again = WaterfallGenerator(cache_bytes=0, disk_cache=cache, **PARAMS).render_levels(reopened, samplerate, stats=stats)
+    assert stats.info["disk_cache_hit"]
+    assert np.array_equal(again, levels)
+    assert hashed == [str(path)]
@@ -0,0 +1,58 @@
+# test_low_memory.py
+"""
+Low-memory mode: same levels as the default mode for float32 audio, and
+peak memory (tracemalloc) bounded by a small multiple of the uint8 level
+matrix.
+
+    python -m pytest test_low_memory.py
+"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from WaterfallGenerator import WaterfallGenerator
+
+SAMPLERATE = 48000
+PARAMS = {"n_fft": 16384, "win_length": 16384, "hop_length": 512, "bandwidth_hz": 3000}
+
+
+def traced_peak(fn) -> tuple:
+    """(result of fn(), peak traced allocation in bytes while it ran)."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture(scope="module")
+def samples() -> np.ndarray:
+    t = np.arange(60 * SAMPLERATE) / SAMPLERATE
+    noise = 0.01 * np.random.default_rng(0).standard_normal(len(t))
+    return (0.3 * np.sin(2 * np.pi * 700.0 * t) + noise).astype(np.float32)
+
+
+def test_low_memory_levels_equal_default(samples):
+    default = WaterfallGenerator(cache_bytes=0, **PARAMS).render_levels(samples, SAMPLERATE)
+    low = WaterfallGenerator(cache_bytes=0, low_memory=True, **PARAMS).render_levels(samples, SAMPLERATE)
+    np.testing.assert_array_equal(low, default)
+
+
+def test_low_memory_peak(samples):
+    default = WaterfallGenerator(cache_bytes=0, **PARAMS)
+    _, default_peak = traced_peak(lambda: default.render_levels(samples, SAMPLERATE))
+
+    generator = WaterfallGenerator(low_memory=True, **PARAMS)
+    levels, render_peak = traced_peak(lambda: generator.render_levels(samples, SAMPLERATE))
+    # A whole render holds the float32 magnitudes of the displayed bins (4x
+    # the levels) plus one block of STFT frames
+    assert render_peak <= 16 * levels.nbytes
+    assert render_peak < default_peak / 2
+
+    # With the magnitudes cached, dB conversion and quantization run in place
+    _, levels_peak = traced_peak(lambda: generator.render_levels(samples, SAMPLERATE))
+    assert generator.last_stats.info["cache_hit"]
+    assert levels_peak <= 2 * levels.nbytes
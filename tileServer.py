@@ -0,0 +1,525 @@
+# tileServer.py
+"""
+Local HTTP server that shows waterfalls in a browser, as map-style tiles.
+
+Example:
+    python tileServer.py "recordings/*.wav" --port 8000
+    then open http://127.0.0.1:8000/
+
+Routes:
+    /                             viewer page
+    /files                        JSON list of the served files
+    /info/<file>                  JSON: image size, zoom levels, time/frequency scale
+    /tiles/<file>/<z>/<x>/<y>.png tile x (frequency) of row y (time) at zoom z
+
+Zoom z = 0 fits the whole waterfall into one tile, each further level
+doubles the resolution, and the highest level shows one STFT frame and
+frequency bin per pixel. Tiles are TILE_SIZE pixels square, except at the
+right and bottom edges, where they end with the image.
+
+Each recording is rendered once, with bounded working memory
+(WaterfallGenerator.iter_level_blocks), when the first of its tiles is
+requested; all viewers share its uint8 level matrix and the max-pooled
+overview levels. Tiles are cut and encoded on demand in a thread pool,
+with concurrent requests for the same tile waiting for one render. Encoded
+tiles are kept in memory (LRU) and in the disk cache. Every tile has an
+ETag derived from the file content, the rendering parameters and the tile
+position, so conditional requests are answered with 304 without a render.
+
+The server binds to 127.0.0.1 unless --host says otherwise.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from audioSource import open_audio
+from batchRender import _positive_power_of_two, expand_inputs
+from diskCache import DEFAULT_DISK_CACHE_BYTES, DiskCache
+from falseColor import PALETTES
+from numpyStft import FFT_BACKENDS, backend_available
+from WaterfallGenerator import RenderStats, WaterfallGenerator, array_to_image, max_pool2
+
+# Edge length of the tiles (pixels)
+TILE_SIZE = 256
+
+# Bump when the tile images change for the same parameters, to invalidate
+# cached tiles and the ETags clients hold
+TILE_VERSION = 1
+
+DEFAULT_TILE_MEMORY_BYTES = 64 * 1024**2
+
+tiles_logger = logging.getLogger("waterfall.tiles")
+
+_VIEWER_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>STFT Waterfall</title>
+<style>
+body { margin: 0; font: 14px sans-serif; }
+#bar { padding: 6px; background: #eee; }
+#view { position: absolute; top: 36px; bottom: 0; left: 0; right: 0; overflow: auto; background: #000; }
+#plane { position: relative; }
+#plane img { position: absolute; image-rendering: pixelated; }
+</style></head>
+<body>
+<div id="bar"><select id="file"></select> <button id="out">-</button> <button id="in">+</button> <span id="status"></span></div>
+<div id="view"><div id="plane"></div></div>
+<script>
+const view = document.getElementById("view"), plane = document.getElementById("plane");
+const status = document.getElementById("status"), select = document.getElementById("file");
+let info = null, zoom = 0, shown = new Set();
+
+function show() {
+  if (!info) return;
+  const scale = 2 ** (info.max_zoom - zoom), t = info.tile_size;
+  const w = Math.ceil(info.width / scale), h = Math.ceil(info.height / scale);
+  plane.style.width = w + "px"; plane.style.height = h + "px";
+  const x0 = Math.floor(view.scrollLeft / t), x1 = Math.min(Math.ceil(w / t), Math.ceil((view.scrollLeft + view.clientWidth) / t));
+  const y0 = Math.floor(view.scrollTop / t), y1 = Math.min(Math.ceil(h / t), Math.ceil((view.scrollTop + view.clientHeight) / t));
+  for (let y = y0; y < y1; y++) for (let x = x0; x < x1; x++) {
+    const key = zoom + "/" + x + "/" + y;
+    if (shown.has(key)) continue;
+    shown.add(key);
+    const img = document.createElement("img");
+    img.src = "tiles/" + encodeURIComponent(info.name) + "/" + key + ".png";
+    img.style.left = x * t + "px"; img.style.top = y * t + "px";
+    plane.appendChild(img);
+  }
+  status.textContent = "zoom " + zoom + "/" + info.max_zoom + ", " + info.width + " x " + info.height;
+}
+
+function setZoom(z) {
+  zoom = Math.max(0, Math.min(info.max_zoom, z));
+  plane.replaceChildren(); shown.clear(); show();
+}
+
+async function open(name) {
+  status.textContent = "rendering " + name + " ...";
+  const r = await fetch("info/" + encodeURIComponent(name));
+  if (!r.ok) { status.textContent = name + ": " + r.statusText; return; }
+  info = await r.json(); setZoom(0);
+}
+
+view.onscroll = show; window.onresize = show;
+document.getElementById("in").onclick = () => setZoom(zoom + 1);
+document.getElementById("out").onclick = () => setZoom(zoom - 1);
+select.onchange = () => open(select.value);
+fetch("files").then(r => r.json()).then(files => {
+  for (const f of files) select.add(new Option(f.name, f.name));
+  if (files.length) open(files[0].name);
+});
+</script></body></html>
+"""
+
+
+class TileCache:
+    """LRU cache of encoded tiles (ETag -> bytes) with a memory cap in bytes. Thread-safe."""
+
+    def __init__(self, max_bytes: int = DEFAULT_TILE_MEMORY_BYTES):
+        self.max_bytes = int(max_bytes)
+        self.__entries = OrderedDict()
+        self.__nbytes = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self.__nbytes
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, etag: str) -> bytes | None:
+        with self.__lock:
+            data = self.__entries.get(etag)
+            if data is not None:
+                self.__entries.move_to_end(etag)
+            return data
+
+    def put(self, etag: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self.__lock:
+            old = self.__entries.pop(etag, None)
+            if old is not None:
+                self.__nbytes -= len(old)
+            while self.__entries and self.__nbytes + len(data) > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__nbytes -= len(evicted)
+            self.__entries[etag] = data
+            self.__nbytes += len(data)
+
+
+class TileSource:
+    """
+    One recording: its uint8 level matrix (time, freq), rendered on first
+    use, and the max-pooled overview levels, each computed once and shared
+    by all requests. Thread-safe.
+    """
+
+    def __init__(self, path: str, generator: WaterfallGenerator, disk_cache: DiskCache | None = None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.generator = generator
+        self.disk_cache = disk_cache
+        self.samplerate = None
+        self.__digest = None
+        self.__levels = []  # pyramid levels rendered so far, full resolution first
+        self.__lock = threading.Lock()
+
+    @property
+    def digest(self) -> str:
+        """Content digest of the file (a stat stamp without disk cache), computed once."""
+        if self.__digest is None:
+            if self.disk_cache is not None:
+                self.__digest = self.disk_cache.digest(self.path)
+            else:
+                st = os.stat(self.path)
+                stamp = f"{os.path.abspath(self.path)}|{st.st_size}|{st.st_mtime_ns}"
+                self.__digest = hashlib.sha256(stamp.encode("utf-8")).hexdigest()
+        return self.__digest
+
+    @property
+    def rendered(self) -> bool:
+        return bool(self.__levels)
+
+    @property
+    def max_zoom(self) -> int:
+        """Zoom level of the full-resolution levels; zoom 0 fits into one tile."""
+        height, width = self.levels(0).shape
+        return max(0, int(np.ceil(np.log2(max(height, width) / TILE_SIZE))))
+
+    def levels(self, level: int) -> np.ndarray:
+        """Pyramid level (0 = full resolution, each further level max-pooled by 2)."""
+        with self.__lock:
+            if not self.__levels:
+                self.__levels.append(self.__render())
+            while len(self.__levels) <= level:
+                self.__levels.append(max_pool2(self.__levels[-1]))
+            return self.__levels[level]
+
+    def info(self) -> dict:
+        height, width = self.levels(0).shape
+        seconds_per_row, hz_first, hz_per_column = self.generator.pixel_scale(self.samplerate)
+        return {
+            "name": self.name,
+            "width": width,
+            "height": height,
+            "tile_size": TILE_SIZE,
+            "max_zoom": self.max_zoom,
+            "samplerate": self.samplerate,
+            "seconds_per_row": seconds_per_row,
+            "hz_first_column": hz_first,
+            "hz_per_column": hz_per_column,
+        }
+
+    def __render(self) -> np.ndarray:
+        stats = RenderStats()
+        stats.info["file"] = self.path
+        t = time.perf_counter()
+        samples, samplerate = open_audio(self.path, self.disk_cache)
+        stats.lap("decode", t)
+        # Copy the blocks into place as they come, rather than collecting and
+        # concatenating them, which holds the levels twice
+        levels = None
+        filled = 0
+        for block in self.generator.iter_level_blocks(samples, int(samplerate), stats=stats):
+            if levels is None:
+                levels = np.empty((self.generator.n_frames(len(samples)), block.shape[1]), dtype=np.uint8)
+            levels[filled : filled + len(block)] = block
+            filled += len(block)
+        self.samplerate = int(samplerate)
+        tiles_logger.info("rendered %s: %d x %d, %s", self.name, levels.shape[1], levels.shape[0], stats.summary())
+        return levels
+
+
+class TileServer(ThreadingHTTPServer):
+    """
+    HTTP server for the tiles of the given recordings (see the module
+    docstring for the routes). Tiles are rendered by a pool of workers
+    threads; memory_bytes caps the in-memory tile cache, and disk_cache (a
+    diskCache.DiskCache) keeps encoded tiles across restarts.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        paths: list[str],
+        generator: WaterfallGenerator | None = None,
+        address: tuple = ("127.0.0.1", 0),
+        workers: int = 4,
+        memory_bytes: int = DEFAULT_TILE_MEMORY_BYTES,
+        disk_cache: DiskCache | None = None,
+    ):
+        self.generator = WaterfallGenerator(cache_bytes=0) if generator is None else generator
+        self.disk_cache = disk_cache
+        self.sources = {}
+        for path in paths:
+            source = TileSource(path, self.generator, disk_cache)
+            if source.name in self.sources:
+                raise ValueError(f"{path} and {self.sources[source.name].path} have the same file name")
+            self.sources[source.name] = source
+
+        self.tiles = TileCache(memory_bytes)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="tile")
+        self.__pending = {}  # ETag -> Future of a tile being rendered
+        self.__lock = threading.Lock()
+        self.__params = self.__render_params()
+        super().__init__(address, TileRequestHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def preload(self) -> None:
+        """Render all recordings in the background, instead of on their first request."""
+        for source in self.sources.values():
+            self.pool.submit(source.levels, 0)
+
+    def etag(self, source: TileSource, z: int, x: int, y: int) -> str:
+        """Strong validator of a tile: changes with the file content and the rendering parameters."""
+        text = json.dumps([TILE_VERSION, source.digest, self.__params, z, x, y])
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+    def tile(self, source: TileSource, z: int, x: int, y: int, etag: str) -> bytes | None:
+        """PNG of a tile, or None if it lies outside the waterfall."""
+        data = self.tiles.get(etag)
+        if data is not None:
+            return data
+        with self.__lock:
+            future = self.__pending.get(etag)
+            if future is None:
+                future = self.__pending[etag] = self.pool.submit(self._load_tile, source, z, x, y)
+        try:
+            data = future.result()
+        finally:
+            with self.__lock:
+                if self.__pending.get(etag) is future:
+                    del self.__pending[etag]
+        if data is not None:
+            self.tiles.put(etag, data)
+        return data
+
+    def _load_tile(self, source: TileSource, z: int, x: int, y: int) -> bytes | None:
+        key = (TILE_VERSION, self.__params, z, x, y)
+        if self.disk_cache is not None:
+            data = self.disk_cache.get_tile(source.digest, key)
+            if data is not None:
+                return data
+        data = self._render_tile(source, z, x, y)
+        if data is not None and self.disk_cache is not None:
+            self.disk_cache.put_tile(source.digest, key, data)
+        return data
+
+    def _render_tile(self, source: TileSource, z: int, x: int, y: int) -> bytes | None:
+        level = source.max_zoom - z
+        if level < 0 or x < 0 or y < 0:
+            return None
+        levels = source.levels(level)
+        if y * TILE_SIZE >= levels.shape[0] or x * TILE_SIZE >= levels.shape[1]:
+            return None
+        tile = levels[y * TILE_SIZE : (y + 1) * TILE_SIZE, x * TILE_SIZE : (x + 1) * TILE_SIZE]
+        buf = io.BytesIO()
+        array_to_image(tile, self.generator.palette_table).save(buf, format="PNG")
+        return buf.getvalue()
+
+    def __render_params(self) -> str:
+        """Everything that changes the pixels of a tile, as one string."""
+        g = self.generator
+        return json.dumps(
+            {
+                "tile_size": TILE_SIZE,
+                "dynamic_db": g.dynamic_db,
+                "n_fft": g.n_fft,
+                "win_length": g.win_length,
+                "hop_length": g.hop_length,
+                "bandwidth_hz": g.bandwidth_hz,
+                "decimate": g.decimate,
+                "band_peak_reference": g.band_peak_reference,
+                "band_hz": g.band_hz,
+                "palette": hashlib.sha256(g.palette_table.tobytes()).hexdigest(),
+            },
+            sort_keys=True,
+        )
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so a viewer reuses its connections
+    server: TileServer
+
+    def do_GET(self):
+        self.__handle(send_body=True)
+
+    def do_HEAD(self):
+        self.__handle(send_body=False)
+
+    def log_message(self, format, *args):
+        tiles_logger.debug("%s %s", self.address_string(), format % args)
+
+    def __handle(self, send_body: bool) -> None:
+        parts = [unquote(p) for p in self.path.split("?", 1)[0].split("/")[1:]]
+        try:
+            if parts == [""]:
+                self.__send(HTTPStatus.OK, "text/html; charset=utf-8", _VIEWER_PAGE.encode("utf-8"), send_body)
+            elif parts == ["files"]:
+                files = [{"name": s.name, "rendered": s.rendered} for s in self.server.sources.values()]
+                self.__send_json(files, send_body)
+            elif len(parts) == 2 and parts[0] == "info" and parts[1] in self.server.sources:
+                self.__send_json(self.server.sources[parts[1]].info(), send_body)
+            elif len(parts) == 5 and parts[0] == "tiles" and parts[1] in self.server.sources:
+                self.__send_tile(self.server.sources[parts[1]], parts[2:], send_body)
+            else:
+                self.__send_error(HTTPStatus.NOT_FOUND, send_body)
+        except ConnectionError:
+            raise  # the client went away
+        except (OSError, ValueError) as e:
+            # unreadable or undecodable recording
+            tiles_logger.warning("%s: %s", self.path, e)
+            self.__send_error(HTTPStatus.INTERNAL_SERVER_ERROR, send_body)
+
+    def __send_tile(self, source: TileSource, zxy: list[str], send_body: bool) -> None:
+        z, x, y = zxy
+        if not y.endswith(".png") or not all(s.isdigit() for s in (z, x, y[:-4])):
+            self.__send_error(HTTPStatus.NOT_FOUND, send_body)
+            return
+        z, x, y = int(z), int(x), int(y[:-4])
+
+        etag = f'"{self.server.etag(source, z, x, y)}"'
+        if self.__matches(etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return
+
+        data = self.server.tile(source, z, x, y, etag.strip('"'))
+        if data is None:
+            self.__send_error(HTTPStatus.NOT_FOUND, send_body)
+            return
+        # no-cache: browsers keep the tile but revalidate it with If-None-Match
+        self.__send(HTTPStatus.OK, "image/png", data, send_body, {"ETag": etag, "Cache-Control": "no-cache"})
+
+    def __matches(self, etag: str) -> bool:
+        """True if the request's If-None-Match lists etag (weak comparison, as for GET)."""
+        header = self.headers.get("If-None-Match")
+        if header is None:
+            return False
+        tags = [t.strip() for t in header.split(",")]
+        return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+    def __send_json(self, value, send_body: bool) -> None:
+        self.__send(HTTPStatus.OK, "application/json", json.dumps(value).encode("utf-8"), send_body)
+
+    def __send_error(self, status: HTTPStatus, send_body: bool) -> None:
+        self.__send(status, "text/plain; charset=utf-8", f"{status.value} {status.phrase}\n".encode("utf-8"), send_body)
+
+    def __send(self, status: HTTPStatus, content_type: str, body: bytes, send_body: bool, headers=None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = WaterfallGenerator()
+    parser = argparse.ArgumentParser(description="Serve waterfall tiles of audio files over HTTP.")
+    parser.add_argument("inputs", nargs="+", help="audio files or glob patterns")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="tile rendering threads")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_TILE_MEMORY_BYTES >> 20, help="in-memory tile cache")
+    parser.add_argument("--cache-dir", help="disk cache for decoded audio and tiles (default: the GUI's)")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_DISK_CACHE_BYTES >> 20, help="disk cache size limit")
+    parser.add_argument("--preload", action="store_true", help="render all files at startup, not on first view")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    parser.add_argument("--palette", choices=sorted(PALETTES), default="screen", help="false colors (default: %(default)s)")
+    parser.add_argument("--dynamic-db", type=float, default=defaults.dynamic_db)
+    parser.add_argument("--n-fft", type=_positive_power_of_two, default=defaults.n_fft)
+    parser.add_argument("--win-length", type=_positive_power_of_two, default=defaults.win_length)
+    parser.add_argument("--hop-length", type=_positive_power_of_two, default=defaults.hop_length)
+    bw = parser.add_mutually_exclusive_group()
+    bw.add_argument("--bandwidth-hz", type=float, default=defaults.bandwidth_hz)
+    bw.add_argument("--no-bandwidth-limit", action="store_true", help="keep all frequencies up to Nyquist")
+    parser.add_argument(
+        "--fft-backend", choices=("auto", *FFT_BACKENDS), default="numpy",
+        help="FFT implementation (default: %(default)s)",
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.dynamic_db <= 0:
+        parser.error("--dynamic-db must be > 0")
+    if args.win_length > args.n_fft:
+        parser.error("--win-length must be <= --n-fft")
+    if args.workers < 1:
+        parser.error("--workers must be >= 1")
+    if args.memory_mb < 0 or args.cache_mb < 0:
+        parser.error("--memory-mb and --cache-mb must be >= 0")
+    if args.fft_backend != "auto" and not backend_available(args.fft_backend):
+        parser.error(f"--fft-backend {args.fft_backend} is not installed")
+
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        print("No input files found.", file=sys.stderr)
+        return 1
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
+    generator = WaterfallGenerator(
+        dynamic_db=args.dynamic_db,
+        n_fft=args.n_fft,
+        win_length=args.win_length,
+        hop_length=args.hop_length,
+        bandwidth_hz=None if args.no_bandwidth_limit else args.bandwidth_hz,
+        palette=args.palette,
+        cache_bytes=0,
+        fft_backend=args.fft_backend,
+    )
+    disk_cache = DiskCache(args.cache_dir, args.cache_mb << 20)
+    try:
+        server = TileServer(
+            inputs, generator, (args.host, args.port), args.workers, args.memory_mb << 20, disk_cache
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    if args.preload:
+        server.preload()
+
+    print(f"Serving {len(server.sources)} file(s) at {server.url}")
+    for name in server.sources:
+        print(f"  {server.url}info/{quote(name)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())